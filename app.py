@@ -1,8 +1,12 @@
 import streamlit as st
 import backend as bk
-import pandas as pd
+import io
 import os
+import tempfile
 import auth
+import export
+import metrics
+import storage
 
 # ---------------- PAGE CONFIG -----------------
 st.set_page_config(page_title="Centralized LMS", page_icon="🎓", layout="wide")
@@ -16,15 +20,71 @@ for key, default in {"login": False, "user_id": None, "role": None}.items():
 st.title("🎓 Centralized LMS Platform")
 st.caption("Empowering Learning with Analytics, Engagement, and AI-driven Efficiency")
 
+LEADERBOARD_SIZE = 10
+GRADING_PAGE_SIZE = 20
+COURSE_PAGE_SIZE = 50
+REPORT_PAGE_SIZE = 50
+SPOOL_BYTES = 8 * 2**20   # exports larger than this are spooled to disk
+
+# ---------------- STARTUP -----------------
+bk.init()   # migrates once per process; a no-op on every rerun after that
+bk.start_pdf_pipeline()   # background PDF text/preview extraction; needs PyMuPDF
+
 # ---------------- HELPER -----------------
-def save_pdf(uploaded_file, folder):
-    """Save PDF locally and return file path."""
-    if uploaded_file is not None:
-        path = os.path.join(folder, uploaded_file.name)
-        with open(path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return path
-    return None
+def dataframe(*args, **kwargs):
+    """pandas.DataFrame, imported on first use so the login page never loads pandas."""
+    import pandas as pd
+    return pd.DataFrame(*args, **kwargs)
+
+
+def pdf_download(label, path, file_name, size, key):
+    """
+    Download button whose payload is read only after the student asks for it,
+    so a page render never touches the PDFs themselves.
+    """
+    size_text = f" ({size / 1024:.0f} KB)" if size else ""
+    if st.session_state.get(key) or st.button(f"{label}{size_text}", key=f"{key}_load"):
+        st.session_state[key] = True
+        st.download_button(f"⬇️ Save {file_name}", storage.read_file(path), file_name=file_name,
+                           mime="application/pdf", key=key + "_save")
+
+def pdf_details(items, path_index):
+    """{file_path: (pages, preview_png)} for the processed PDFs among `items`."""
+    paths = tuple(item[path_index] for item in items if item[path_index])
+    return {path: (pages, preview) for path, pages, preview in bk.get_pdf_details(paths)} if paths else {}
+
+
+def pdf_preview(details, path, key):
+    """Page count and first-page preview once the background pipeline has processed the PDF."""
+    if path not in details:
+        return
+    pages, preview = details[path]
+    st.caption(f"{pages} page{'s' if pages != 1 else ''}")
+    if preview and st.toggle("👁️ Preview first page", key=key):
+        st.image(preview)
+
+
+def material_search(cid, key):
+    """Full-text search inside the course's PDFs."""
+    query = st.text_input("🔎 Search inside course materials", key=key)
+    if query:
+        hits = bk.search_materials(cid, query)
+        for kind, item_id, title, snippet in hits:
+            st.markdown(f"- **{kind.title()}** {title or ''}: {snippet}")
+        if not hits:
+            st.info("No material mentions that.")
+
+def spooled(chunks):
+    """
+    Write streamed export chunks to a SpooledTemporaryFile (memory up to
+    SPOOL_BYTES, then disk) and return it as a readable file for
+    st.download_button, instead of joining the export into one bytes object.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return io.BufferedReader(spool)
 
 # ---------------- LOGIN / SIGNUP -----------------
 def login_form():
@@ -81,11 +141,11 @@ def student_dashboard(uid):
     if nav == "🏠 Dashboard":
         st.subheader("📊 Your Learning Analytics")
 
-        enrolled_courses = bk.get_enrolled_courses(uid)
-        total_courses = len(enrolled_courses)
-        total_assignments = sum([len(bk.get_assignments(c[0])) for c in enrolled_courses])
-        total_exams = sum([len(bk.get_exams(c[0])) for c in enrolled_courses])
-        points = bk.get_user_points(uid)
+        summary = bk.get_student_summary(uid)
+        total_courses = len(summary["courses"])
+        total_assignments = summary["assignments"]
+        total_exams = summary["exams"]
+        points = summary["points"]
 
         col1, col2, col3, col4 = st.columns(4)
         col1.metric("Courses Enrolled", total_courses)
@@ -95,31 +155,39 @@ def student_dashboard(uid):
 
         st.divider()
         st.write("### Progress Overview")
-        progress_data = bk.get_course_progress(uid)
+        progress_data = summary["progress"]
         if progress_data:
-            df = pd.DataFrame(progress_data, columns=["Course", "Progress %"])
+            df = dataframe(progress_data, columns=["Course", "Progress %"])
             st.bar_chart(df.set_index("Course"))
         else:
             st.info("No progress data available yet.")
 
     # ---------------- Enroll -----------------
     elif nav == "📚 Enroll":
-        all_courses = bk.get_courses()
-        enrolled = [c[0] for c in bk.get_enrolled_courses(uid)]
-        available = [c for c in all_courses if c[0] not in enrolled]
-
         st.subheader("📘 Available Courses")
         search = st.text_input("🔍 Search Courses")
-        filtered = [c for c in available if search.lower() in c[1].lower()] if search else available
+        cursor_key = f"enroll_after_{search}"
+        after = st.session_state.get(cursor_key, 0)
+        results, next_cursor = bk.search_courses(uid, search, COURSE_PAGE_SIZE, after)
 
-        if filtered:
-            choice = st.selectbox("Select Course to Enroll", [c[1] for c in filtered])
+        if results:
+            choice = st.selectbox("Select Course to Enroll", [c[1] for c in results])
             if st.button("Enroll Now"):
-                cid = [c[0] for c in filtered if c[1] == choice][0]
+                cid = [c[0] for c in results if c[1] == choice][0]
                 bk.enroll_course(uid, cid)
                 st.success(f"✅ Enrolled in {choice}")
                 st.toast(f"🎉 Successfully enrolled in {choice}!", icon="🎓")
                 st.rerun()
+            col1, col2 = st.columns(2)
+            if after and col1.button("⬅️ First page"):
+                st.session_state[cursor_key] = 0
+                st.rerun()
+            if next_cursor is not None and col2.button("Next page ➡️"):
+                st.session_state[cursor_key] = next_cursor
+                st.rerun()
+        elif after:
+            st.session_state[cursor_key] = 0
+            st.rerun()
         else:
             st.info("No matching or available courses found.")
 
@@ -139,13 +207,15 @@ def student_dashboard(uid):
         if enrolled:
             course = st.selectbox("Select Course", [c[1] for c in enrolled])
             cid = [c[0] for c in enrolled if c[1] == course][0]
+            material_search(cid, "search_assign")
             assignments = bk.get_assignments(cid)
             if assignments:
+                details = pdf_details(assignments, 2)
                 for a in assignments:
                     st.markdown(f"### 📘 {a[1]}")
                     if a[2]:
-                        with open(a[2], "rb") as f:
-                            st.download_button("📄 Download Assignment PDF", f, file_name=a[1] + ".pdf")
+                        pdf_preview(details, a[2], f"preview_assign_{a[0]}")
+                        pdf_download("📄 Download Assignment PDF", a[2], a[1] + ".pdf", a[3], f"dl_assign_{a[0]}")
                     ans = st.text_area(f"Submit Answer for '{a[1]}'", key=f"assign_{a[0]}")
                     if st.button(f"Submit {a[1]}", key=f"btn_{a[0]}"):
                         bk.submit_assignment(uid, a[0], ans)
@@ -162,13 +232,15 @@ def student_dashboard(uid):
         if enrolled:
             course = st.selectbox("Select Course", [c[1] for c in enrolled])
             cid = [c[0] for c in enrolled if c[1] == course][0]
+            material_search(cid, "search_note")
             notes = bk.get_notes(cid)
             if notes:
+                details = pdf_details(notes, 1)
                 for n in notes:
                     st.markdown(f"📘 Note File:")
                     if n[1]:
-                        with open(n[1], "rb") as f:
-                            st.download_button("📄 Download Note PDF", f, file_name=os.path.basename(n[1]))
+                        pdf_preview(details, n[1], f"preview_note_{n[0]}")
+                        pdf_download("📄 Download Note PDF", n[1], os.path.basename(n[1]), n[2], f"dl_note_{n[0]}")
             else:
                 st.info("No notes uploaded.")
         else:
@@ -180,13 +252,15 @@ def student_dashboard(uid):
         if enrolled:
             course = st.selectbox("Select Course", [c[1] for c in enrolled])
             cid = [c[0] for c in enrolled if c[1] == course][0]
+            material_search(cid, "search_exam")
             exams = bk.get_exams(cid)
             if exams:
+                details = pdf_details(exams, 2)
                 for e in exams:
                     st.markdown(f"### 🧠 {e[1]}")
                     if e[2]:
-                        with open(e[2], "rb") as f:
-                            st.download_button("📄 View Exam Paper (PDF)", f, file_name=e[1] + ".pdf")
+                        pdf_preview(details, e[2], f"preview_exam_{e[0]}")
+                        pdf_download("📄 View Exam Paper (PDF)", e[2], e[1] + ".pdf", e[3], f"dl_exam_{e[0]}")
                     ans = st.text_area(f"Write Answers for {e[1]}", key=f"exam_ans_{e[0]}")
                     if st.button(f"Submit {e[1]}", key=f"submit_exam_{e[0]}"):
                         bk.submit_exam(uid, e[0], ans)
@@ -200,15 +274,23 @@ def student_dashboard(uid):
     # ---------------- Leaderboard -----------------
     elif nav == "🏅 My Rank":
         st.subheader("🏆 Student Leaderboard")
-        leaderboard = bk.get_leaderboard()
-        df = pd.DataFrame(leaderboard, columns=["Username", "Points"])
-        st.table(df.sort_values(by="Points", ascending=False))
+        top, _ = bk.get_leaderboard_page(limit=LEADERBOARD_SIZE)
+        df = dataframe([r[:1] + r[2:] for r in top], columns=["Rank", "Username", "Points"])
+        st.table(df.set_index("Rank"))
+
+        my_rank = bk.get_rank(uid)
+        if my_rank:
+            rank, points, total = my_rank
+            st.metric("Your Rank", f"#{rank} of {total}", f"{points} points")
+        else:
+            st.info("Earn points by submitting assignments and exams to join the leaderboard.")
 
 
 # ---------------- TEACHER DASHBOARD -----------------
 def teacher_dashboard(uid):
     st.sidebar.title("👩‍🏫 Teacher Menu")
-    nav = st.sidebar.radio("Navigate", ["📘 Courses", "🧾 Assignments", "📚 Notes", "🧠 Exams", "📊 Analytics"])
+    nav = st.sidebar.radio("Navigate", ["📘 Courses", "🧾 Assignments", "📚 Notes", "🧠 Exams", "✅ Grading",
+                                        "📊 Analytics"])
 
     if st.sidebar.button("Logout"):
         st.session_state.login = False
@@ -242,10 +324,9 @@ def teacher_dashboard(uid):
             title = st.text_input("Assignment Title")
             uploaded = st.file_uploader("📤 Upload Assignment PDF", type=["pdf"])
             if st.button("Upload Assignment"):
-                path = save_pdf(uploaded, bk.ASSIGN_DIR)
-                if path:
-                    bk.add_assignment(cid, title, path)
-                    st.success("📝 Assignment uploaded successfully!")
+                if uploaded is not None:
+                    bk.add_assignment(cid, title, uploaded)
+                    st.success("📝 Assignment uploaded! Its preview and search text are prepared in the background.")
                 else:
                     st.warning("Please upload a valid PDF file.")
         else:
@@ -258,10 +339,9 @@ def teacher_dashboard(uid):
             cid = [c[0] for c in my_courses if c[1] == course][0]
             uploaded = st.file_uploader("📤 Upload Notes PDF", type=["pdf"])
             if st.button("Upload Note"):
-                path = save_pdf(uploaded, bk.NOTES_DIR)
-                if path:
-                    bk.upload_note(cid, path)
-                    st.success("📘 Note uploaded successfully!")
+                if uploaded is not None:
+                    bk.upload_note(cid, uploaded)
+                    st.success("📘 Note uploaded! Its preview and search text are prepared in the background.")
                 else:
                     st.warning("Please upload a valid PDF file.")
         else:
@@ -275,46 +355,174 @@ def teacher_dashboard(uid):
             title = st.text_input("Exam Title")
             uploaded = st.file_uploader("📤 Upload Exam Paper (PDF)", type=["pdf"])
             if st.button("Create Exam"):
-                path = save_pdf(uploaded, bk.EXAMS_DIR)
-                if path:
-                    bk.create_exam(cid, title, path)
-                    st.success("🧠 Exam uploaded successfully!")
+                if uploaded is not None:
+                    bk.create_exam(cid, title, uploaded)
+                    st.success("🧠 Exam uploaded! Its preview and search text are prepared in the background.")
                 else:
                     st.warning("Please upload a valid PDF file.")
         else:
             st.info("Add a course first.")
 
+    # ---------------- Grading -----------------
+    elif nav == "✅ Grading":
+        st.subheader("✅ Grade Submissions")
+        if my_courses:
+            course = st.selectbox("Select Course", [c[1] for c in my_courses], key="grading_course")
+            cid = [c[0] for c in my_courses if c[1] == course][0]
+            kind = st.radio("Submission Type", ["assignment", "exam"], horizontal=True,
+                            format_func=str.capitalize)
+            cursor_key = f"grading_after_{cid}_{kind}"
+            after = st.session_state.get(cursor_key, 0)
+            rows, next_cursor = bk.get_ungraded_submissions(cid, kind, after, GRADING_PAGE_SIZE)
+
+            if rows:
+                with st.form(f"grading_{cid}_{kind}_{after}"):
+                    entries = []
+                    for sid, title, student, answer, date in rows:
+                        st.markdown(f"**{title}** · {student} · {date}")
+                        st.text(answer or "")
+                        col1, col2 = st.columns([1, 3])
+                        grade = col1.number_input("Grade", min_value=0, max_value=100, value=None,
+                                                  step=1, key=f"grade_{kind}_{sid}")
+                        feedback = col2.text_input("Feedback", key=f"feedback_{kind}_{sid}")
+                        entries.append((sid, grade, feedback))
+                    if st.form_submit_button("💾 Save Grades"):
+                        graded = [e for e in entries if e[1] is not None]
+                        count = bk.grade_submissions(graded, kind)["updated"] if graded else 0
+                        st.toast(f"✅ Saved {count} grades", icon="📝")
+                        st.rerun()
+                if next_cursor is not None and st.button("Next page ➡️"):
+                    st.session_state[cursor_key] = next_cursor
+                    st.rerun()
+            elif after:
+                st.session_state[cursor_key] = 0
+                st.rerun()
+            else:
+                st.info("Nothing left to grade for this course.")
+        else:
+            st.info("Add a course first.")
+
     # ---------------- Analytics -----------------
     elif nav == "📊 Analytics":
-     st.subheader("📈 Detailed Student Report")
+        st.subheader("📈 Detailed Student Report")
 
-     my_courses = [c for c in bk.get_courses() if c[2] == uid]
-
-    if my_courses:
-        course = st.selectbox("Select Course", [c[1] for c in my_courses], key="analytics_course")
-        cid = [c[0] for c in my_courses if c[1] == course][0]
+        if my_courses:
+            course = st.selectbox("Select Course", [c[1] for c in my_courses], key="analytics_course")
+            cid = [c[0] for c in my_courses if c[1] == course][0]
 
-        data = bk.get_teacher_student_performance(cid)
+            # One keyset page at a time; the stack holds the cursor of every page shown so far.
+            pages = st.session_state.setdefault(f"report_pages_{cid}", [0])
+            data, next_after = bk.get_teacher_student_performance_page(cid, pages[-1], REPORT_PAGE_SIZE)
+
+            if data:
+                st.dataframe(dataframe(data))
+                col_prev, col_page, col_next = st.columns([1, 2, 1])
+                if col_prev.button("⬅️ Previous", disabled=len(pages) == 1, key=f"report_prev_{cid}"):
+                    pages.pop()
+                    st.rerun()
+                col_page.caption(f"Page {len(pages)}")
+                if col_next.button("Next ➡️", disabled=next_after is None, key=f"report_next_{cid}"):
+                    pages.append(next_after)
+                    st.rerun()
+
+                # Optional CSV download: streamed from the database only when the button is
+                # pressed, then kept for later reruns until the teacher refreshes it.
+                csv_key = f"report_csv_{cid}"
+                prepared = csv_key in st.session_state
+                if st.button("🔄 Refresh CSV Report" if prepared else "📥 Prepare CSV Report",
+                             key=f"{csv_key}_prepare"):
+                    st.session_state[csv_key] = spooled(export.iter_csv(*export.course_report(cid)))
+                if csv_key in st.session_state:
+                    st.download_button(
+                        label="📥 Download Report as CSV",
+                        data=st.session_state[csv_key],
+                        file_name=f"{course}_performance_report.csv",
+                        mime="text/csv"
+                    )
+            else:
+                st.info("No student submissions or exams yet for this course.")
+
+            st.divider()
+            st.write("### 📊 Grade Statistics")
+            stats_kind = st.radio("Grades for", ["assignment", "exam"], horizontal=True,
+                                  format_func=str.capitalize, key="stats_kind")
+            stats_items = bk.get_assignments(cid) if stats_kind == "assignment" else bk.get_exams(cid)
+            stats_titles = {None: f"All {stats_kind}s", **{i[0]: i[1] for i in stats_items}}
+            stats_item = st.selectbox("Scope", list(stats_titles), format_func=stats_titles.get,
+                                      key="stats_item")
+            stats = bk.get_grade_stats(cid, stats_kind, stats_item)
+            if stats is None:
+                st.info("Grade statistics need NumPy installed on the server.")
+            elif stats["summary"]["count"]:
+                s = stats["summary"]
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Graded", s["count"])
+                col2.metric("Mean", f"{s['mean']:.1f}", f"σ {s['std']:.1f}", delta_color="off")
+                col3.metric("Median", f"{s['median']:.1f}")
+                col4.metric("P25 – P75", f"{s['p25']:.0f} – {s['p75']:.0f}")
+                edges, counts = stats["histogram"]["edges"], stats["histogram"]["counts"]
+                hist = dataframe({"Grade": [f"{lo:.0f}–{hi:.0f}" for lo, hi in zip(edges, edges[1:])],
+                                     "Submissions": counts})
+                st.bar_chart(hist.set_index("Grade"))
+                students = dataframe(stats["students"],
+                                        columns=["Student", "Graded", "Average", "Z-Score", "At Risk"])
+                st.write(f"**{int(students['At Risk'].sum())} students at risk**")
+                st.dataframe(students.sort_values("Z-Score"), hide_index=True)
+            else:
+                st.info("No graded submissions yet.")
+
+            st.divider()
+            st.write("### 🔍 Similar Answers")
+            kind = st.radio("Compare", ["assignment", "exam"], horizontal=True,
+                            format_func=str.capitalize, key="similar_kind")
+            items = bk.get_assignments(cid) if kind == "assignment" else bk.get_exams(cid)
+            if items:
+                titles = {i[0]: i[1] for i in items}
+                item_id = st.selectbox(kind.capitalize(), list(titles), format_func=titles.get,
+                                       key="similar_item")
+                pairs = bk.get_suspicious_pairs(item_id, kind)
+                if pairs:
+                    st.dataframe(dataframe([p[:3] for p in pairs],
+                                              columns=["Student A", "Student B", "Similarity"]))
+                else:
+                    st.info("No near-duplicate answers found.")
+            else:
+                st.info(f"No {kind}s in this course yet.")
+        else:
+            st.warning("Please add a course first.")
 
-        if data:
-            df = pd.DataFrame(data)
-            st.dataframe(df)
+# ---------------- ADMIN STATS -----------------
+def admin_stats_page():
+    """Live query stats; reached with ?admin=<LMS_ADMIN_KEY>, not linked anywhere."""
+    st.subheader("🛠️ Backend Query Stats")
+    if not metrics.ENABLED:
+        st.info("Instrumentation is off. Start the app with LMS_METRICS=1 or enable it below.")
+        if st.button("Enable for this process"):
+            metrics.enable()
+            st.rerun()
+        return
+    snap = metrics.snapshot()
+    st.caption(f"Slow-query threshold: {snap['slow_query_ms']:.0f} ms")
+    st.write("### Functions")
+    st.dataframe(dataframe(snap["functions"]), use_container_width=True)
+    st.write("### SQL Statements")
+    st.dataframe(dataframe(snap["statements"]), use_container_width=True)
+    st.write("### Read Cache")
+    st.json(bk.get_cache_stats())
+    col1, col2 = st.columns(2)
+    col1.download_button("📥 Export JSON", metrics.to_json(), file_name="lms_metrics.json",
+                         mime="application/json")
+    if col2.button("Reset Stats"):
+        metrics.reset()
+        st.rerun()
 
-            # Optional CSV download
-            csv = df.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label="📥 Download Report as CSV",
-                data=csv,
-                file_name=f"{course}_performance_report.csv",
-                mime="text/csv"
-            )
-        else:
-            st.info("No student submissions or exams yet for this course.")
-    else:
-        st.warning("Please add a course first.")
 
 # ---------------- MAIN -----------------
-if not st.session_state.login:
+ADMIN_KEY = os.environ.get("LMS_ADMIN_KEY")
+
+if ADMIN_KEY and st.query_params.get("admin") == ADMIN_KEY:
+    admin_stats_page()
+elif not st.session_state.login:
     choice = st.sidebar.radio("Menu", ["Login", "Signup"])
     if choice == "Login":
         login_form()
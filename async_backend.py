@@ -0,0 +1,115 @@
+# async_backend.py
+"""
+asyncio mirror of the backend API for async web front ends.
+
+Every public function in backend.py is available here under the same name
+and signature as a coroutine, so an aiohttp/FastAPI handler can write
+
+    courses = await async_backend.get_enrolled_courses(uid)
+
+without blocking its event loop. Calls run on a dedicated executor whose
+threads use their own connection pool, so async traffic never waits for a
+connection held by Streamlit sessions (or the other way round). Submissions
+are queued on the group-commit writer and awaited through its Future instead
+of parking an executor thread until the commit.
+"""
+import asyncio
+import functools
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import backend
+import db
+
+WORKERS = 8   # executor threads, and connections in their pool
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the async executor, creating it (and its connection pool) on first use."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                backend.init()
+                pool = db.ConnectionPool(db.DB_PATH, WORKERS, db.BUSY_TIMEOUT)
+                _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="async-backend",
+                                               initializer=db.bind_pool, initargs=(pool,))
+                _executor.pool = pool
+    return _executor
+
+
+def shutdown():
+    """Stop the executor and close its connections."""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor.pool.close()
+            _executor = None
+
+
+async def run(fn, *args, **kwargs):
+    """Run any blocking callable on the async executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def _mirror(fn):
+    @functools.wraps(fn)
+    async def call(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return call
+
+
+# ---------------- MIRRORED API -----------------
+__all__ = ["run", "shutdown", "get_executor", "get_student_dashboard"]
+for _name, _fn in vars(backend).items():
+    if (_name.startswith("_") or not callable(_fn) or isinstance(_fn, type)
+            or getattr(_fn, "__module__", None) != backend.__name__):
+        continue
+    if inspect.isgeneratorfunction(inspect.unwrap(_fn)):
+        continue   # async generators below
+    globals()[_name] = _mirror(_fn)
+    __all__.append(_name)
+
+
+async def submit_assignment(student_id, assignment_id, answer):
+    """Queue the submission and await its group commit without holding a worker."""
+    future = await run(backend.submit_assignment, student_id, assignment_id, answer, wait=False)
+    return await asyncio.wrap_future(future)
+
+
+async def submit_exam(student_id, exam_id, answer):
+    """Queue the exam submission and await its group commit without holding a worker."""
+    future = await run(backend.submit_exam, student_id, exam_id, answer, wait=False)
+    return await asyncio.wrap_future(future)
+
+
+async def iter_teacher_student_performance(course_id, page_size=500):
+    """Async generator over the performance report, one page per executor call."""
+    after = 0
+    while after is not None:
+        rows, after = await run(backend.get_teacher_student_performance_page, course_id, after, page_size)
+        for row in rows:
+            yield row
+
+__all__.append("iter_teacher_student_performance")
+
+
+# ---------------- COMPOSITE READS -----------------
+async def get_student_dashboard(student_id, leaderboard_size=10):
+    """
+    Everything a student home screen needs, fetched concurrently with
+    asyncio.gather: summary, rank, top of the leaderboard and courses.
+    """
+    summary, rank, (leaders, _), courses = await asyncio.gather(
+        get_student_summary(student_id),
+        get_rank(student_id),
+        get_leaderboard_page(leaderboard_size),
+        get_enrolled_courses(student_id),
+    )
+    return {"summary": summary, "rank": rank, "leaderboard": leaders, "courses": courses}
@@ -1,38 +1,31 @@
 # auth.py
 import sqlite3
 
-DB_PATH = "lms.db"
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-c = conn.cursor()
+import cache
+import db
+import metrics
+import migrations
+import passwords
+
+DB_PATH = db.DB_PATH
 
 # ---------- MIGRATE USERS TABLE ----------
 def migrate_users_table():
     """
-    Ensure that the users table has an email column.
+    Ensure that the users table (with its email column) exists.
+    Schema changes live in migrations.py; this is a no-op once current.
+    Not run at import: startup calls backend.init().
     """
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            email TEXT UNIQUE,
-            password TEXT,
-            role TEXT CHECK(role IN ('Student','Teacher'))
-        )
-    """)
-    try:
-        c.execute("ALTER TABLE users ADD COLUMN email TEXT")
-    except Exception:
-        pass
-    conn.commit()
-
-migrate_users_table()
+    migrations.ensure_current()
 
 # ---------- AUTH FUNCTIONS ----------
 def signup_user(username, email, password, role):
+    hashed = passwords.hash_in_pool(password)
     try:
-        c.execute("INSERT INTO users (username, email, password, role) VALUES (?, ?, ?, ?)",
-                  (username, email, password, role))
-        conn.commit()
+        with db.transaction() as c:
+            c.execute("INSERT INTO users (username, email, password, role) VALUES (?, ?, ?, ?)",
+                      (username, email, hashed, role))
+        cache.bump("users")
         return True
     except sqlite3.IntegrityError:
         return False
@@ -41,6 +34,36 @@ def verify_login(email, password, role):
     """
     Return (id, username, role) if credentials are valid, else None.
     """
-    c.execute("SELECT id, username, role FROM users WHERE email=? AND password=? AND role=?",
-              (email, password, role))
-    return c.fetchone()
+    return authenticate("email", email, password, role)
+
+
+# Lookups go through the unique indexes on users(email) and users(username).
+LOGIN_SQL = {
+    "email": "SELECT id, username, role, password FROM users WHERE email=? AND role=?",
+    "username": "SELECT id, username, role, password FROM users WHERE username=? AND role=?",
+}
+
+
+def authenticate(column, value, password, role):
+    """
+    Look the user up by `column` ("email" or "username") and check the
+    password on the hashing pool. A legacy plaintext or outdated hash is
+    replaced with a fresh one after the first successful login.
+    Returns (id, username, role) or None.
+    """
+    with db.cursor() as c:
+        c.execute(LOGIN_SQL[column], (value, role))
+        row = c.fetchone()
+    stored = row[3] if row else passwords.dummy_hash()
+    if not passwords.verify_in_pool(password, stored) or row is None:
+        return None
+    if passwords.needs_rehash(stored):
+        rehashed = passwords.hash_in_pool(password)
+        with db.transaction() as c:
+            # Only replace the value we checked; a concurrent change wins.
+            c.execute("UPDATE users SET password=? WHERE id=? AND password=?", (rehashed, row[0], stored))
+    return row[:3]
+
+
+# ---------------- INSTRUMENTATION -----------------
+metrics.instrument(globals(), "auth")
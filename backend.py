@@ -1,129 +1,71 @@
+import importlib
+import json
+import re
 import sqlite3
 from datetime import datetime
-import os
+import threading
 
-# ---------------- DATABASE CONNECTION -----------------
-DB_PATH = "lms.db"
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-c = conn.cursor()
-
-# ---------------- CREATE FOLDERS FOR FILES -----------------
-UPLOAD_DIRS = ["uploads/assignments", "uploads/notes", "uploads/exams"]
-for d in UPLOAD_DIRS:
-    os.makedirs(d, exist_ok=True)
-
-# ---------------- SAFE MIGRATION HELPERS -----------------
-def try_alter(table, sql):
-    """Executes ALTER TABLE safely (ignores existing columns)."""
+import auth
+import cache
+import db
+import metrics
+import ingest
+import migrations
+import passwords
+import pdf_pipeline
+import shards
+import storage
+
+
+_numpy_modules = {}   # name -> module, or None when NumPy is missing
+
+
+def _numpy_module(name):
+    """
+    Import a NumPy-backed module on first use, keeping NumPy out of startup.
+    Returns None when NumPy is not installed (the feature is then skipped).
+    The outcome is remembered, so a missing NumPy costs one failed import.
+    """
     try:
-        c.execute(sql)
-        conn.commit()
-    except Exception:
+        return _numpy_modules[name]
+    except KeyError:
         pass
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        module = None
+    _numpy_modules[name] = module
+    return module
+
+# ---------------- DATABASE CONNECTION -----------------
+# Connections come from the shared pool in db.py; every function checks one
+# out for the duration of its queries instead of sharing a global cursor.
+DB_PATH = db.DB_PATH
 
 # ---------------- CREATE / MIGRATE TABLES -----------------
+def init():
+    """
+    Explicit startup step for every process using the backend: brings the
+    schema up to date on first call and is free afterwards. Importing this
+    module runs no SQL.
+    """
+    migrations.ensure_current()
+    shards.init()
+
+
 def create_tables_and_migrate():
-    # Users table (base, handled mainly by auth.py)
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE,
-                    password TEXT,
-                    role TEXT CHECK(role IN ('Student','Teacher'))
-                )''')
-
-    # Courses
-    c.execute('''CREATE TABLE IF NOT EXISTS courses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT,
-                    teacher_id INTEGER,
-                    FOREIGN KEY (teacher_id) REFERENCES users(id)
-                )''')
-
-    # Enrollments
-    c.execute('''CREATE TABLE IF NOT EXISTS enrollments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    student_id INTEGER,
-                    course_id INTEGER,
-                    FOREIGN KEY (student_id) REFERENCES users(id),
-                    FOREIGN KEY (course_id) REFERENCES courses(id)
-                )''')
-
-    # Assignments (PDF support)
-    c.execute('''CREATE TABLE IF NOT EXISTS assignments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    course_id INTEGER,
-                    title TEXT,
-                    file_path TEXT,
-                    FOREIGN KEY (course_id) REFERENCES courses(id)
-                )''')
-    try_alter("assignments", "ALTER TABLE assignments ADD COLUMN file_path TEXT")
-
-    # Submissions (student assignment answers)
-    c.execute('''CREATE TABLE IF NOT EXISTS submissions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    student_id INTEGER,
-                    assignment_id INTEGER,
-                    answer TEXT,
-                    submission_date TEXT,
-                    grade INTEGER,
-                    feedback TEXT,
-                    FOREIGN KEY (student_id) REFERENCES users(id),
-                    FOREIGN KEY (assignment_id) REFERENCES assignments(id)
-                )''')
-
-    # Notes (PDF)
-    c.execute('''CREATE TABLE IF NOT EXISTS notes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    course_id INTEGER,
-                    file_path TEXT,
-                    FOREIGN KEY (course_id) REFERENCES courses(id)
-                )''')
-    try_alter("notes", "ALTER TABLE notes ADD COLUMN file_path TEXT")
-
-    # Exams (PDF)
-    c.execute('''CREATE TABLE IF NOT EXISTS exams (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    course_id INTEGER,
-                    title TEXT,
-                    file_path TEXT,
-                    FOREIGN KEY (course_id) REFERENCES courses(id)
-                )''')
-    try_alter("exams", "ALTER TABLE exams ADD COLUMN file_path TEXT")
-
-    # Exam Submissions
-    c.execute('''CREATE TABLE IF NOT EXISTS exam_submissions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    student_id INTEGER,
-                    exam_id INTEGER,
-                    answer TEXT,
-                    submission_date TEXT,
-                    grade INTEGER,
-                    feedback TEXT,
-                    FOREIGN KEY (student_id) REFERENCES users(id),
-                    FOREIGN KEY (exam_id) REFERENCES exams(id)
-                )''')
-
-    # Points / Leaderboard
-    c.execute('''CREATE TABLE IF NOT EXISTS points (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    student_id INTEGER UNIQUE,
-                    points INTEGER DEFAULT 0,
-                    FOREIGN KEY (student_id) REFERENCES users(id)
-                )''')
-
-    conn.commit()
-
-
-# Run migration at import
-create_tables_and_migrate()
+    """Apply pending schema migrations (no-op when the schema is current)."""
+    return migrations.migrate()
 
 # ---------------- USER FUNCTIONS -----------------
 def signup(username, password, role):
     """Register a new user."""
+    hashed = passwords.hash_in_pool(password)
     try:
-        c.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                  (username, password, role))
-        conn.commit()
+        with db.transaction() as c:
+            c.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                      (username, hashed, role))
+        cache.bump("users")
         return True
     except sqlite3.IntegrityError:
         return False
@@ -131,208 +73,786 @@ def signup(username, password, role):
 
 def login(username, password, role):
     """Login user by username, password, and role."""
-    c.execute("SELECT id FROM users WHERE username=? AND password=? AND role=?",
-              (username, password, role))
-    return c.fetchone()
+    user = auth.authenticate("username", username, password, role)
+    return user[:1] if user else None
 
 # ---------------- COURSE FUNCTIONS -----------------
 def add_course(name, teacher_id):
-    c.execute("INSERT INTO courses (name, teacher_id) VALUES (?, ?)", (name, teacher_id))
-    conn.commit()
+    with db.transaction() as c:
+        c.execute("INSERT INTO courses (name, teacher_id) VALUES (?, ?)", (name, teacher_id))
+        shards.place(c, c.lastrowid)
+    cache.bump("courses", "course_shards")
 
 
+@cache.cached("courses")
 def get_courses():
-    c.execute("SELECT id, name, teacher_id FROM courses")
-    return c.fetchall()
+    with db.cursor() as c:
+        c.execute("SELECT id, name, teacher_id FROM courses")
+        return c.fetchall()
 
 
+@cache.cached("courses", "enrollments")
+@shards.fan_out(shards.concat)
 def get_enrolled_courses(student_id):
-    c.execute('''SELECT c.id, c.name
-                 FROM courses c
-                 JOIN enrollments e ON c.id = e.course_id
-                 WHERE e.student_id = ?''', (student_id,))
-    return c.fetchall()
+    with db.cursor() as c:
+        c.execute('''SELECT c.id, c.name
+                     FROM courses c
+                     JOIN enrollments e ON c.id = e.course_id
+                     WHERE e.student_id = ?''', (student_id,))
+        return c.fetchall()
+
 
+def _fts_prefix_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{w}"*' for w in words)
 
+
+def search_courses(student_id, query="", limit=20, cursor=0):
+    """
+    One page of courses the student is not enrolled in whose names match
+    every word of `query` as a prefix, as (course_id, name) in id order.
+    Returns (rows, cursor); cursor is None on the last page.
+    """
+    match = _fts_prefix_query(query)
+    # Enrollments may sit on any shard; exclude the (cached) enrolled ids instead of joining.
+    enrolled = "[%s]" % ",".join(str(cid) for cid, _ in get_enrolled_courses(student_id))
+    with db.cursor() as c:
+        if match:
+            c.execute("""
+                SELECT c.id, c.name
+                FROM courses_fts f
+                JOIN courses c ON c.id = f.rowid
+                WHERE courses_fts MATCH ? AND f.rowid > ?
+                  AND c.id NOT IN (SELECT value FROM json_each(?))
+                ORDER BY f.rowid
+                LIMIT ?
+            """, (match, cursor, enrolled, limit))
+        else:
+            c.execute("""
+                SELECT c.id, c.name
+                FROM courses c
+                WHERE c.id > ?
+                  AND c.id NOT IN (SELECT value FROM json_each(?))
+                ORDER BY c.id
+                LIMIT ?
+            """, (cursor, enrolled, limit))
+        rows = c.fetchall()
+    next_cursor = rows[-1][0] if len(rows) == limit else None
+    return rows, next_cursor
+
+
+@shards.by_course()
 def enroll_course(student_id, course_id):
     """Enroll a student in a course if not already enrolled."""
-    c.execute("SELECT id FROM enrollments WHERE student_id=? AND course_id=?", (student_id, course_id))
-    if c.fetchone():
-        return False
-    c.execute("INSERT INTO enrollments (student_id, course_id) VALUES (?, ?)", (student_id, course_id))
-    conn.commit()
-    return True
+    with db.transaction() as c:
+        c.execute("INSERT OR IGNORE INTO enrollments (student_id, course_id) VALUES (?, ?)",
+                  (student_id, course_id))
+        enrolled = c.rowcount == 1
+    if enrolled:
+        cache.bump("enrollments")
+    return enrolled
 
 
+@shards.by_course()
 def count_enrolled_students(course_id):
-    c.execute("SELECT COUNT(*) FROM enrollments WHERE course_id=?", (course_id,))
-    return c.fetchone()[0]
+    with db.cursor() as c:
+        c.execute("SELECT COUNT(*) FROM enrollments WHERE course_id=?", (course_id,))
+        return c.fetchone()[0]
 
 
+@cache.cached("users", "enrollments")
+@shards.by_course()
 def get_enrolled_students(course_id):
     """Return all students enrolled in a given course."""
-    c.execute("""
-        SELECT u.id, u.username
-        FROM users u
-        JOIN enrollments e ON e.student_id = u.id
-        WHERE e.course_id = ?
-    """, (course_id,))
-    return c.fetchall()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT u.id, u.username
+            FROM users u
+            JOIN enrollments e ON e.student_id = u.id
+            WHERE e.course_id = ?
+        """, (course_id,))
+        return c.fetchall()
 
 # ---------------- ASSIGNMENT FUNCTIONS (PDF) -----------------
+@shards.by_course()
 def add_assignment(course_id, title, uploaded_file):
     """Add a new PDF assignment."""
-    file_path = f"uploads/assignments/{title}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    c.execute("INSERT INTO assignments (course_id, title, file_path) VALUES (?, ?, ?)",
-              (course_id, title, file_path))
-    conn.commit()
-
-
+    file_hash, file_size, file_path = storage.store(uploaded_file)
+    with db.transaction() as c:
+        c.execute("""INSERT INTO assignments (id, course_id, title, file_path, file_hash, file_size)
+                     VALUES (?, ?, ?, ?, ?, ?)""",
+                  (shards.new_id("assignments"), course_id, title, file_path, file_hash, file_size))
+        item_id = c.lastrowid
+    cache.bump("assignments")
+    pdf_pipeline.enqueue("assignment", item_id, file_path)
+
+
+@cache.cached("assignments")
+@shards.by_course()
 def get_assignments(course_id):
-    c.execute("SELECT id, title, file_path FROM assignments WHERE course_id=?", (course_id,))
-    return c.fetchall()
+    with db.cursor() as c:
+        c.execute("SELECT id, title, file_path, file_size FROM assignments WHERE course_id=?", (course_id,))
+        return c.fetchall()
 
 # ---------------- NOTES FUNCTIONS (PDF) -----------------
+@shards.by_course()
 def upload_note(course_id, uploaded_file):
     """Upload PDF notes for a course."""
-    file_path = f"uploads/notes/note_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    c.execute("INSERT INTO notes (course_id, file_path) VALUES (?, ?)", (course_id, file_path))
-    conn.commit()
+    file_hash, file_size, file_path = storage.store(uploaded_file)
+    with db.transaction() as c:
+        c.execute("INSERT INTO notes (id, course_id, file_path, file_hash, file_size) VALUES (?, ?, ?, ?, ?)",
+                  (shards.new_id("notes"), course_id, file_path, file_hash, file_size))
+        item_id = c.lastrowid
+    cache.bump("notes")
+    pdf_pipeline.enqueue("note", item_id, file_path)
 
 
+@cache.cached("notes")
+@shards.by_course()
 def get_notes(course_id):
-    c.execute("SELECT id, file_path FROM notes WHERE course_id=?", (course_id,))
-    return c.fetchall()
+    with db.cursor() as c:
+        c.execute("SELECT id, file_path, file_size FROM notes WHERE course_id=?", (course_id,))
+        return c.fetchall()
 
 # ---------------- EXAM FUNCTIONS (PDF) -----------------
+@shards.by_course()
 def create_exam(course_id, title, uploaded_file):
     """Create and upload a PDF-based exam."""
-    file_path = f"uploads/exams/{title}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    c.execute("INSERT INTO exams (course_id, title, file_path) VALUES (?, ?, ?)",
-              (course_id, title, file_path))
-    conn.commit()
-
-
+    file_hash, file_size, file_path = storage.store(uploaded_file)
+    with db.transaction() as c:
+        c.execute("""INSERT INTO exams (id, course_id, title, file_path, file_hash, file_size)
+                     VALUES (?, ?, ?, ?, ?, ?)""",
+                  (shards.new_id("exams"), course_id, title, file_path, file_hash, file_size))
+        item_id = c.lastrowid
+    cache.bump("exams")
+    pdf_pipeline.enqueue("exam", item_id, file_path)
+
+
+@cache.cached("exams")
+@shards.by_course()
 def get_exams(course_id):
-    c.execute("SELECT id, title, file_path FROM exams WHERE course_id=?", (course_id,))
-    return c.fetchall()
+    with db.cursor() as c:
+        c.execute("SELECT id, title, file_path, file_size FROM exams WHERE course_id=?", (course_id,))
+        return c.fetchall()
+
+# ---------------- PDF DETAILS & SEARCH -----------------
+# Uploads are queued for pdf_pipeline.py, which extracts page counts, text
+# and first-page previews in a process pool after the request returns.
+def start_pdf_pipeline(workers=None):
+    """Start background PDF processing once per process; None without PyMuPDF."""
+    return pdf_pipeline.start(workers or pdf_pipeline.WORKERS)
+
+
+@cache.cached("pdf_documents")
+def get_pdf_details(file_paths):
+    """(file_path, pages, preview_png) for those of `file_paths` already processed."""
+    with db.cursor() as c:
+        c.execute("""SELECT file_path, pages, preview FROM pdf_documents
+                     WHERE file_path IN (SELECT value FROM json_each(?))""", (json.dumps(list(file_paths)),))
+        return c.fetchall()
+
+
+@cache.cached("assignments", "exams", "notes")
+@shards.by_course()
+def _course_files(course_id):
+    with db.cursor() as c:
+        c.execute("""SELECT 'assignment', id, title, file_path FROM assignments
+                     WHERE course_id = ?1 AND file_path IS NOT NULL
+                     UNION ALL
+                     SELECT 'exam', id, title, file_path FROM exams
+                     WHERE course_id = ?1 AND file_path IS NOT NULL
+                     UNION ALL
+                     SELECT 'note', id, NULL, file_path FROM notes
+                     WHERE course_id = ?1 AND file_path IS NOT NULL""", (course_id,))
+        return c.fetchall()
+
+
+def search_materials(course_id, query, limit=20):
+    """
+    A course's assignments, exams and notes whose PDF text matches every word
+    of `query` as a prefix, best match first, as (kind, item_id, title, snippet).
+    """
+    match = _fts_prefix_query(query)
+    by_path = {}
+    for kind, item_id, title, path in _course_files(course_id):
+        by_path.setdefault(path, []).append((kind, item_id, title))
+    if not match or not by_path:
+        return []
+    with db.cursor() as c:
+        c.execute("""
+            SELECT d.file_path, snippet(pdf_documents_fts, 0, '**', '**', '…', 12)
+            FROM pdf_documents_fts f
+            JOIN pdf_documents d ON d.id = f.rowid
+            WHERE pdf_documents_fts MATCH ? AND d.file_path IN (SELECT value FROM json_each(?))
+            ORDER BY f.rank
+            LIMIT ?
+        """, (match, json.dumps(list(by_path)), limit))
+        rows = c.fetchall()
+    return [item + (snippet,) for path, snippet in rows for item in by_path[path]][:limit]
+
+
+def get_pdf_job_counts():
+    """{status: jobs} of the PDF processing queue."""
+    return pdf_pipeline.job_counts()
 
 # ---------------- SUBMISSIONS & PERFORMANCE -----------------
-def submit_assignment(student_id, assignment_id, answer):
-    """Submit or update an assignment answer."""
+SUBMIT_ASSIGNMENT_SQL = """
+    INSERT INTO submissions (student_id, assignment_id, answer, submission_date) VALUES (?, ?, ?, ?)
+    ON CONFLICT(student_id, assignment_id) DO UPDATE
+    SET answer = excluded.answer, submission_date = excluded.submission_date"""
+
+SUBMIT_EXAM_SQL = """
+    INSERT INTO exam_submissions (student_id, exam_id, answer, submission_date) VALUES (?, ?, ?, ?)
+    ON CONFLICT(student_id, exam_id) DO UPDATE
+    SET answer = excluded.answer, submission_date = excluded.submission_date"""
+
+
+@shards.by_item("assignments", "assignment_id")
+def submit_assignment(student_id, assignment_id, answer, wait=True):
+    """
+    Submit or update an assignment answer through the group-commit writer.
+    Returns True once the row is committed, or a Future right away if
+    wait=False.
+    """
     date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("SELECT id FROM submissions WHERE student_id=? AND assignment_id=?", (student_id, assignment_id))
-    row = c.fetchone()
-    if row:
-        c.execute("UPDATE submissions SET answer=?, submission_date=? WHERE id=?",
-                  (answer, date, row[0]))
-    else:
-        c.execute("""INSERT INTO submissions (student_id, assignment_id, answer, submission_date)
-                     VALUES (?, ?, ?, ?)""", (student_id, assignment_id, answer, date))
-    conn.commit()
-
-
-def submit_exam(student_id, exam_id, answer):
-    """Submit or update an exam answer."""
+    future = ingest.write(SUBMIT_ASSIGNMENT_SQL, (student_id, assignment_id, answer, date), wait)
+    _index_when_committed(future, "assignment", student_id, assignment_id, answer)
+    return future.result() if wait else future
+
+
+@shards.by_item("exams", "exam_id")
+def submit_exam(student_id, exam_id, answer, wait=True):
+    """
+    Submit or update an exam answer through the group-commit writer.
+    Returns True once the row is committed, or a Future right away if
+    wait=False.
+    """
     date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("SELECT id FROM exam_submissions WHERE student_id=? AND exam_id=?", (student_id, exam_id))
-    row = c.fetchone()
-    if row:
-        c.execute("UPDATE exam_submissions SET answer=?, submission_date=? WHERE id=?",
-                  (answer, date, row[0]))
-    else:
-        c.execute("""INSERT INTO exam_submissions (student_id, exam_id, answer, submission_date)
-                     VALUES (?, ?, ?, ?)""", (student_id, exam_id, answer, date))
-    conn.commit()
+    future = ingest.write(SUBMIT_EXAM_SQL, (student_id, exam_id, answer, date), wait)
+    _index_when_committed(future, "exam", student_id, exam_id, answer)
+    return future.result() if wait else future
+
+
+def _index_when_committed(future, kind, student_id, item_id, answer):
+    """
+    Queue the answer for copy detection once its write is committed. The
+    indexer of the answer's database file indexes queued answers in batches
+    on its own thread, so submitting never waits for (or fails on) indexing.
+    """
+    similarity = _numpy_module("similarity")
+    if similarity is not None:
+        indexer = similarity.get_indexer()   # the shard the answer was written to
+
+        def index(f):
+            if f.exception() is None:
+                indexer.submit(kind, student_id, item_id, answer)
+        future.add_done_callback(index)
+
+# ---------------- GRADING -----------------
+GRADED_TABLES = migrations.GRADED_TABLES
+MIN_GRADE, MAX_GRADE = 0, 100
+
+
+def _whole_number(value):
+    """int(value) for ints and whole-number floats or strings such as "85" or "85.0"."""
+    if isinstance(value, str):
+        value = value.strip()
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(value)
+    return int(number)
+
+
+def grade_submissions(grades, kind="assignment"):
+    """
+    Apply (submission_id, grade, feedback) rows, or dicts with those keys,
+    in one transaction per shard. Grades must be whole numbers from
+    MIN_GRADE to MAX_GRADE; other rows are skipped and reported.
+    Returns {"updated": n, "rejected": [(line, reason)]}; line is 1-based.
+    """
+    table = GRADED_TABLES[kind][0]
+    rows, rejected = [], []
+    for line, g in enumerate(grades, start=1):
+        if isinstance(g, dict):
+            g = (g.get("submission_id"), g.get("grade"), g.get("feedback"))
+        sid, grade, feedback = g
+        try:
+            sid = _whole_number(sid)
+        except (TypeError, ValueError):
+            rejected.append((line, "invalid submission_id"))
+            continue
+        if grade is None or str(grade).strip() == "":
+            rejected.append((line, "missing grade"))
+            continue
+        try:
+            grade = _whole_number(grade)
+        except (TypeError, ValueError):
+            rejected.append((line, "grade is not a whole number"))
+            continue
+        if not MIN_GRADE <= grade <= MAX_GRADE:
+            rejected.append((line, f"grade outside {MIN_GRADE}-{MAX_GRADE}"))
+            continue
+        rows.append((grade, feedback or None, sid))
+    updated = 0
+    for shard, group in shards.split_rows(rows, lambda row: row[2]).items():
+        with shards.using(shard), db.transaction() as c:
+            c.executemany(f"UPDATE {table} SET grade=?, feedback=? WHERE id=?", group)
+            updated += c.rowcount
+    if rows:
+        cache.bump(table)
+    return {"updated": updated, "rejected": rejected}
+
+
+@shards.by_course()
+def get_ungraded_submissions(course_id, kind="assignment", after=0, limit=50):
+    """
+    One page of a course's ungraded submissions, oldest first, as
+    (submission_id, title, username, answer, submission_date).
+    Returns (rows, cursor); cursor is None on the last page.
+    """
+    table, items, fk = GRADED_TABLES[kind]
+    with db.cursor() as c:
+        c.execute(f"""
+            SELECT s.id, i.title, u.username, s.answer, s.submission_date
+            FROM {items} i
+            JOIN {table} s ON s.{fk} = i.id AND s.grade IS NULL
+            LEFT JOIN users u ON u.id = s.student_id
+            WHERE i.course_id = ? AND s.id > ?
+            ORDER BY s.id
+            LIMIT ?
+        """, (course_id, after, limit))
+        rows = c.fetchall()
+    cursor = rows[-1][0] if len(rows) == limit else None
+    return rows, cursor
+
+
+@shards.fan_out(shards.concat)
+def get_student_grades(student_id):
+    """Return (course_name, kind, title, grade, feedback) for every graded submission."""
+    with db.cursor() as c:
+        c.execute("""
+            SELECT co.name, 'assignment', a.title, s.grade, s.feedback
+            FROM submissions s
+            JOIN assignments a ON a.id = s.assignment_id
+            JOIN courses co ON co.id = a.course_id
+            WHERE s.student_id = ? AND s.grade IS NOT NULL
+            UNION ALL
+            SELECT co.name, 'exam', e.title, s.grade, s.feedback
+            FROM exam_submissions s
+            JOIN exams e ON e.id = s.exam_id
+            JOIN courses co ON co.id = e.course_id
+            WHERE s.student_id = ? AND s.grade IS NOT NULL
+        """, (student_id, student_id))
+        return c.fetchall()
 
 # ---------------- TEACHER ANALYTICS -----------------
+# One statement per page: the roster page is a keyset slice of enrollments and
+# each student's submissions are aggregated in SQL through the
+# (student_id, assignment_id) / (student_id, exam_id) unique indexes.
+PERFORMANCE_SQL = """
+    WITH roster AS (
+        SELECT e.id AS eid, u.id AS sid, u.username AS name
+        FROM enrollments e
+        JOIN users u ON u.id = e.student_id
+        WHERE e.course_id = :cid AND e.id > :after
+        ORDER BY e.id
+        LIMIT :limit
+    )
+    SELECT r.eid, r.name,
+           (SELECT COUNT(*) FROM submissions s
+                JOIN assignments a ON a.id = s.assignment_id
+                WHERE s.student_id = r.sid AND a.course_id = :cid),
+           (SELECT group_concat(title, ', ') FROM (
+                SELECT a.title FROM submissions s
+                JOIN assignments a ON a.id = s.assignment_id
+                WHERE s.student_id = r.sid AND a.course_id = :cid
+                ORDER BY a.id)),
+           (SELECT COUNT(*) FROM exam_submissions s
+                JOIN exams e ON e.id = s.exam_id
+                WHERE s.student_id = r.sid AND e.course_id = :cid),
+           (SELECT group_concat(title, ', ') FROM (
+                SELECT e.title FROM exam_submissions s
+                JOIN exams e ON e.id = s.exam_id
+                WHERE s.student_id = r.sid AND e.course_id = :cid
+                ORDER BY e.id))
+    FROM roster r
+    ORDER BY r.eid
+"""
+
+
+def _performance_row(row):
+    _, name, n_assign, assign_titles, n_exams, exam_titles = row
+    return {
+        "Student Name": name,
+        "Assignments Submitted": n_assign,
+        "Assignment Titles": assign_titles or "None",
+        "Exams Attempted": n_exams,
+        "Exam Titles": exam_titles or "None"
+    }
+
+
+@shards.by_course()
+def get_teacher_student_performance_page(course_id, after=0, limit=500):
+    """
+    One page of the performance report, in enrollment order.
+    Returns (rows, cursor); pass cursor as `after` for the next page.
+    cursor is None once the course is exhausted.
+    """
+    with db.cursor() as c:
+        c.execute(PERFORMANCE_SQL, {"cid": course_id, "after": after, "limit": limit})
+        rows = c.fetchall()
+    cursor = rows[-1][0] if len(rows) == limit else None
+    return [_performance_row(r) for r in rows], cursor
+
+
+def iter_teacher_student_performance(course_id, page_size=500):
+    """Yield report rows page by page so callers can render before the course is done."""
+    after = 0
+    while after is not None:
+        rows, after = get_teacher_student_performance_page(course_id, after, page_size)
+        yield from rows
+
+
 def get_teacher_student_performance(course_id):
     """
     Return detailed performance of all students in a course.
     Columns: Student Name, Assignments Submitted, Assignment Titles, Exams Attempted, Exam Titles
     """
-    students = get_enrolled_students(course_id)
-    data = []
-    for sid, name in students:
-        c.execute("""SELECT a.title FROM assignments a
-                     JOIN submissions s ON a.id = s.assignment_id
-                     WHERE s.student_id=? AND a.course_id=?""", (sid, course_id))
-        assignments_done = c.fetchall()
-        assignment_titles = ", ".join([a[0] for a in assignments_done]) if assignments_done else "None"
-
-        c.execute("""SELECT e.title FROM exams e
-                     JOIN exam_submissions s ON e.id = s.exam_id
-                     WHERE s.student_id=? AND e.course_id=?""", (sid, course_id))
-        exams_done = c.fetchall()
-        exam_titles = ", ".join([e[0] for e in exams_done]) if exams_done else "None"
-
-        data.append({
-            "Student Name": name,
-            "Assignments Submitted": len(assignments_done),
-            "Assignment Titles": assignment_titles,
-            "Exams Attempted": len(exams_done),
-            "Exam Titles": exam_titles
-        })
-    return data
+    rows, _ = get_teacher_student_performance_page(course_id, 0, -1)
+    return rows
+
+def get_suspicious_pairs(item_id, kind="assignment", min_similarity=0.8):
+    """
+    Near-duplicate answers to one assignment or exam, most similar first, as
+    (student_a, student_b, similarity, submission_a, submission_b).
+    """
+    similarity = _numpy_module("similarity")
+    if similarity is None:
+        return []
+    with shards.using(shards.shard_of_item(GRADED_TABLES[kind][1], item_id)):
+        return similarity.suspicious_pairs(kind, item_id, min_similarity)
+
+
+@shards.by_course()
+def get_grade_stats(course_id, kind="assignment", item_id=None):
+    """
+    Grade summary, histogram and per-student scores (with usernames) for a
+    course, or one assignment/exam of it. None when NumPy is unavailable.
+    """
+    grade_stats = _numpy_module("grade_stats")
+    if grade_stats is None:
+        return None
+    stats = grade_stats.course_stats(course_id, kind, item_id)
+    names = dict(get_enrolled_students(course_id))
+    stats["students"] = [(names.get(sid, f"#{sid}"),) + row[1:] for row in stats["students"]]
+    return stats
+
+
+@shards.fan_out(shards.total)
+def rebuild_answer_index(kind="assignment"):
+    """Recompute copy detection for every existing answer; returns (answers, pairs)."""
+    similarity = _numpy_module("similarity")
+    if similarity is None:
+        raise RuntimeError("copy detection needs NumPy")
+    return similarity.rebuild(kind)
+
 
 # ---------------- POINTS / LEADERBOARD -----------------
+ADD_POINTS_SQL = """INSERT INTO points (student_id, points) VALUES (?, ?)
+                    ON CONFLICT(student_id) DO UPDATE SET points = points + excluded.points"""
+
+
 def add_points(student_id, points):
-    """Add points (create row if missing)."""
-    c.execute("SELECT points FROM points WHERE student_id=?", (student_id,))
-    row = c.fetchone()
-    if row:
-        new_total = row[0] + points
-        c.execute("UPDATE points SET points=? WHERE student_id=?", (new_total, student_id))
-    else:
-        c.execute("INSERT INTO points (student_id, points) VALUES (?, ?)", (student_id, points))
-    conn.commit()
+    """Add points (create row if missing) in one atomic statement."""
+    with db.transaction() as c:
+        c.execute(ADD_POINTS_SQL, (student_id, points))
+
+
+def add_points_many(awards):
+    """Apply many (student_id, points) awards in a single transaction."""
+    with db.transaction() as c:
+        c.executemany(ADD_POINTS_SQL, awards)
+
+
+def queue_points(awards):
+    """
+    Append (student_id, points) awards to the ledger without touching the
+    totals. Cheap under write bursts; compact_points() folds them in later.
+    """
+    with db.transaction() as c:
+        c.executemany("INSERT INTO points_ledger (student_id, points) VALUES (?, ?)", awards)
+
+
+def compact_points():
+    """Fold pending ledger rows into the points totals. Returns rows folded."""
+    with db.transaction() as c:
+        c.execute("SELECT MAX(id) FROM points_ledger")
+        upto = c.fetchone()[0]
+        if upto is None:
+            return 0
+        c.execute("""INSERT INTO points (student_id, points)
+                     SELECT student_id, SUM(points) FROM points_ledger
+                     WHERE id <= ? GROUP BY student_id
+                     ON CONFLICT(student_id) DO UPDATE SET points = points + excluded.points""",
+                  (upto,))
+        c.execute("DELETE FROM points_ledger WHERE id <= ?", (upto,))
+        return c.rowcount
+
+
+class PointsCompactor(threading.Thread):
+    """Daemon thread that runs compact_points() every `interval` seconds."""
+
+    def __init__(self, interval=5.0):
+        super().__init__(name="points-compactor", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                compact_points()
+            except sqlite3.OperationalError:
+                pass   # database busy; retry on the next tick
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        compact_points()
+
+
+_compactor = None
+
+
+def start_points_compactor(interval=5.0):
+    """Start the process-wide compactor once; later calls return the same thread."""
+    global _compactor
+    if _compactor is None:
+        _compactor = PointsCompactor(interval)
+        _compactor.start()
+    return _compactor
 
 
 def get_user_points(student_id):
-    """Return total points for a specific student."""
-    c.execute("SELECT points FROM points WHERE student_id=?", (student_id,))
-    row = c.fetchone()
-    return row[0] if row else 0
-
-
-def get_leaderboard():
-    """Return leaderboard of all students sorted by points."""
-    c.execute('''
-        SELECT u.username, p.points
-        FROM users u
-        JOIN points p ON u.id = p.student_id
-        ORDER BY p.points DESC
-    ''')
-    return c.fetchall()
+    """Return total points for a specific student, including uncompacted awards."""
+    with db.cursor() as c:
+        c.execute("""SELECT COALESCE((SELECT points FROM points WHERE student_id=?), 0)
+                          + COALESCE((SELECT SUM(points) FROM points_ledger WHERE student_id=?), 0)""",
+                  (student_id, student_id))
+        return c.fetchone()[0]
+
+
+# Uncompacted awards: pending sums per student, and each such student's
+# compacted total (old, NULL without a points row) and live total (new).
+PENDING_POINTS_CTE = """
+    pending AS (SELECT student_id, SUM(points) AS points FROM points_ledger GROUP BY student_id),
+    moved AS (SELECT l.student_id, p.points AS old, COALESCE(p.points, 0) + l.points AS new
+              FROM pending l LEFT JOIN points p ON p.student_id = l.student_id)"""
+
+# Students whose live total beats {score}. point_counts covers compacted
+# totals; students with pending awards are moved from their old score to
+# their new one. Cost: the distinct scores above {score} plus the pending students.
+ABOVE_SQL = "(SELECT COALESCE(SUM(q.students), 0) FROM point_counts q WHERE q.points > {score})"
+MOVED_ABOVE_SQL = """ - (SELECT COUNT(*) FROM moved m WHERE m.old > {score})
+                      + (SELECT COUNT(*) FROM moved m WHERE m.new > {score})"""
+
+# Compacted totals in leaderboard order, straight off ix_points_rank.
+LEADERBOARD_SQL = """
+    SELECT {columns}
+    FROM (SELECT p.student_id, u.username, p.points
+          FROM points p
+          JOIN users u ON u.id = p.student_id
+          WHERE 1 {where_points}) b
+    ORDER BY b.points DESC, b.student_id
+    LIMIT ?1"""
+
+# The same with uncompacted awards. Students without pending awards come off
+# the index (at most `limit` of them can make the page); the few with pending
+# awards are merged in at their live totals.
+PENDING_LEADERBOARD_SQL = f"""
+    WITH {PENDING_POINTS_CTE},
+    board AS (
+        SELECT * FROM (
+            SELECT p.student_id, u.username, p.points
+            FROM points p
+            JOIN users u ON u.id = p.student_id
+            WHERE p.student_id NOT IN (SELECT student_id FROM pending) {{where_points}}
+            ORDER BY p.points DESC, p.student_id
+            LIMIT ?1)
+        UNION ALL
+        SELECT m.student_id, u.username, m.new
+        FROM moved m
+        JOIN users u ON u.id = m.student_id
+        WHERE 1 {{where_moved}})
+    SELECT {{columns}}
+    FROM board b
+    ORDER BY b.points DESC, b.student_id
+    LIMIT ?1"""
+
+# Keyset condition: strictly after the cursor's (points, student_id).
+AFTER_SQL = "AND {points} <= ?2 AND ({points} < ?2 OR {id} > ?3)"
+
+
+def _has_pending_points(c):
+    """True when points_ledger holds awards compact_points() has not folded in yet."""
+    c.execute("SELECT EXISTS (SELECT 1 FROM points_ledger)")
+    return bool(c.fetchone()[0])
+
+
+def _leaderboard_sql(columns, after, pending):
+    where = {"where_points": "", "where_moved": ""}
+    if after:
+        where = {"where_points": AFTER_SQL.format(points="p.points", id="p.student_id"),
+                 "where_moved": AFTER_SQL.format(points="m.new", id="m.student_id")}
+    return (PENDING_LEADERBOARD_SQL if pending else LEADERBOARD_SQL).format(columns=columns, **where)
+
+
+def _above_sql(score, pending):
+    return ABOVE_SQL.format(score=score) + (MOVED_ABOVE_SQL.format(score=score) if pending else "")
+
+
+def get_leaderboard(limit=None):
+    """
+    Return (username, points) sorted by live points (uncompacted awards
+    included), highest first. Ties are ordered by student id. `limit`
+    keeps only the top K rows.
+    """
+    with db.cursor() as c:
+        sql = _leaderboard_sql("b.username, b.points", None, _has_pending_points(c))
+        c.execute(sql, (-1 if limit is None else limit,))
+        return c.fetchall()
+
+
+def get_leaderboard_page(limit=10, after=None):
+    """
+    Keyset page of the leaderboard as (rank, student_id, username, points),
+    on live totals like get_user_points(). Rank is competition style: tied
+    students share a rank and the next distinct score skips ahead
+    (1, 2, 2, 4). `after` is the cursor returned by the previous page; the
+    returned cursor is None on the last page. Read-only: pending ledger
+    rows are summed in, never compacted here.
+    """
+    params = (limit, after[0], after[1]) if after else (limit,)
+    with db.cursor() as c:
+        pending = _has_pending_points(c)
+        columns = f"1 + {_above_sql('b.points', pending)}, b.student_id, b.username, b.points"
+        c.execute(_leaderboard_sql(columns, after, pending), params)
+        rows = c.fetchall()
+    cursor = (rows[-1][3], rows[-1][1]) if len(rows) == limit else None
+    return rows, cursor
+
+
+def get_rank(student_id):
+    """
+    Return (rank, points, total_students) for one student on live totals
+    (uncompacted awards included), or None if the student has no points
+    yet. Read-only: the rank is a sum over point_counts (one row per
+    distinct compacted score, kept by triggers on points) corrected for the
+    students with pending awards, so the cost grows with the distinct scores
+    above the student's plus the pending students, not with all students.
+    """
+    with db.cursor() as c:
+        c.execute(f"""
+            WITH {PENDING_POINTS_CTE},
+            me AS (SELECT COALESCE((SELECT points FROM points WHERE student_id = ?1), 0)
+                          + COALESCE((SELECT points FROM pending WHERE student_id = ?1), 0) AS points
+                   WHERE EXISTS (SELECT 1 FROM points WHERE student_id = ?1)
+                      OR EXISTS (SELECT 1 FROM pending WHERE student_id = ?1))
+            SELECT 1 + {_above_sql("me.points", True)},
+                   me.points,
+                   (SELECT COALESCE(SUM(students), 0) FROM point_counts)
+                   + (SELECT COUNT(*) FROM moved WHERE old IS NULL)
+            FROM me""", (student_id,))
+        return c.fetchone()
+
 
 # ---------------- ANALYTICS / PROGRESS -----------------
+@shards.fan_out(shards.concat)
 def get_course_progress(student_id):
     """
     Returns list of (course_name, completion_percent).
     If a course has zero assignments, progress = 0.0.
+    Counts come from the trigger-maintained course_stats tables.
+    """
+    with db.cursor() as c:
+        c.execute('''
+            SELECT
+                c.name,
+                CASE
+                    WHEN COALESCE(cs.assignment_count, 0) = 0 THEN 0.0
+                    ELSE (CAST(COALESCE(ss.submission_count, 0) AS FLOAT) * 100.0) / cs.assignment_count
+                END AS progress
+            FROM enrollments e
+            JOIN courses c ON c.id = e.course_id
+            LEFT JOIN course_stats cs ON cs.course_id = e.course_id
+            LEFT JOIN student_course_stats ss ON ss.student_id = e.student_id AND ss.course_id = e.course_id
+            WHERE e.student_id = ?
+        ''', (student_id,))
+        return c.fetchall()
+
+
+def _merge_summaries(results):
+    merged = dict(results[0], courses=[], progress=[], assignments=0, exams=0)
+    for r in results:
+        for key in ("courses", "progress", "assignments", "exams"):
+            merged[key] += r[key]
+    return merged
+
+
+@shards.fan_out(_merge_summaries)
+def get_student_summary(student_id):
+    """
+    Everything the student dashboard needs in one query:
+    {"courses": [(id, name)], "assignments": int, "exams": int,
+     "points": int, "progress": [(course_name, completion_percent)]}
     """
-    c.execute('''
-        SELECT
-            c.name,
-            CASE
-                WHEN (SELECT COUNT(*) FROM assignments a WHERE a.course_id = c.id) = 0 THEN 0.0
-                ELSE (CAST(COALESCE(sub.count_submissions,0) AS FLOAT) * 100.0) /
-                     (SELECT COUNT(*) FROM assignments a WHERE a.course_id = c.id)
-            END AS progress
-        FROM courses c
-        JOIN enrollments e ON c.id = e.course_id
-        LEFT JOIN (
-            SELECT a.course_id, COUNT(s.id) AS count_submissions
-            FROM assignments a
-            LEFT JOIN submissions s ON a.id = s.assignment_id AND s.student_id = ?
-            GROUP BY a.course_id
-        ) sub ON sub.course_id = c.id
-        WHERE e.student_id = ?
-    ''', (student_id, student_id))
-    return c.fetchall()
+    with db.cursor() as c:
+        c.execute('''
+            SELECT
+                COALESCE((SELECT points FROM points WHERE student_id = :sid), 0)
+                    + COALESCE((SELECT SUM(points) FROM points_ledger WHERE student_id = :sid), 0),
+                c.id, c.name,
+                COALESCE(cs.assignment_count, 0),
+                (SELECT COUNT(*) FROM exams x WHERE x.course_id = c.id),
+                CASE
+                    WHEN COALESCE(cs.assignment_count, 0) = 0 THEN 0.0
+                    ELSE (CAST(COALESCE(ss.submission_count, 0) AS FLOAT) * 100.0) / cs.assignment_count
+                END
+            FROM (SELECT :sid AS sid) me
+            LEFT JOIN enrollments e ON e.student_id = me.sid
+            LEFT JOIN courses c ON c.id = e.course_id
+            LEFT JOIN course_stats cs ON cs.course_id = e.course_id
+            LEFT JOIN student_course_stats ss ON ss.student_id = e.student_id AND ss.course_id = e.course_id
+        ''', {"sid": student_id})
+        rows = c.fetchall()
+    courses = [r for r in rows if r[1] is not None]
+    return {
+        "courses": [(r[1], r[2]) for r in courses],
+        "assignments": sum(r[3] for r in courses),
+        "exams": sum(r[4] for r in courses),
+        "points": rows[0][0],
+        "progress": [(r[2], r[5]) for r in courses],
+    }
+
+
+@shards.fan_out(shards.concat)
+def check_progress_counters():
+    """Return (table, course_id, student_id, stored, actual) for every drifted counter."""
+    with db.cursor() as c:
+        return migrations.check_counters(c)
+
+
+@shards.fan_out(lambda results: None)
+def rebuild_progress_counters():
+    """Recompute the progress counters from scratch."""
+    with db.transaction() as c:
+        migrations.rebuild_counters(c)
+
+# ---------------- READ CACHE -----------------
+def get_cache_stats():
+    """Hit/miss statistics of the shared read cache (see cache.py)."""
+    return cache.stats()
+
+
+# ---------------- INSTRUMENTATION -----------------
+metrics.instrument(globals(), "backend")
@@ -0,0 +1,1457 @@
+# bench.py
+"""
+Micro-benchmarks for the LMS backend.
+
+Each benchmark runs against a throwaway database in a temp directory so it
+never touches lms.db. Run one with:
+
+    python bench.py <name> [options]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import db
+import passwords
+
+
+# ---------------- HELPERS -----------------
+def fresh_db(size=None):
+    """Point the pool at a freshly migrated temp database and return its path."""
+    import migrations
+    folder = tempfile.mkdtemp(prefix="lms_bench_")
+    path = os.path.join(folder, "bench.db")
+    db.configure(path, size=size)
+    migrations.ensure_current()
+    return path
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def run_threads(n, target):
+    threads = [threading.Thread(target=target) for _ in range(n)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+# ---------------- BENCHMARKS -----------------
+def bench_pool_reads(args):
+    """Concurrent read throughput through the connection pool."""
+    fresh_db(size=max(args.threads))
+    import backend as bk
+
+    with db.transaction() as c:
+        c.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'Student')",
+                      ((f"s{i}",) for i in range(args.rows)))
+        c.execute("INSERT INTO points (student_id, points) SELECT id, id % 997 FROM users")
+
+    print(f"{'threads':>8} {'queries':>8} {'seconds':>8} {'q/s':>10}")
+    for n in args.threads:
+        per_thread = args.queries // n
+
+        def worker():
+            for _ in range(per_thread):
+                bk.get_leaderboard()
+
+        elapsed = run_threads(n, worker)
+        total = per_thread * n
+        print(f"{n:>8} {total:>8} {elapsed:>8.3f} {total / elapsed:>10.1f}")
+
+
+# Hot backend calls and the indexes their statements must use. The plans
+# come from the SQL each call actually executes (metrics.STATEMENT_HOOKS),
+# so a rewritten query is checked as soon as it ships. Fresh users tables
+# carry email UNIQUE, so SQLite may prefer that autoindex over
+# ix_users_email_role; a tuple lists acceptable alternatives.
+def _hot_calls(student, teacher_course, email, username):
+    import auth
+    import backend as bk
+    return [
+        ("get_enrolled_courses", lambda: bk.get_enrolled_courses.uncached(student),
+         ["ux_enrollments_student_course"]),
+        ("count_enrolled_students", lambda: bk.count_enrolled_students(teacher_course),
+         ["ix_enrollments_course"]),
+        ("get_assignments", lambda: bk.get_assignments.uncached(teacher_course), ["ix_assignments_course"]),
+        ("get_exams", lambda: bk.get_exams.uncached(teacher_course), ["ix_exams_course"]),
+        ("get_notes", lambda: bk.get_notes.uncached(teacher_course), ["ix_notes_course"]),
+        ("search_courses", lambda: bk.search_courses(student, "cour"),
+         ["ux_enrollments_student_course", "VIRTUAL TABLE INDEX"]),
+        ("get_teacher_student_performance_page",
+         lambda: bk.get_teacher_student_performance_page(teacher_course),
+         ["ix_enrollments_course", "ux_submissions_student_assignment", "ix_assignments_course",
+          "ux_exam_submissions_student_exam", "ix_exams_course"]),
+        ("get_ungraded_submissions", lambda: bk.get_ungraded_submissions(teacher_course),
+         ["ix_assignments_course", "ix_submissions_ungraded"]),
+        ("get_ungraded_submissions exam", lambda: bk.get_ungraded_submissions(teacher_course, "exam"),
+         ["ix_exams_course", "ix_exam_submissions_ungraded"]),
+        ("get_student_grades", lambda: bk.get_student_grades(student),
+         ["ux_submissions_student_assignment", "ux_exam_submissions_student_exam"]),
+        ("get_course_progress", lambda: bk.get_course_progress(student), ["ux_enrollments_student_course"]),
+        ("get_user_points", lambda: bk.get_user_points(student),
+         ["sqlite_autoindex_points_1", "ix_points_ledger_student"]),
+        ("get_leaderboard_page", lambda: bk.get_leaderboard_page(10),
+         ["ix_points_rank", "SEARCH q USING INTEGER PRIMARY KEY"]),
+        ("get_rank", lambda: bk.get_rank(student),
+         ["sqlite_autoindex_points_1", "SEARCH q USING INTEGER PRIMARY KEY"]),
+        ("verify_login", lambda: auth.verify_login(email, "wrong", "Student"),
+         [("ix_users_email_role", "sqlite_autoindex_users_2")]),
+        ("authenticate username", lambda: auth.authenticate("username", username, "wrong", "Student"),
+         ["sqlite_autoindex_users_1"]),
+    ]
+
+
+def _captured_plans(fn):
+    """Run fn and return the query plan of every SELECT/WITH it executed."""
+    import metrics
+    statements = []
+
+    def capture(cursor, sql, params):
+        if params is not None and sql.lstrip()[:4].upper() in ("SELE", "WITH"):
+            statements.append((sql, params))
+
+    metrics.STATEMENT_HOOKS.append(capture)
+    try:
+        fn()
+    finally:
+        metrics.STATEMENT_HOOKS.remove(capture)
+    plans = []
+    with db.cursor() as c:
+        for sql, params in statements:
+            c.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plans.append(" | ".join(row[3] for row in c.fetchall()))
+    return plans
+
+
+def bench_query_plans(args):
+    """Check that the statements behind every hot call use their indexes."""
+    import backend as bk
+    import metrics
+    import seed
+
+    fresh_db()
+    seed.generate(**seed.SCALES["tiny"], log=lambda msg: None)
+    with db.cursor() as c:
+        c.execute("SELECT id, email, username FROM users WHERE role = 'Student' ORDER BY id LIMIT 1")
+        student, email, username = c.fetchone()
+        c.execute("SELECT course_id FROM enrollments WHERE student_id = ? LIMIT 1", (student,))
+        course = c.fetchone()[0]
+    bk.compact_points()   # start from the plain index-only leaderboard
+    was_enabled = metrics.ENABLED
+    metrics.enable()
+    calls = _hot_calls(student, course, email, username)
+    # Run the board reads again with a ledger award pending, which switches
+    # them onto their PENDING_POINTS_CTE variants.
+    calls.append(("pending award", lambda: bk.queue_points([(student, 5)]), []))
+    calls += [(label + " pending", fn, expected) for label, fn, expected in calls
+              if label in ("get_leaderboard_page", "get_rank")]
+
+    failures = 0
+    try:
+        for label, fn, expected in calls:
+            plan = " || ".join(_captured_plans(fn))
+            if not expected:
+                continue
+            missing = [want for want in expected
+                       if not any(w in plan for w in ((want,) if isinstance(want, str) else want))]
+            failures += bool(missing) or not plan
+            print(f"{'FAIL' if missing or not plan else 'ok  '} {label:<38} {plan}")
+            for want in missing:
+                print(f"     missing: {want}")
+    finally:
+        if not was_enabled:
+            metrics.disable()
+    if failures:
+        raise SystemExit(f"{failures} hot calls do not use their indexes")
+
+
+def _legacy_performance(course_id):
+    """The original per-student N+1 report, kept as the reference output."""
+    import backend as bk
+    data = []
+    with db.cursor() as c:
+        for sid, name in bk.get_enrolled_students(course_id):
+            c.execute("""SELECT a.title FROM assignments a
+                         JOIN submissions s ON a.id = s.assignment_id
+                         WHERE s.student_id=? AND a.course_id=? ORDER BY a.id""", (sid, course_id))
+            done = [r[0] for r in c.fetchall()]
+            c.execute("""SELECT e.title FROM exams e
+                         JOIN exam_submissions s ON e.id = s.exam_id
+                         WHERE s.student_id=? AND e.course_id=? ORDER BY e.id""", (sid, course_id))
+            exams = [r[0] for r in c.fetchall()]
+            data.append({
+                "Student Name": name,
+                "Assignments Submitted": len(done),
+                "Assignment Titles": ", ".join(done) if done else "None",
+                "Exams Attempted": len(exams),
+                "Exam Titles": ", ".join(exams) if exams else "None"
+            })
+    return data
+
+
+def bench_performance_report(args):
+    """Set-based teacher report vs the per-student loop; outputs must match."""
+    import random
+    fresh_db()
+    import backend as bk
+
+    rng = random.Random(1)
+    students = args.rows // 10 or 1
+    with db.transaction() as c:
+        c.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'Student')",
+                      ((f"s{i}",) for i in range(students)))
+        c.execute("INSERT INTO courses (name, teacher_id) VALUES ('Big Course', 0)")
+        c.execute("INSERT INTO enrollments (student_id, course_id) SELECT id, 1 FROM users")
+        c.executemany("INSERT INTO assignments (course_id, title) VALUES (1, ?)", ((f"A{i}",) for i in range(10)))
+        c.executemany("INSERT INTO exams (course_id, title) VALUES (1, ?)", ((f"E{i}",) for i in range(3)))
+        c.executemany("INSERT INTO submissions (student_id, assignment_id, answer) VALUES (?, ?, 'x')",
+                      ((s, a) for s in range(1, students + 1) for a in range(1, 11) if rng.random() < 0.6))
+        c.executemany("INSERT INTO exam_submissions (student_id, exam_id, answer) VALUES (?, ?, 'x')",
+                      ((s, e) for s in range(1, students + 1) for e in range(1, 4) if rng.random() < 0.5))
+
+    t_old, old = timed(_legacy_performance, 1)
+    t_new, new = timed(bk.get_teacher_student_performance, 1)
+    t_first, _ = timed(lambda: next(bk.iter_teacher_student_performance(1, page_size=50)))
+    streamed = list(bk.iter_teacher_student_performance(1, page_size=97))
+    if not (old == new == streamed):
+        raise SystemExit("set-based report differs from the per-student reference")
+    print(f"students={students}  per-student loop={t_old:.3f}s  set-based={t_new:.3f}s  "
+          f"first page={t_first * 1000:.1f}ms  speedup={t_old / t_new:.1f}x")
+
+
+def _legacy_add_points(student_id, points):
+    """The original read-modify-write award, kept as the baseline."""
+    with db.transaction() as c:
+        c.execute("SELECT points FROM points WHERE student_id=?", (student_id,))
+        row = c.fetchone()
+        if row:
+            c.execute("UPDATE points SET points=? WHERE student_id=?", (row[0] + points, student_id))
+        else:
+            c.execute("INSERT INTO points (student_id, points) VALUES (?, ?)", (student_id, points))
+
+
+def bench_points_awards(args):
+    """Awards per second: read-modify-write vs UPSERT vs batch vs ledger + compaction."""
+    import random
+    fresh_db()
+    import backend as bk
+
+    rng = random.Random(1)
+    students = 1000
+    awards = [(rng.randint(1, students), rng.choice((10, 20))) for _ in range(args.rows)]
+    expected = {}
+    for sid, pts in awards:
+        expected[sid] = expected.get(sid, 0) + pts
+
+    def batched(fn):
+        for i in range(0, len(awards), args.batch):
+            fn(awards[i:i + args.batch])
+
+    def ledger():
+        batched(bk.queue_points)
+        bk.compact_points()
+
+    cases = [
+        ("read-modify-write", lambda: [_legacy_add_points(s, p) for s, p in awards]),
+        ("upsert", lambda: [bk.add_points(s, p) for s, p in awards]),
+        (f"upsert batch={args.batch}", lambda: batched(bk.add_points_many)),
+        (f"ledger batch={args.batch}", ledger),
+    ]
+    print(f"{'method':<24} {'awards':>8} {'seconds':>8} {'awards/s':>10}")
+    for name, fn in cases:
+        with db.transaction() as c:
+            c.execute("DELETE FROM points")
+        elapsed, _ = timed(fn)
+        with db.cursor() as c:
+            c.execute("SELECT student_id, points FROM points")
+            if dict(c.fetchall()) != expected:
+                raise SystemExit(f"{name}: totals do not match the awards")
+        print(f"{name:<24} {len(awards):>8} {elapsed:>8.3f} {len(awards) / elapsed:>10.0f}")
+
+
+LEGACY_PROGRESS_SQL = '''
+    SELECT c.name,
+           CASE
+               WHEN (SELECT COUNT(*) FROM assignments a WHERE a.course_id = c.id) = 0 THEN 0.0
+               ELSE (CAST(COALESCE(sub.count_submissions,0) AS FLOAT) * 100.0) /
+                    (SELECT COUNT(*) FROM assignments a WHERE a.course_id = c.id)
+           END AS progress
+    FROM courses c
+    JOIN enrollments e ON c.id = e.course_id
+    LEFT JOIN (
+        SELECT a.course_id, COUNT(s.id) AS count_submissions
+        FROM assignments a
+        LEFT JOIN submissions s ON a.id = s.assignment_id AND s.student_id = ?
+        GROUP BY a.course_id
+    ) sub ON sub.course_id = c.id
+    WHERE e.student_id = ?
+'''
+
+
+def bench_course_progress(args):
+    """
+    get_course_progress on counter tables vs the original grouped subquery,
+    at --submissions rows (default 1M; pass e.g. --submissions 20000 for a
+    quick run).
+    """
+    import random
+    fresh_db()
+    import backend as bk
+
+    rng = random.Random(1)
+    courses, per_course, per_student = 2000, 20, 5
+    students = max(args.submissions // (per_course * per_student), 1)
+    start = time.perf_counter()
+    with db.transaction() as c:
+        c.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'Student')",
+                      ((f"s{i}",) for i in range(students)))
+        c.executemany("INSERT INTO courses (name, teacher_id) VALUES (?, 0)",
+                      ((f"Course {i}",) for i in range(courses)))
+        c.executemany("INSERT INTO assignments (course_id, title) VALUES (?, ?)",
+                      ((cid, f"A{k}") for cid in range(1, courses + 1) for k in range(per_course)))
+        enrolled = {sid: rng.sample(range(1, courses + 1), per_student) for sid in range(1, students + 1)}
+        c.executemany("INSERT INTO enrollments (student_id, course_id) VALUES (?, ?)",
+                      ((sid, cid) for sid, cids in enrolled.items() for cid in cids))
+        c.executemany("INSERT INTO submissions (student_id, assignment_id, answer) VALUES (?, ?, 'x')",
+                      ((sid, (cid - 1) * per_course + k + 1)
+                       for sid, cids in enrolled.items() for cid in cids for k in range(per_course)))
+        c.execute("SELECT COUNT(*) FROM submissions")
+        total = c.fetchone()[0]
+    print(f"seeded {total} submissions for {students} students in {time.perf_counter() - start:.1f}s")
+
+    if bk.check_progress_counters():
+        raise SystemExit("progress counters drifted from the seeded data")
+    sample = rng.sample(range(1, students + 1), min(args.queries, students))
+
+    def legacy():
+        with db.cursor() as c:
+            return [c.execute(LEGACY_PROGRESS_SQL, (sid, sid)).fetchall() for sid in sample]
+
+    t_old, old = timed(legacy)
+    t_new, new = timed(lambda: [bk.get_course_progress(sid) for sid in sample])
+    if [sorted(r) for r in old] != [sorted(r) for r in new]:
+        raise SystemExit("counter-based progress differs from the original query")
+    print(f"{len(sample)} dashboards  original={t_old / len(sample) * 1000:.2f}ms  "
+          f"counters={t_new / len(sample) * 1000:.3f}ms  speedup={t_old / t_new:.0f}x")
+    elapsed, drift = timed(bk.check_progress_counters)
+    print(f"consistency check {elapsed:.2f}s, {len(drift)} drifted")
+
+
+class QueryCounter:
+    """
+    Counts statements run on pool connections opened after install(). The
+    app's own background workers are left out, so a count covers only the
+    work done for the caller.
+    """
+    BACKGROUND = {"points-compactor", "group-commit-writer", "pdf-pipeline", "answer-indexer"}
+
+    def __init__(self):
+        self.statements = []
+
+    def install(self):
+        db.CONNECT_HOOKS.append(lambda conn: conn.set_trace_callback(self._trace))
+        return self
+
+    def _trace(self, sql):
+        if threading.current_thread().name not in self.BACKGROUND:
+            self.statements.append(sql)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+DASHBOARD_QUERY_CAP = 1
+
+
+def _render_student_dashboard(email, password, counter):
+    """
+    Statements in one cold rerun of app.py's student dashboard. Renders the
+    page with Streamlit's AppTest when Streamlit is installed; otherwise
+    replays the backend calls that rerun makes.
+    """
+    import backend as bk
+    import cache
+
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        AppTest = None
+    if AppTest is not None:
+        at = AppTest.from_file(APP_PATH, default_timeout=120)
+        dict(_session_steps("Student", email, password))["login"](at)
+        cache.clear()
+        counter.statements.clear()
+        at.run()
+        if at.exception:
+            raise SystemExit(f"student dashboard: {at.exception[0].value}")
+        return len(counter)
+
+    import auth
+    uid = auth.verify_login(email, password, "Student")[0]
+    cache.clear()
+    counter.statements.clear()
+    bk.init()
+    bk.start_pdf_pipeline()
+    bk.get_student_summary(uid)
+    return len(counter)
+
+
+def bench_dashboard_queries(args):
+    """Queries per student dashboard render; fails above DASHBOARD_QUERY_CAP."""
+    import auth
+    import pdf_pipeline
+
+    counter = QueryCounter().install()
+    fresh_db(size=1)
+    import backend as bk
+
+    courses = 20
+    email, password = "s@example.com", "dashboard"
+    auth.signup_user("s", email, password, "Student")
+    with db.transaction() as c:
+        c.execute("SELECT id FROM users WHERE email = ?", (email,))
+        uid = c.fetchone()[0]
+        c.executemany("INSERT INTO courses (name, teacher_id) VALUES (?, 0)",
+                      ((f"Course {i}",) for i in range(courses)))
+        c.execute("INSERT INTO enrollments (student_id, course_id) SELECT ?, id FROM courses", (uid,))
+        c.execute("INSERT INTO assignments (course_id, title) SELECT id, 'A' FROM courses")
+        c.execute("INSERT INTO exams (course_id, title) SELECT id, 'E' FROM courses")
+    bk.add_points(uid, 30)
+
+    def legacy():
+        enrolled = bk.get_enrolled_courses(uid)
+        return (len(enrolled), sum(len(bk.get_assignments(cid)) for cid, _ in enrolled),
+                sum(len(bk.get_exams(cid)) for cid, _ in enrolled),
+                bk.get_user_points(uid), bk.get_course_progress(uid))
+
+    counter.statements.clear()
+    old = legacy()
+    old_queries = len(counter)
+    summary = bk.get_student_summary(uid)
+    new = (len(summary["courses"]), summary["assignments"], summary["exams"],
+           summary["points"], summary["progress"])
+    if old != new:
+        raise SystemExit("get_student_summary disagrees with the per-course calls")
+    try:
+        new_queries = _render_student_dashboard(email, password, counter)
+    finally:
+        pdf_pipeline.stop()
+    print(f"{courses} courses: per-course calls={old_queries} queries, dashboard render={new_queries} queries")
+    for sql in counter.statements:
+        print(f"  {' '.join(sql.split())[:100]}")
+    if new_queries > DASHBOARD_QUERY_CAP:
+        raise SystemExit(f"dashboard render ran {new_queries} queries (cap {DASHBOARD_QUERY_CAP})")
+
+
+def bench_uploads(args):
+    """Peak memory and throughput of whole-buffer writes vs the streaming blob store."""
+    import tracemalloc
+    import storage
+
+    folder = os.path.dirname(fresh_db())
+    storage.STORE_DIR = os.path.join(folder, "blobs")
+    src = os.path.join(folder, "upload.pdf")
+    size = args.mb * 1024 * 1024
+    with open(src, "wb") as f:
+        for _ in range(args.mb):
+            f.write(os.urandom(1024 * 1024))
+
+    def whole_buffer():
+        with open(src, "rb") as f:
+            data = f.read()
+        with open(os.path.join(folder, "legacy.pdf"), "wb") as out:
+            out.write(data)
+
+    cases = [
+        ("whole buffer", whole_buffer),
+        ("streamed, new blob", lambda: storage.store(src)),
+        ("streamed, duplicate", lambda: storage.store(src)),
+    ]
+    print(f"{'method':<22} {'MB':>6} {'seconds':>8} {'MB/s':>8} {'peak MB':>8}")
+    for name, fn in cases:
+        tracemalloc.start()
+        elapsed, _ = timed(fn)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:<22} {args.mb:>6} {elapsed:>8.3f} {size / elapsed / 2**20:>8.0f} {peak / 2**20:>8.1f}")
+
+
+def bench_material_render(args):
+    """Notes page render cost vs number of PDFs: eager reads vs metadata-only render."""
+    import io
+    import storage
+
+    folder = os.path.dirname(fresh_db())
+    storage.STORE_DIR = os.path.join(folder, "blobs")
+    import backend as bk
+
+    print(f"{'notes':>6} {'eager ms':>9} {'lazy ms':>9} {'one download ms':>16}")
+    for count in args.counts:
+        with db.transaction() as c:
+            c.execute("INSERT INTO courses (name, teacher_id) VALUES ('Notes', 0)")
+            cid = c.lastrowid
+        for i in range(count):
+            bk.upload_note(cid, io.BytesIO(os.urandom(args.kb * 1024)))
+        notes = bk.get_notes(cid)
+
+        def eager():
+            for _, path, _ in notes:
+                with open(path, "rb") as f:
+                    f.read()
+
+        def lazy():
+            return [(os.path.basename(path), size) for _, path, size in bk.get_notes(cid)]
+
+        t_eager, _ = timed(eager)
+        t_lazy, _ = timed(lazy)
+        t_one, _ = timed(storage.read_file, notes[0][1])
+        print(f"{count:>6} {t_eager * 1000:>9.2f} {t_lazy * 1000:>9.3f} {t_one * 1000:>16.3f}")
+
+
+def bench_bulk_import(args):
+    """Bulk user + enrollment import vs one signup/enroll_course call per row."""
+    import importer
+    fresh_db()
+    import auth
+    import backend as bk
+
+    students, courses = max(args.rows // 20, 1), 500
+    hashed = passwords.hash_password("pw")   # pre-hashed rows skip the KDF on import
+    users = [(f"s{i}", f"s{i}@uni.edu", hashed, "Student") for i in range(students)]
+    t_users, res = timed(importer.import_users, users)
+    print(f"import_users: {res['inserted']} users in {t_users:.2f}s")
+    with db.transaction() as c:
+        c.executemany("INSERT INTO courses (name, teacher_id) VALUES (?, 0)",
+                      ((f"Course {i}",) for i in range(courses)))
+    pairs = [(1 + i % students, 1 + (i // students) % courses) for i in range(args.rows)]
+    t_bulk, res = timed(importer.import_enrollments, pairs)
+    print(f"import_enrollments: {res['inserted']} enrollments in {t_bulk:.2f}s "
+          f"({res['inserted'] / t_bulk:.0f}/s)")
+    t_again, res = timed(importer.import_enrollments, pairs[:args.queries])
+    print(f"re-import {args.queries} rows: {len(res['conflicts'])} conflicts reported in {t_again:.3f}s")
+
+    sample = args.queries
+    t_user_loop, _ = timed(lambda: [auth.signup_user(f"x{i}", f"x{i}@uni.edu", "pw", "Student")
+                                    for i in range(sample)])
+    t_enroll_loop, _ = timed(lambda: [bk.enroll_course(students + 1 + i, 1) for i in range(sample)])
+    print(f"per-row calls: signup_user {sample / t_user_loop:.0f}/s, "
+          f"enroll_course {sample / t_enroll_loop:.0f}/s")
+
+
+def _legacy_submit(student_id, assignment_id, answer):
+    """The original SELECT then UPDATE/INSERT submission with its own commit."""
+    with db.transaction() as c:
+        c.execute("SELECT id FROM submissions WHERE student_id=? AND assignment_id=?", (student_id, assignment_id))
+        row = c.fetchone()
+        if row:
+            c.execute("UPDATE submissions SET answer=?, submission_date='now' WHERE id=?", (answer, row[0]))
+        else:
+            c.execute("""INSERT INTO submissions (student_id, assignment_id, answer, submission_date)
+                         VALUES (?, ?, ?, 'now')""", (student_id, assignment_id, answer))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def bench_submission_burst(args):
+    """N concurrent submitters at a deadline: per-request commits vs group commit."""
+    fresh_db(size=16)
+    import backend as bk
+    import ingest
+
+    with db.transaction() as c:
+        c.execute("INSERT INTO courses (name, teacher_id) VALUES ('Deadline', 0)")
+        c.execute("INSERT INTO assignments (course_id, title) VALUES (1, 'Final')")
+        c.execute("INSERT INTO exams (course_id, title) VALUES (1, 'Final')")
+
+    bk._numpy_module("similarity")   # one-off import of NumPy, not part of any burst
+
+    def burst(submit):
+        latencies = []
+        gate = threading.Barrier(args.submitters)
+
+        def submitter(sid):
+            gate.wait()
+            start = time.perf_counter()
+            submit(sid)
+            latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=submitter, args=(sid,)) for sid in range(1, args.submitters + 1)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - start, latencies
+
+    cases = [
+        ("per-request commit", lambda sid: _legacy_submit(sid, 1, "answer")),
+        ("group commit", lambda sid: bk.submit_assignment(sid, 1, "answer")),
+        ("group commit (resubmit)", lambda sid: bk.submit_assignment(sid, 1, "answer v2")),
+    ]
+    print(f"{'method':<24} {'subs':>6} {'wall s':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, fn in cases:
+        with db.transaction() as c:
+            if not name.endswith("(resubmit)"):
+                c.execute("DELETE FROM submissions")
+        wall, lat = burst(fn)
+        with db.cursor() as c:
+            c.execute("SELECT COUNT(*) FROM submissions")
+            if c.fetchone()[0] != args.submitters:
+                raise SystemExit(f"{name}: lost submissions")
+        print(f"{name:<24} {len(lat):>6} {wall:>7.2f} {percentile(lat, 50) * 1000:>8.1f} "
+              f"{percentile(lat, 99) * 1000:>8.1f} {max(lat) * 1000:>8.1f}")
+    writer = ingest.get_writer()
+    print(f"group commit: {writer.rows} rows in {writer.batches} transactions")
+    ingest.stop_writer()
+    similarity = bk._numpy_module("similarity")
+    if similarity is not None:
+        indexer = similarity.get_indexer()
+        elapsed, _ = timed(indexer.flush)
+        print(f"answer index: {indexer.indexed} indexed in {indexer.batches} transactions, "
+              f"{indexer.failed} failed, drained {elapsed:.2f}s after the last commit")
+        similarity.stop_indexer()
+
+
+# Public functions the suite deliberately does not time.
+SUITE_SKIP = {
+    "backend.start_points_compactor": "starts a background thread",
+    "backend.create_tables_and_migrate": "no-op once migrated (see query_plans)",
+    "auth.migrate_users_table": "no-op once migrated (see query_plans)",
+    "backend.rebuild_answer_index": "full rebuild; timed by answer_similarity",
+    "backend.start_pdf_pipeline": "starts a process pool; timed by pdf_pipeline",
+}
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+
+def _suite_cases(bk, auth):
+    """(name, callable) for every public backend/auth function, on seeded data."""
+    import io
+    import itertools
+    seq = itertools.count(1)
+    with db.cursor() as c:
+        c.execute("SELECT MAX(id) FROM users WHERE role = 'Student'")
+        students = c.fetchone()[0]
+        c.execute("SELECT id, teacher_id FROM courses ORDER BY id LIMIT 1")
+        course, teacher = c.fetchone()
+        c.execute("SELECT MIN(id) FROM assignments WHERE course_id = ?", (course,))
+        assignment = c.fetchone()[0]
+        c.execute("SELECT MIN(id) FROM exams WHERE course_id = ?", (course,))
+        exam = c.fetchone()[0]
+        c.execute("SELECT MAX(id) FROM courses")
+        courses = c.fetchone()[0]
+        c.execute("SELECT email FROM users WHERE id = 1")
+        email = c.fetchone()[0]
+    pdf = b"%PDF-1.4 synthetic\n" * 64
+
+    def raw(fn):
+        return getattr(fn, "uncached", fn)   # time the query, not the read cache
+
+    def student():
+        return 1 + next(seq) % students
+
+    return {
+        "auth.signup_user": lambda: auth.signup_user(f"bench{next(seq)}", f"bench{next(seq)}@x", "pw", "Student"),
+        "auth.authenticate": lambda: auth.authenticate("username", "user1", "password", "Student"),
+        "auth.verify_login": lambda: auth.verify_login(email, "password", "Student"),
+        "backend.init": lambda: bk.init(),
+        "backend.signup": lambda: bk.signup(f"legacy{next(seq)}", "pw", "Student"),
+        "backend.login": lambda: bk.login("user1", "password", "Student"),
+        "backend.add_course": lambda: bk.add_course(f"Bench {next(seq)}", teacher),
+        "backend.get_courses": lambda: raw(bk.get_courses)(),
+        "backend.get_enrolled_courses": lambda: raw(bk.get_enrolled_courses)(student()),
+        "backend.search_courses": lambda: bk.search_courses(student(), "cour 1", 20),
+        "backend.enroll_course": lambda: bk.enroll_course(student(), 1 + next(seq) % courses),
+        "backend.count_enrolled_students": lambda: bk.count_enrolled_students(course),
+        "backend.get_enrolled_students": lambda: raw(bk.get_enrolled_students)(course),
+        "backend.add_assignment": lambda: bk.add_assignment(course, "Bench", io.BytesIO(pdf)),
+        "backend.get_assignments": lambda: raw(bk.get_assignments)(course),
+        "backend.upload_note": lambda: bk.upload_note(course, io.BytesIO(pdf)),
+        "backend.get_notes": lambda: raw(bk.get_notes)(course),
+        "backend.create_exam": lambda: bk.create_exam(course, "Bench", io.BytesIO(pdf)),
+        "backend.get_exams": lambda: raw(bk.get_exams)(course),
+        "backend.get_pdf_details": lambda: raw(bk.get_pdf_details)(("missing.pdf",)),
+        "backend.search_materials": lambda: bk.search_materials(course, "lect"),
+        "backend.get_pdf_job_counts": lambda: bk.get_pdf_job_counts(),
+        "backend.submit_assignment": lambda: bk.submit_assignment(student(), assignment, "bench"),
+        "backend.submit_exam": lambda: bk.submit_exam(student(), exam, "bench"),
+        "backend.grade_submissions": lambda: bk.grade_submissions([(next(seq), 80, "ok")]),
+        "backend.get_ungraded_submissions": lambda: bk.get_ungraded_submissions(course),
+        "backend.get_suspicious_pairs": lambda: bk.get_suspicious_pairs(assignment),
+        "backend.get_grade_stats": lambda: bk.get_grade_stats(course),
+        "backend.get_student_grades": lambda: bk.get_student_grades(student()),
+        "backend.get_teacher_student_performance_page": lambda: bk.get_teacher_student_performance_page(course),
+        "backend.iter_teacher_student_performance": lambda: next(bk.iter_teacher_student_performance(course)),
+        "backend.get_teacher_student_performance": lambda: bk.get_teacher_student_performance(course),
+        "backend.add_points": lambda: bk.add_points(student(), 10),
+        "backend.add_points_many": lambda: bk.add_points_many([(student(), 10) for _ in range(100)]),
+        "backend.queue_points": lambda: bk.queue_points([(student(), 10) for _ in range(100)]),
+        "backend.compact_points": lambda: bk.compact_points(),
+        "backend.get_user_points": lambda: bk.get_user_points(student()),
+        "backend.get_leaderboard": lambda: bk.get_leaderboard(),
+        "backend.get_leaderboard_page": lambda: bk.get_leaderboard_page(10),
+        "backend.get_rank": lambda: bk.get_rank(student()),
+        "backend.get_course_progress": lambda: bk.get_course_progress(student()),
+        "backend.get_student_summary": lambda: bk.get_student_summary(student()),
+        "backend.check_progress_counters": lambda: bk.check_progress_counters(),
+        "backend.rebuild_progress_counters": lambda: bk.rebuild_progress_counters(),
+        "backend.get_cache_stats": lambda: bk.get_cache_stats(),
+    }
+
+
+def _public_functions(module, prefix):
+    return {f"{prefix}.{name}" for name, fn in vars(module).items()
+            if not name.startswith("_") and callable(fn) and not isinstance(fn, type)
+            and getattr(fn, "__module__", None) == module.__name__}
+
+
+def bench_suite(args):
+    """
+    Time every public backend/auth function on a seeded database and compare
+    the medians with the saved baseline. Fails on regressions.
+    """
+    import json
+    import statistics
+    import seed
+    import storage
+
+    folder = os.path.dirname(fresh_db())
+    storage.STORE_DIR = os.path.join(folder, "blobs")
+    import auth
+    import backend as bk
+    seed.generate(**seed.SCALES[args.scale])
+
+    cases = _suite_cases(bk, auth)
+    expected = (_public_functions(bk, "backend") | _public_functions(auth, "auth")) - set(SUITE_SKIP)
+    missing = sorted(expected - set(cases))
+    if missing:
+        raise SystemExit(f"suite does not cover: {', '.join(missing)}")
+
+    results = {}
+    for name, fn in sorted(cases.items()):
+        fn()   # warm up
+        samples = [timed(fn)[0] for _ in range(args.repeat)]
+        results[name] = statistics.median(samples) * 1000
+
+    results["startup.import"] = startup_seconds() * 1000
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        baseline = saved["results"] if saved.get("scale") == args.scale else {}
+
+    regressions = []
+    print(f"{'function':<48} {'median ms':>10} {'baseline':>10} {'ratio':>7}")
+    for name, ms in results.items():
+        base = baseline.get(name)
+        ratio = ms / base if base else None
+        flag = ""
+        if ratio and ratio > args.tolerance and ms - base > 0.2:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<48} {ms:>10.3f} {base if base else float('nan'):>10.3f} "
+              f"{ratio if ratio else float('nan'):>7.2f}{flag}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"scale": args.scale, "repeat": args.repeat, "results": results}, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+    if regressions:
+        raise SystemExit(f"{len(regressions)} functions regressed more than {args.tolerance}x")
+
+
+# ---------------- STARTUP -----------------
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STARTUP_MODULES = "backend, auth, export, storage, cache, metrics"
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "streamlit")
+
+
+def _import_run(code, cwd, importtime=False):
+    """Run `code` in a fresh interpreter from `cwd`; returns (seconds, CompletedProcess)."""
+    import subprocess
+    import sys
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE="1")
+    start = time.perf_counter()
+    done = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, done
+
+
+def startup_seconds(repeat=5):
+    """Median wall time of a fresh interpreter importing the backend modules."""
+    import statistics
+    cwd = tempfile.mkdtemp(prefix="lms_startup_")
+    bare = statistics.median(_import_run("pass", cwd)[0] for _ in range(repeat))
+    full = statistics.median(_import_run(f"import {STARTUP_MODULES}", cwd)[0] for _ in range(repeat))
+    return full - bare
+
+
+def bench_startup(args):
+    """
+    Cold-import cost of the backend in a fresh interpreter (python -X importtime),
+    and checks that importing runs no DDL, creates no files and loads no
+    heavy optional dependencies.
+    """
+    cwd = tempfile.mkdtemp(prefix="lms_startup_")
+    check = (f"import sys; import {STARTUP_MODULES}; "
+             f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    loaded = _import_run(check, cwd)[1].stdout.strip()
+    created = os.listdir(cwd)
+    profile = _import_run(f"import {STARTUP_MODULES}", cwd, importtime=True)[1].stderr
+    modules = []
+    for line in profile.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if not name.startswith("  ") or name.strip() in STARTUP_MODULES:
+                modules.append((int(cumulative), name.strip()))
+    print("slowest top-level imports (cumulative):")
+    for micros, name in sorted(modules, reverse=True)[:10]:
+        print(f"  {micros / 1000:7.1f} ms  {name}")
+    print(f"import {STARTUP_MODULES}: {startup_seconds(args.repeat) * 1000:.1f} ms over a bare interpreter")
+    if loaded:
+        raise SystemExit(f"importing the backend loaded {loaded}")
+    if created:
+        raise SystemExit(f"importing the backend created {created} in the working directory")
+
+
+# ---------------- LOGINS -----------------
+def bench_logins(args):
+    """
+    Logins per second at each scrypt cost, with --submitters concurrent
+    sessions sharing the hashing pool. Also checks the plaintext upgrade path.
+    """
+    fresh_db()
+    import auth
+
+    with db.transaction() as c:
+        c.execute("INSERT INTO users (username, email, password, role) VALUES ('legacy', 'legacy@x', 'pw', 'Student')")
+    if auth.verify_login("legacy@x", "pw", "Student") is None:
+        raise SystemExit("legacy plaintext login failed")
+    with db.cursor() as c:
+        c.execute("SELECT password FROM users WHERE username = 'legacy'")
+        if not passwords.is_hashed(c.fetchone()[0]):
+            raise SystemExit("legacy password was not rehashed")
+    if auth.verify_login("legacy@x", "wrong", "Student") or not auth.verify_login("legacy@x", "pw", "Student"):
+        raise SystemExit("rehashed password does not verify correctly")
+
+    sessions = min(args.submitters, 64)
+    print(f"{sessions} concurrent sessions, {passwords.WORKERS} hashing workers")
+    for cost in args.costs:
+        passwords.SCRYPT_N = cost
+        hashed = passwords.hash_password("pw")
+        with db.transaction() as c:
+            c.execute("DELETE FROM users WHERE username LIKE 'load%'")
+            c.executemany("INSERT INTO users (username, email, password, role) VALUES (?, ?, ?, 'Student')",
+                          ((f"load{i}", f"load{i}@x", hashed) for i in range(sessions)))
+        latencies = []
+        per_session = max(args.queries // sessions, 2)
+
+        def session(i=iter(range(sessions))):
+            email = f"load{next(i)}@x"
+            for _ in range(per_session):
+                seconds, user = timed(auth.verify_login, email, "pw", "Student")
+                if user is None:
+                    raise SystemExit("load login failed")
+                latencies.append(seconds)
+
+        elapsed = run_threads(sessions, session)
+        print(f"N=2^{cost.bit_length() - 1:<3} {len(latencies) / elapsed:8.1f} logins/s   "
+              f"p50 {percentile(latencies, 50) * 1000:7.1f} ms   p95 {percentile(latencies, 95) * 1000:7.1f} ms")
+
+
+# ---------------- ASYNC API -----------------
+def bench_async_requests(args):
+    """
+    Dashboard requests per second: a sync handler calling the four reads in
+    turn vs async handlers fanning them out with asyncio.gather, at several
+    concurrency levels. Caches are bypassed so every request hits SQLite.
+    """
+    import asyncio
+    import async_backend
+    import cache
+    import seed
+
+    fresh_db()
+    import backend as bk
+    seed.generate(**seed.SCALES[args.scale], log=lambda msg: None)
+    cache.MAX_ENTRIES = 0   # every call is a miss
+    with db.cursor() as c:
+        c.execute("SELECT MAX(id) FROM users WHERE role = 'Student'")
+        students = c.fetchone()[0]
+    requests = args.queries * 8
+
+    def sync_dashboard(uid):
+        return (bk.get_student_summary(uid), bk.get_rank(uid), bk.get_leaderboard_page(10),
+                bk.get_enrolled_courses(uid))
+
+    elapsed, _ = timed(lambda: [sync_dashboard(1 + i % students) for i in range(requests)])
+    print(f"sync, one request at a time:   {requests / elapsed:8.0f} req/s")
+
+    async def heartbeat(lags, stop):
+        """Largest delay of a 1 ms timer: how long the event loop was blocked."""
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            start = loop.time()
+            await asyncio.sleep(0.001)
+            lags.append(loop.time() - start - 0.001)
+
+    async def serve(handler, concurrency):
+        gate = asyncio.Semaphore(concurrency)
+        lags, stop = [], asyncio.Event()
+        beat = asyncio.create_task(heartbeat(lags, stop))
+
+        async def handle(uid):
+            async with gate:
+                return await handler(uid)
+        await asyncio.gather(*(handle(1 + i % students) for i in range(requests)))
+        stop.set()
+        await beat
+        return max(lags, default=0.0)
+
+    async def blocking_dashboard(uid):
+        return sync_dashboard(uid)   # sync backend called straight from a coroutine
+
+    elapsed, lag = timed(asyncio.run, serve(blocking_dashboard, 64))
+    print(f"sync calls inside the loop:     {requests / elapsed:8.0f} req/s   max loop stall {lag * 1000:7.1f} ms")
+    for concurrency in args.threads:
+        elapsed, lag = timed(asyncio.run, serve(async_backend.get_student_dashboard, concurrency))
+        print(f"async gather, {concurrency:>3} in flight:   {requests / elapsed:8.0f} req/s   "
+              f"max loop stall {lag * 1000:7.1f} ms")
+
+    async def submit_burst():
+        await asyncio.gather(*(async_backend.submit_assignment(1 + i % students, 1, f"async {i}")
+                               for i in range(requests)))
+    elapsed, _ = timed(asyncio.run, submit_burst())
+    print(f"async submissions (group commit): {requests / elapsed:5.0f} req/s")
+    async_backend.shutdown()
+
+
+# ---------------- SHARDED STORAGE -----------------
+def bench_sharded_writes(args):
+    """
+    Submission throughput with the catalog only vs course shard files, and
+    the latency of enrolments in one course while another course takes an
+    exam-deadline burst. Each writer thread submits to its own course.
+    """
+    import backend as bk
+    import ingest
+    import shards
+
+    courses = 8
+    writers = max(args.threads)
+    per_writer = max(args.rows // writers, 1)
+    print(f"{'shards':>6} {'subs/s':>8} {'commits':>8} {'enrol p50 ms':>13} {'enrol p99 ms':>13} {'max ms':>8}")
+    for n in args.shards:
+        fresh_db(size=2 * writers + 4)
+        shards.configure(n)
+        bk.init()
+        items = {}
+        for cid in range(1, courses + 1):
+            bk.add_course(f"Course {cid}", 0)
+            with shards.using(shards.shard_of_course(cid)), db.transaction() as c:
+                c.execute("INSERT INTO assignments (id, course_id, title) VALUES (?, ?, 'Final')",
+                          (shards.new_id("assignments"), cid))
+                items[cid] = c.lastrowid
+
+        def writer(n=[0], lock=threading.Lock()):
+            with lock:
+                n[0] += 1
+                w = n[0]
+            cid = 1 + w % courses
+            for i in range(per_writer):
+                bk.submit_assignment(w * per_writer + i, items[cid], f"answer {i}")
+
+        wall = run_threads(writers, writer)
+        commits = sum(w.batches for w in ingest._writers.values())
+        rate = writers * per_writer / wall
+
+        # Deadline burst on course 1 (submissions plus bulk grading) while
+        # enrolments trickle into course 2.
+        done, latencies = threading.Event(), []
+
+        def burst(n=[0], lock=threading.Lock()):
+            with lock:
+                n[0] += 1
+                w = n[0]
+            if w == 1:
+                while not done.is_set():
+                    rows, _ = bk.get_ungraded_submissions(1, limit=args.batch)
+                    bk.grade_submissions([(sid, 70, None) for sid, *_ in rows])
+                return
+            for i in range(per_writer):
+                bk.submit_assignment(10**6 + w * per_writer + i, items[1], f"deadline {i}")
+            done.set()
+
+        def enrol():
+            sid = 0
+            while not done.is_set():
+                sid += 1
+                latencies.append(timed(bk.enroll_course, sid, 2)[0])
+
+        probe = threading.Thread(target=enrol)
+        probe.start()
+        run_threads(writers, burst)
+        probe.join()
+        ingest.stop_writer()
+        print(f"{n:>6} {rate:>8.0f} {commits:>8} {percentile(latencies, 50) * 1000:>13.2f} "
+              f"{percentile(latencies, 99) * 1000:>13.2f} {max(latencies) * 1000:>8.1f}")
+    shards.configure(1)
+
+
+# ---------------- PDF PIPELINE -----------------
+def bench_pdf_pipeline(args):
+    """
+    Bulk upload of a semester of PDF materials: upload latency with inline
+    extraction vs queueing for the pipeline, pipeline throughput per worker
+    count, recovery of jobs leased by a crashed process, and retries of a
+    corrupt upload.
+    """
+    import cache
+    import pdf_pipeline
+    import storage
+    if not pdf_pipeline.available():
+        raise SystemExit("pdf_pipeline needs PyMuPDF (pip install pymupdf)")
+    import pymupdf
+
+    folder = os.path.dirname(fresh_db())
+    storage.STORE_DIR = os.path.join(folder, "blobs")
+    import backend as bk
+    bk.init()
+    courses, per_course = 10, max(args.pdfs // 10, 1)
+    files = []
+    for i in range(courses * per_course):
+        doc = pymupdf.open()
+        for p in range(args.pages):
+            doc.new_page().insert_text((72, 72), f"Course {i % courses} material {i} page {p}\n"
+                                       + "lecture topic derivation example exercise\n" * 30)
+        path = os.path.join(folder, f"material{i}.pdf")
+        doc.save(path)
+        doc.close()
+        files.append(path)
+    for cid in range(1, courses + 1):
+        bk.add_course(f"Course {cid}", 0)
+
+    def upload(i, path):
+        cid = 1 + i % courses
+        kind = i % 3
+        if kind == 0:
+            bk.add_assignment(cid, f"Assignment {i}", path)
+        elif kind == 1:
+            bk.upload_note(cid, path)
+        else:
+            bk.create_exam(cid, f"Exam {i}", path)
+
+    def reset():
+        with db.transaction() as c:
+            c.execute("DELETE FROM pdf_documents")
+            c.execute("UPDATE pdf_jobs SET status = 'pending', attempts = 0, run_after = 0, error = NULL")
+        cache.bump("pdf_documents")
+
+    half = len(files) // 2
+    inline = [timed(lambda: (upload(i, p), pdf_pipeline.extract(p)))[0] for i, p in enumerate(files[:half])]
+    queued = [timed(upload, i, p)[0] for i, p in enumerate(files[half:], half)]
+    print(f"{len(files)} PDFs x {args.pages} pages")
+    print(f"{'upload':<22} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, lat in (("inline extraction", inline), ("queued for pipeline", queued)):
+        print(f"{name:<22} {percentile(lat, 50) * 1000:>8.1f} {percentile(lat, 99) * 1000:>8.1f}")
+
+    print(f"{'workers':>7} {'docs/s':>8} {'seconds':>8}")
+    for workers in args.threads:
+        reset()
+        pipeline = pdf_pipeline.PdfPipeline(workers)
+        elapsed, _ = timed(pipeline.drain)
+        if pdf_pipeline.job_counts() != {"done": len(files)}:
+            raise SystemExit(f"{workers} workers: jobs left {pdf_pipeline.job_counts()}")
+        print(f"{workers:>7} {pipeline.processed / elapsed:>8.1f} {elapsed:>8.2f}")
+
+    # A process that claimed jobs and died: they come back once the lease runs out.
+    reset()
+    leased = pdf_pipeline.claim(len(files) // 4)
+    with db.transaction() as c:
+        c.execute("UPDATE pdf_jobs SET run_after = ? WHERE status = 'running'", (time.time() - 1,))
+    pipeline = pdf_pipeline.PdfPipeline(max(args.threads))
+    elapsed, _ = timed(pipeline.drain)
+    print(f"recovered {len(leased)} expired leases; {pipeline.processed} docs in {elapsed:.2f}s, "
+          f"jobs {pdf_pipeline.job_counts()}")
+
+    # A corrupt upload is retried MAX_ATTEMPTS times, then marked failed.
+    pdf_pipeline.RETRY_DELAY = 0.0
+    bad = os.path.join(folder, "corrupt.pdf")
+    with open(bad, "wb") as f:
+        f.write(b"%PDF-1.4 truncated" + os.urandom(4096))
+    bk.upload_note(1, bad)
+    pipeline = pdf_pipeline.PdfPipeline(1)
+    elapsed, _ = timed(pipeline.drain)
+    with db.cursor() as c:
+        c.execute("SELECT status, attempts, error FROM pdf_jobs WHERE status != 'done'")
+        status, attempts, error = c.fetchone()
+    print(f"corrupt PDF: {status} after {attempts} attempts in {elapsed:.2f}s ({error[:60]})")
+    print(f"search 'deriv': {len(bk.search_materials(1, 'deriv'))} hits in course 1")
+
+
+# ---------------- EXPORTS -----------------
+def bench_export(args):
+    """
+    Peak Python heap while exporting all submissions at growing scales; with
+    streaming it should stay flat instead of growing with the row count.
+    """
+    import tracemalloc
+    import export
+    import seed
+
+    fmts = [".csv"]
+    try:
+        import pyarrow   # noqa: F401
+        fmts += [".parquet", ".arrow"]
+    except ImportError:
+        print("pyarrow not installed: CSV only")
+    for scale in ("tiny", "small", "medium"):
+        path = fresh_db()
+        seed.generate(**seed.SCALES[scale], log=lambda msg: None)
+        for ext in fmts:
+            out = os.path.join(os.path.dirname(path), "export" + ext)
+            tracemalloc.start()
+            seconds, rows = timed(export.write, out, *export.submissions(answers=True))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{scale:>6} {ext:<8} {rows:>8} rows in {seconds:5.1f}s, "
+                  f"peak heap {peak / 2**20:6.1f} MB, file {os.path.getsize(out) / 2**20:6.1f} MB")
+
+
+# ---------------- GRADE STATISTICS -----------------
+def _python_grade_stats(rows):
+    """Pure-Python reference: the same statistics with loops and dicts."""
+    import statistics
+    grades = [g for _, _, g in rows]
+    counts = [0] * 10
+    for g in grades:
+        counts[min(int(g // 10), 9)] += 1
+    totals = {}
+    for sid, _, g in rows:
+        n, s = totals.get(sid, (0, 0))
+        totals[sid] = (n + 1, s + g)
+    means = {sid: s / n for sid, (n, s) in totals.items()}
+    mu, sigma = statistics.fmean(means.values()), statistics.pstdev(means.values())
+    at_risk = sum(1 for m in means.values() if m < 50 or (m - mu) / sigma <= -1)
+    return statistics.fmean(grades), statistics.median(grades), counts, at_risk
+
+
+def bench_grade_stats(args):
+    """Course grade statistics: NumPy arrays (cold and cached) vs a pure-Python loop."""
+    import grade_stats
+    import seed
+
+    fresh_db()
+    seed.generate(**seed.SCALES[args.scale])
+    # One large course on top of the seeded data: 20 assignments, --rows grades.
+    students = max(args.rows // 20, 1)
+    with db.transaction() as c:
+        c.execute("INSERT INTO courses (name, teacher_id) VALUES ('Large course', 0)")
+        course = c.lastrowid
+        c.execute(f"{seed._numbers(20)} INSERT INTO assignments (course_id, title) SELECT ?, 'A' || i FROM n",
+                  (course,))
+        c.execute(f"""{seed._numbers(students)}
+            INSERT INTO submissions (student_id, assignment_id, answer, grade)
+            SELECT n.i, a.id, 'x', 20 + abs(random()) % 81 FROM n JOIN assignments a ON a.course_id = ?""",
+                  (course,))
+        c.execute("""SELECT s.student_id, s.assignment_id, s.grade FROM assignments a
+                     JOIN submissions s ON s.assignment_id = a.id
+                     WHERE a.course_id = ? AND s.grade IS NOT NULL""", (course,))
+        rows = c.fetchall()
+    import cache
+    cache.bump("submissions")
+
+    n = args.repeat
+    py = min(timed(_python_grade_stats, rows)[0] for _ in range(n))
+    cold = min(timed(lambda: (cache.bump("submissions"), grade_stats.course_stats(course)))[0] for _ in range(n))
+    warm = min(timed(grade_stats.course_stats, course)[0] for _ in range(n))
+    stats = grade_stats.course_stats(course)
+    ref = _python_grade_stats(rows)
+    s = stats["summary"]
+    numpy_result = (round(s["mean"], 6), s["median"], stats["histogram"]["counts"],
+                    sum(1 for row in stats["students"] if row[4]))
+    if numpy_result != (round(ref[0], 6),) + ref[1:]:
+        raise SystemExit(f"NumPy and Python disagree: {numpy_result} vs {ref}")
+    print(f"course {course}: {len(rows)} grades, {len(stats['students'])} students")
+    print(f"pure Python (compute only): {py * 1000:8.2f} ms")
+    print(f"NumPy cold (fetch + compute): {cold * 1000:6.2f} ms")
+    print(f"NumPy cached arrays:         {warm * 1000:6.2f} ms ({py / warm:.0f}x faster than Python)")
+
+
+# ---------------- ANSWER SIMILARITY -----------------
+def bench_answer_similarity(args):
+    """
+    Index --answers synthetic answers (100 per assignment, about 2% copied with
+    small edits), then time incremental re-indexing and check that the
+    planted copies are reported.
+    """
+    import random
+    import similarity
+
+    fresh_db()
+    import backend as bk
+
+    rng = random.Random(7)
+    vocab = [f"w{i}" for i in range(5000)]
+    per_item = 100
+    items = max(args.answers // per_item, 1)
+    with db.transaction() as c:
+        c.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'Student')",
+                      ((f"s{i}",) for i in range(per_item)))
+        c.execute("INSERT INTO courses (name, teacher_id) VALUES ('C', 0)")
+        c.executemany("INSERT INTO assignments (course_id, title) VALUES (1, ?)",
+                      ((f"A{i}",) for i in range(items)))
+
+    planted = set()
+    rows = []
+    for item in range(1, items + 1):
+        answers = [" ".join(rng.choices(vocab, k=60)) for _ in range(per_item)]
+        picked = rng.sample(range(per_item), 2 * (per_item // 50))
+        for a, b in zip(picked[::2], picked[1::2]):
+            words = answers[a].split()
+            words[rng.randrange(len(words))] = rng.choice(vocab)   # one word changed
+            answers[b] = " ".join(words)
+            planted.add((item, min(a, b) + 1, max(a, b) + 1))
+        rows.extend((s + 1, item, answers[s], "2025-01-01") for s in range(per_item))
+    with db.transaction() as c:
+        c.executemany("INSERT INTO submissions (student_id, assignment_id, answer, submission_date) "
+                      "VALUES (?, ?, ?, ?)", rows)
+
+    seconds, (answers, pairs) = timed(similarity.rebuild, "assignment")
+    print(f"rebuild: {answers} answers in {seconds:.1f}s ({answers / seconds:.0f}/s), {pairs} pairs stored")
+    naive = items * per_item * (per_item - 1) // 2
+    print(f"all-pairs within assignments would compare {naive} pairs")
+
+    with db.cursor() as c:
+        c.execute("""SELECT m.item_id, sa.student_id, sb.student_id FROM answer_matches m
+                     JOIN submissions sa ON sa.id = m.submission_a
+                     JOIN submissions sb ON sb.id = m.submission_b
+                     WHERE m.similarity >= ?""", (similarity.REPORT_SIMILARITY,))
+        found = {(item, min(a, b), max(a, b)) for item, a, b in c.fetchall()}
+    print(f"planted copies reported: {len(planted & found)}/{len(planted)}, "
+          f"other pairs reported: {len(found - planted)}")
+
+    latencies = []
+    for _ in range(min(args.queries * 10, 1000)):
+        item, student = rng.randint(1, items), rng.randint(1, per_item)
+        answer = " ".join(rng.choices(vocab, k=60))
+        with db.transaction() as c:
+            c.execute("UPDATE submissions SET answer = ? WHERE student_id = ? AND assignment_id = ?",
+                      (answer, student, item))
+        latencies.append(timed(similarity.index_answer, "assignment", student, item, answer)[0])
+    print(f"incremental index_answer: p50={percentile(latencies, 50) * 1000:.2f} ms "
+          f"p95={percentile(latencies, 95) * 1000:.2f} ms")
+    if len(planted & found) < 0.95 * len(planted):
+        raise SystemExit("LSH missed more than 5% of planted copies")
+
+
+# ---------------- APP SESSIONS -----------------
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+STUDENT_PAGES = ["🏠 Dashboard", "📚 Enroll", "🎓 My Courses", "📝 Assignments", "📖 Notes", "🧠 Exams",
+                 "🏅 My Rank"]
+TEACHER_PAGES = ["📘 Courses", "🧾 Assignments", "📚 Notes", "🧠 Exams", "✅ Grading", "📊 Analytics"]
+# AppTest cannot attach files to st.file_uploader, so the upload steps press
+# the button with no file and time the "Please upload" rerun.
+TEACHER_UPLOADS = {"🧾 Assignments": "Upload Assignment", "📚 Notes": "Upload Note", "🧠 Exams": "Create Exam"}
+
+
+def _button(at, label):
+    return next(b for b in at.button if b.label.startswith(label))
+
+
+def _session_steps(role, email, password):
+    """
+    (page, action) steps one simulated user walks through. Each action takes
+    an AppTest and performs exactly one rerun.
+    """
+    def login(at):
+        at.run()   # first render: login form
+        at.text_input[0].input(email)
+        at.text_input[1].input(password)
+        at.selectbox[0].select(role)
+        _button(at, "Login").click().run()
+
+    def visit(page):
+        return lambda at: at.sidebar.radio[0].set_value(page).run()
+
+    def enroll(at):
+        _button(at, "Enroll Now").click().run()
+
+    def submit(at):
+        at.text_area[0].input("Load test answer")
+        _button(at, "Submit").click().run()
+
+    def upload(label):
+        return lambda at: _button(at, label).click().run()
+
+    if role == "Student":
+        steps = [("login", login)]
+        for page in STUDENT_PAGES:
+            steps.append((page, visit(page)))
+            if page == "📚 Enroll":
+                steps.append(("📚 Enroll: enroll", enroll))
+            elif page in ("📝 Assignments", "🧠 Exams"):
+                steps.append((f"{page}: submit", submit))
+        return steps
+    # Teacher and student pages share names ("🧠 Exams"); keep their samples apart.
+    steps = [("teacher login", login)]
+    for page in TEACHER_PAGES:
+        steps.append((f"teacher {page}", visit(page)))
+        if page in TEACHER_UPLOADS:
+            steps.append((f"teacher {page}: upload", upload(TEACHER_UPLOADS[page])))
+    return steps
+
+
+def _run_session(steps, samples, queries=None, counter=None):
+    """Drive one AppTest through `steps`, recording per-step latency (and queries)."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    for name, action in steps:
+        before = len(counter) if counter is not None else 0
+        try:
+            seconds, _ = timed(action, at)
+        except (StopIteration, IndexError):
+            raise SystemExit(f"{name}: expected widget is not on the page")
+        if at.exception:
+            raise SystemExit(f"{name}: {at.exception[0].value}")
+        samples.setdefault(name, []).append(seconds)
+        if queries is not None:
+            queries.setdefault(name, []).append(len(counter) - before)
+
+
+def bench_app_sessions(args):
+    """
+    Render app.py for N concurrent student and teacher sessions with
+    Streamlit's AppTest on a seeded database. Reports per-page rerun latency
+    percentiles, SQL statements per rerun and peak RSS.
+    """
+    import resource
+    import seed
+    import storage
+
+    counter = QueryCounter().install()
+    path = fresh_db()
+    storage.STORE_DIR = os.path.join(os.path.dirname(path), "blobs")
+    seed.generate(**seed.SCALES[args.scale])
+    with db.cursor() as c:
+        # Students with a course to submit to and one left to enroll in, so
+        # every step finds its widget.
+        c.execute("""SELECT u.email, u.role FROM users u
+                     WHERE u.role = 'Student'
+                       AND (SELECT COUNT(*) FROM enrollments e WHERE e.student_id = u.id)
+                           BETWEEN 1 AND (SELECT COUNT(*) FROM courses) - 1
+                     ORDER BY u.id LIMIT ?""", (args.sessions,))
+        students = c.fetchall()
+        c.execute("""SELECT u.email, u.role FROM users u
+                     WHERE u.role = 'Teacher' AND EXISTS (SELECT 1 FROM courses c WHERE c.teacher_id = u.id)
+                     ORDER BY u.id LIMIT ?""", (max(args.sessions // 10, 1),))
+        teachers = c.fetchall()
+    users = students + teachers
+
+    # One session per role alone first, so statement counts are not mixed
+    # with other sessions' queries on the shared pool.
+    queries = {}
+    for email, role in (students[-1], teachers[-1]):
+        _run_session(_session_steps(role, email, seed.PASSWORD), {}, queries, counter)
+
+    samples = {}
+    errors = []
+
+    def session(email, role):
+        try:
+            _run_session(_session_steps(role, email, seed.PASSWORD), samples)
+        except BaseException as e:
+            errors.append(f"{email}: {e}")
+
+    threads = [threading.Thread(target=session, args=user) for user in users]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    reruns = sum(len(v) for v in samples.values())
+
+    print(f"{len(students)} students + {len(teachers)} teachers at scale={args.scale}: "
+          f"{reruns} reruns in {elapsed:.1f}s ({reruns / elapsed:.1f}/s)")
+    print(f"{'page':<28} {'reruns':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'queries':>8}")
+    for name, values in samples.items():
+        q = queries.get(name)
+        print(f"{name:<28} {len(values):>7} {percentile(values, 50) * 1000:>9.1f} "
+              f"{percentile(values, 95) * 1000:>9.1f} {max(values) * 1000:>9.1f} "
+              f"{(max(q) if q else float('nan')):>8.0f}")
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    print(f"failed sessions: {len(errors)} of {len(users)}")
+    for error in errors:
+        print(f"  {error}")
+    if errors:
+        raise SystemExit(f"{len(errors)} sessions failed, first: {errors[0]}")
+
+
+BENCHMARKS = {
+    "pool_reads": bench_pool_reads,
+    "query_plans": bench_query_plans,
+    "performance_report": bench_performance_report,
+    "points_awards": bench_points_awards,
+    "course_progress": bench_course_progress,
+    "dashboard_queries": bench_dashboard_queries,
+    "uploads": bench_uploads,
+    "material_render": bench_material_render,
+    "bulk_import": bench_bulk_import,
+    "submission_burst": bench_submission_burst,
+    "suite": bench_suite,
+    "app_sessions": bench_app_sessions,
+    "answer_similarity": bench_answer_similarity,
+    "export": bench_export,
+    "grade_stats": bench_grade_stats,
+    "logins": bench_logins,
+    "async_requests": bench_async_requests,
+    "startup": bench_startup,
+    "sharded_writes": bench_sharded_writes,
+    "pdf_pipeline": bench_pdf_pipeline,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LMS backend benchmarks")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--submissions", type=int, default=1000000, help="rows seeded by course_progress")
+    parser.add_argument("--mb", type=int, default=100)
+    parser.add_argument("--kb", type=int, default=512)
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--submitters", type=int, default=1000)
+    parser.add_argument("--scale", default="small", help="seed.py scale for the suite")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown vs baseline")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--costs", type=int, nargs="+", default=[2**12, 2**13, 2**14, 2**15],
+                        help="scrypt N values for the logins benchmark")
+    parser.add_argument("--answers", type=int, default=100000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 4], help="shard counts to compare")
+    parser.add_argument("--pdfs", type=int, default=120, help="PDFs uploaded by pdf_pipeline")
+    parser.add_argument("--pages", type=int, default=12, help="pages per generated PDF")
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent student sessions")
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
+
+
+if __name__ == "__main__":
+    main()
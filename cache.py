@@ -0,0 +1,108 @@
+# cache.py
+"""
+Process-wide read cache for backend queries.
+
+Streamlit reruns the whole script on every interaction and all sessions of
+a server share one process, so caching here is shared across sessions.
+Every cached function declares the tables it reads. Write functions call
+bump() on the tables they change, which moves the table's version counter;
+cache keys include those versions, so a reader never gets a value computed
+before a committed write. TTL bounds staleness from writes made by other
+processes, which do not bump this process's counters.
+"""
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ENTRIES = 2048
+TTL = 30.0   # seconds
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # key -> (expires_at, value)
+_versions = {}
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+
+def version(table):
+    return _versions.get(table, 0)
+
+
+def bump(*tables):
+    """Invalidate cached reads of `tables`; call after the write has committed."""
+    with _lock:
+        for table in tables:
+            _versions[table] = _versions.get(table, 0) + 1
+
+
+def cached(*tables, ttl=None):
+    """
+    Cache a list-returning read function per (arguments, versions of `tables`).
+    Arguments are bound to the signature with defaults applied, so f(1),
+    f(1, 20) and f(x=1) share one entry when 20 is the default.
+    Callers get a fresh list each time, so mutating it can't corrupt the cache.
+    """
+    def decorate(fn):
+        signature = None
+        arity = -1   # positional arguments that are already canonical
+
+        def bind(args, kwargs):
+            nonlocal signature, arity
+            if signature is None:
+                import inspect   # on first call, keeping it out of startup
+                signature = inspect.signature(fn)
+                params = signature.parameters.values()
+                if all(p.kind is p.POSITIONAL_OR_KEYWORD for p in params):
+                    arity = len(signature.parameters)
+            if not kwargs and len(args) == arity:
+                return args, {}
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return bound.args, bound.kwargs
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            args, kwargs = bind(args, kwargs)
+            with _lock:
+                key = (fn.__name__, args, tuple(sorted(kwargs.items())),
+                       tuple(_versions.get(t, 0) for t in tables))
+                entry = _entries.get(key)
+                now = time.monotonic()
+                if entry is not None:
+                    if entry[0] > now:
+                        _entries.move_to_end(key)
+                        _stats["hits"] += 1
+                        return list(entry[1])
+                    del _entries[key]
+                    _stats["expired"] += 1
+                _stats["misses"] += 1
+            # Run the query outside the lock; the key already pins the versions
+            # seen before it started, so a concurrent write can't be masked.
+            value = tuple(fn(*args, **kwargs))
+            with _lock:
+                _entries[key] = (now + (TTL if ttl is None else ttl), value)
+                _entries.move_to_end(key)
+                while len(_entries) > MAX_ENTRIES:
+                    _entries.popitem(last=False)
+                    _stats["evictions"] += 1
+            return list(value)
+
+        wrapper.uncached = fn
+        return wrapper
+    return decorate
+
+
+def stats():
+    """Hit/miss counters plus current size and hit ratio."""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return dict(_stats, size=len(_entries), max_entries=MAX_ENTRIES,
+                    hit_ratio=_stats["hits"] / lookups if lookups else 0.0)
+
+
+def clear():
+    """Drop every entry and reset the statistics."""
+    with _lock:
+        _entries.clear()
+        for k in _stats:
+            _stats[k] = 0
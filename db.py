@@ -0,0 +1,178 @@
+# db.py
+import sqlite3
+import threading
+import queue
+from contextlib import contextmanager
+
+import metrics
+
+DB_PATH = "lms.db"
+POOL_SIZE = 8
+BUSY_TIMEOUT = 5.0   # seconds a connection waits on a locked database
+
+# Callables run on every new connection, e.g. to install trace callbacks.
+CONNECT_HOOKS = []
+
+
+# ---------------- CONNECTIONS -----------------
+def connect(path=None, timeout=None):
+    """Open a standalone connection with the pool's pragmas (WAL, busy timeout)."""
+    timeout = BUSY_TIMEOUT if timeout is None else timeout
+    conn = sqlite3.connect(path or DB_PATH, timeout=timeout, check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    for hook in CONNECT_HOOKS:
+        hook(conn)
+    return conn
+
+
+# ---------------- CONNECTION POOL -----------------
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections to one database file.
+    Connections are checked out by one thread at a time and returned
+    afterwards, so cursors are never shared between Streamlit sessions.
+    """
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self):
+        return connect(self.path, self.timeout)
+
+    def get(self):
+        """Check out a connection, opening a new one while under the pool size."""
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                opened = True
+            else:
+                opened = False
+        if opened:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        return self._idle.get(timeout=self.timeout)
+
+    def put(self, conn):
+        """Return a connection to the pool, discarding any open transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.get()
+        try:
+            yield conn
+        finally:
+            self.put(conn)
+
+    def close(self):
+        """Close every idle connection; checked-out ones close when returned."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_pool():
+    """Return this thread's bound pool, else the process-wide one (created on first use)."""
+    global _pool
+    bound = getattr(_local, "pool", None)
+    if bound is not None:
+        return bound
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH, POOL_SIZE, BUSY_TIMEOUT)
+    return _pool
+
+
+def configure(path=None, size=None, timeout=None):
+    """Point the process-wide pool at another database (tests, benchmarks)."""
+    global _pool, DB_PATH, POOL_SIZE, BUSY_TIMEOUT
+    with _pool_lock:
+        if path is not None:
+            DB_PATH = path
+        if size is not None:
+            POOL_SIZE = size
+        if timeout is not None:
+            BUSY_TIMEOUT = timeout
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(DB_PATH, POOL_SIZE, BUSY_TIMEOUT)
+    return _pool
+
+
+def bind_pool(pool):
+    """
+    Make the calling thread use `pool` instead of the process-wide one.
+    Meant as a ThreadPoolExecutor initializer for workers that need their
+    own connections.
+    """
+    _local.pool = pool
+
+
+@contextmanager
+def using(pool):
+    """Temporarily route this thread's cursor()/transaction() to `pool`."""
+    previous = getattr(_local, "pool", None)
+    _local.pool = pool
+    try:
+        yield pool
+    finally:
+        _local.pool = previous
+
+
+# ---------------- CURSOR HELPERS -----------------
+@contextmanager
+def cursor():
+    """Cursor on a pooled connection for read queries."""
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield metrics.wrap(cur)
+        finally:
+            cur.close()
+
+
+@contextmanager
+def transaction():
+    """Cursor inside a write transaction; commits on success, rolls back on error."""
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield metrics.wrap(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
@@ -0,0 +1,196 @@
+# export.py
+"""
+Streaming report exports.
+
+Rows come from generators (a keyset-paged report or one cursor read with
+fetchmany) and go straight to CSV chunks, Parquet row groups or Arrow IPC
+record batches, so memory stays bounded by CHUNK_ROWS whatever the size of
+the export. pyarrow is only needed for the columnar formats.
+
+    python manage.py export submissions.parquet
+    python manage.py export report.csv --course 12
+"""
+import csv
+import io
+import os
+
+import shards
+
+CHUNK_ROWS = 10000   # rows per CSV chunk / Parquet row group / Arrow batch
+
+# (column, type) pairs; types map to Arrow types for the columnar writers.
+COURSE_REPORT_COLUMNS = [
+    ("Student Name", "string"),
+    ("Assignments Submitted", "int64"),
+    ("Assignment Titles", "string"),
+    ("Exams Attempted", "int64"),
+    ("Exam Titles", "string"),
+]
+
+SUBMISSION_COLUMNS = [
+    ("kind", "string"),
+    ("course_id", "int64"),
+    ("course", "string"),
+    ("item_id", "int64"),
+    ("title", "string"),
+    ("student_id", "int64"),
+    ("student", "string"),
+    ("submission_id", "int64"),
+    ("submitted_at", "string"),
+    ("grade", "int64"),
+    ("feedback", "string"),
+]
+
+SUBMISSIONS_SQL = """
+    SELECT 'assignment', co.id, co.name, i.id, i.title, s.student_id, u.username,
+           s.id, s.submission_date, s.grade, s.feedback{answer}
+    FROM submissions s
+    JOIN assignments i ON i.id = s.assignment_id
+    JOIN courses co ON co.id = i.course_id
+    LEFT JOIN users u ON u.id = s.student_id
+    UNION ALL
+    SELECT 'exam', co.id, co.name, i.id, i.title, s.student_id, u.username,
+           s.id, s.submission_date, s.grade, s.feedback{answer}
+    FROM exam_submissions s
+    JOIN exams i ON i.id = s.exam_id
+    JOIN courses co ON co.id = i.course_id
+    LEFT JOIN users u ON u.id = s.student_id
+"""
+
+
+# ---------------- SOURCES -----------------
+def course_report(course_id):
+    """(columns, rows) for one course's performance report, read page by page."""
+    import backend as bk
+    names = [name for name, _ in COURSE_REPORT_COLUMNS]
+    rows = (tuple(r[n] for n in names) for r in bk.iter_teacher_student_performance(course_id))
+    return COURSE_REPORT_COLUMNS, rows
+
+
+def submissions(answers=False):
+    """
+    (columns, rows) for every assignment and exam submission with its grade,
+    streamed from one cursor per course shard, so the export is a consistent
+    snapshot of each shard.
+    """
+    columns = SUBMISSION_COLUMNS + ([("answer", "string")] if answers else [])
+    return columns, _stream(SUBMISSIONS_SQL.format(answer=", s.answer" if answers else ""))
+
+
+def _stream(sql, params=()):
+    for shard in range(shards.count()):
+        # Check the connection out directly: routing is thread-local and the
+        # consumer runs between yields.
+        with shards.get_pool(shard).connection() as conn:
+            c = conn.execute(sql, params)
+            while True:
+                rows = c.fetchmany(CHUNK_ROWS)
+                if not rows:
+                    break
+                yield from rows
+
+
+# ---------------- CSV -----------------
+def iter_csv(columns, rows, chunk_rows=CHUNK_ROWS):
+    """Yield UTF-8 CSV bytes, header first, about `chunk_rows` rows at a time."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([name for name, _ in columns])
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+    yield buf.getvalue().encode("utf-8")
+
+
+def write_csv(path, columns, rows):
+    """Stream rows to a CSV file; returns the number of rows written."""
+    counted = _Counter(rows)
+    with open(path, "wb") as f:
+        for chunk in iter_csv(columns, counted):
+            f.write(chunk)
+    return counted.n
+
+
+# ---------------- PARQUET / ARROW -----------------
+def _schema(columns):
+    import pyarrow as pa
+    return pa.schema([(name, getattr(pa, kind)()) for name, kind in columns])
+
+
+def _batches(columns, rows, chunk_rows=CHUNK_ROWS):
+    """Yield pyarrow RecordBatches of at most `chunk_rows` rows."""
+    import pyarrow as pa
+    schema = _schema(columns)
+
+    def batch(block):
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*block), schema)]
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    block = []
+    for row in rows:
+        block.append(row)
+        if len(block) >= chunk_rows:
+            yield batch(block)
+            block = []
+    if block:
+        yield batch(block)
+
+
+def write_parquet(path, columns, rows):
+    """Stream rows to a Parquet file, one row group per chunk; returns the row count."""
+    import pyarrow.parquet as pq
+    n = 0
+    with pq.ParquetWriter(path, _schema(columns), compression="zstd") as writer:
+        for batch in _batches(columns, rows):
+            writer.write_batch(batch)
+            n += batch.num_rows
+    return n
+
+
+def write_arrow(path, columns, rows):
+    """Stream rows to an Arrow IPC (Feather v2) file; returns the row count."""
+    import pyarrow as pa
+    n = 0
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, _schema(columns)) as writer:
+        for batch in _batches(columns, rows):
+            writer.write_batch(batch)
+            n += batch.num_rows
+    return n
+
+
+WRITERS = {
+    ".csv": write_csv,
+    ".parquet": write_parquet,
+    ".arrow": write_arrow,
+    ".feather": write_arrow,
+}
+
+
+def write(path, columns, rows):
+    """Write rows in the format named by the file extension; returns the row count."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in WRITERS:
+        raise ValueError(f"unsupported export format {ext!r} (use {', '.join(WRITERS)})")
+    return WRITERS[ext](path, columns, rows)
+
+
+class _Counter:
+    """Iterator wrapper that counts the rows passing through."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self.n = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self._rows)
+        self.n += 1
+        return row
@@ -0,0 +1,157 @@
+# importer.py
+"""
+Bulk onboarding of users and enrollments.
+
+Rows are staged into a TEMP table with executemany, checked against the
+live tables in SQL, and copied with INSERT OR IGNORE, one transaction per
+CHUNK_SIZE rows. Rows that clash with existing data (or with an earlier row
+of the same import) are reported back and skipped instead of aborting the
+batch. Enrollments are staged on the shard that holds their course.
+"""
+import csv
+import itertools
+
+import cache
+import db
+import passwords
+import shards
+
+CHUNK_SIZE = 5000
+
+
+def _chunks(rows, size):
+    it = iter(rows)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_csv(path):
+    """Yield dict rows from a CSV file with a header line."""
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+# ---------------- USERS -----------------
+USER_CONFLICTS_SQL = """
+    SELECT s.line,
+           CASE
+               WHEN s.username IS NULL THEN 'missing username'
+               WHEN s.role IS NULL THEN 'missing role'
+               WHEN s.role NOT IN ('Student', 'Teacher') THEN 'invalid role'
+               WHEN s.password IS NULL THEN 'missing password'
+               WHEN EXISTS (SELECT 1 FROM users u WHERE u.username = s.username) THEN 'username exists'
+               WHEN EXISTS (SELECT 1 FROM users u WHERE u.email = s.email) THEN 'email exists'
+               WHEN EXISTS (SELECT 1 FROM _import_users p WHERE p.line < s.line
+                            AND (p.username = s.username OR p.email = s.email)) THEN 'duplicate in import'
+           END AS reason
+    FROM _import_users s
+    WHERE reason IS NOT NULL
+"""
+
+
+def import_users(rows, chunk_size=CHUNK_SIZE):
+    """
+    Insert users from dicts (or tuples) of username, email, password, role.
+    Plaintext passwords are hashed on the password pool; values that are
+    already hashes are stored as given. Rows without a password are
+    conflicts, never accounts with an empty one.
+    Returns {"inserted": n, "conflicts": [(line, reason)]}; line is 1-based.
+    """
+    inserted, conflicts = 0, []
+    numbered = enumerate(rows, start=1)
+    for chunk in _chunks(numbered, chunk_size):
+        staged = [(line,) + _user_fields(row) for line, row in chunk]
+        plain = [n for n, row in enumerate(staged) if row[3] and not passwords.is_hashed(row[3])]
+        for n, hashed in zip(plain, passwords.hash_many(staged[n][3] for n in plain)):
+            staged[n] = staged[n][:3] + (hashed,) + staged[n][4:]
+        with db.transaction() as c:
+            c.execute("""CREATE TEMP TABLE IF NOT EXISTS _import_users (
+                             line INTEGER PRIMARY KEY, username TEXT, email TEXT, password TEXT, role TEXT)""")
+            c.execute("CREATE INDEX IF NOT EXISTS temp._import_users_username ON _import_users(username)")
+            c.execute("CREATE INDEX IF NOT EXISTS temp._import_users_email ON _import_users(email)")
+            c.execute("DELETE FROM _import_users")
+            c.executemany("INSERT INTO _import_users VALUES (?, ?, ?, ?, ?)", staged)
+            c.execute(USER_CONFLICTS_SQL)
+            bad = c.fetchall()
+            conflicts.extend(bad)
+            c.executemany("DELETE FROM _import_users WHERE line = ?", ((line,) for line, _ in bad))
+            c.execute("""INSERT OR IGNORE INTO users (username, email, password, role)
+                         SELECT username, email, password, role FROM _import_users ORDER BY line""")
+            inserted += c.rowcount
+            c.execute("DELETE FROM _import_users")
+    if inserted:
+        cache.bump("users")
+    return {"inserted": inserted, "conflicts": conflicts}
+
+
+def _user_fields(row):
+    """(username, email, password, role) with blank cells as None; whitespace is stripped except in passwords."""
+    if isinstance(row, dict):
+        row = row.get("username"), row.get("email"), row.get("password"), row.get("role")
+    username, email, password, role = row
+    username, email, role = (v.strip() if isinstance(v, str) else v for v in (username, email, role))
+    return username or None, email or None, password or None, role or None
+
+
+# ---------------- ENROLLMENTS -----------------
+ENROLLMENT_CONFLICTS_SQL = """
+    SELECT s.line,
+           CASE
+               WHEN NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.student_id) THEN 'unknown student'
+               WHEN NOT EXISTS (SELECT 1 FROM courses c WHERE c.id = s.course_id) THEN 'unknown course'
+               WHEN EXISTS (SELECT 1 FROM enrollments e
+                            WHERE e.student_id = s.student_id AND e.course_id = s.course_id) THEN 'already enrolled'
+               WHEN EXISTS (SELECT 1 FROM _import_enrollments p WHERE p.line < s.line
+                            AND p.student_id = s.student_id AND p.course_id = s.course_id) THEN 'duplicate in import'
+           END AS reason
+    FROM _import_enrollments s
+    WHERE reason IS NOT NULL
+"""
+
+
+def import_enrollments(pairs, chunk_size=CHUNK_SIZE):
+    """
+    Enroll (student_id, course_id) pairs, or dicts with those keys.
+    Unknown students or courses are reported and skipped.
+    Returns {"inserted": n, "conflicts": [(line, reason)]}; line is 1-based.
+    """
+    inserted, conflicts = 0, []
+    numbered = enumerate(pairs, start=1)
+    for chunk in _chunks(numbered, chunk_size):
+        by_shard = {}
+        for line, pair in chunk:
+            row = (line,) + _enrollment_fields(pair)
+            by_shard.setdefault(shards.shard_of_course(row[2]), []).append(row)
+        for shard, staged in sorted(by_shard.items()):
+            with shards.using(shard), db.transaction() as c:
+                c.execute("""CREATE TEMP TABLE IF NOT EXISTS _import_enrollments (
+                                 line INTEGER PRIMARY KEY, student_id INTEGER, course_id INTEGER)""")
+                c.execute("""CREATE INDEX IF NOT EXISTS temp._import_enrollments_pair
+                             ON _import_enrollments(student_id, course_id)""")
+                c.execute("DELETE FROM _import_enrollments")
+                c.executemany("INSERT INTO _import_enrollments VALUES (?, ?, ?)", staged)
+                c.execute(ENROLLMENT_CONFLICTS_SQL)
+                bad = c.fetchall()
+                conflicts.extend(bad)
+                c.executemany("DELETE FROM _import_enrollments WHERE line = ?", ((line,) for line, _ in bad))
+                c.execute("""INSERT OR IGNORE INTO enrollments (student_id, course_id)
+                             SELECT student_id, course_id FROM _import_enrollments ORDER BY line""")
+                inserted += c.rowcount
+                c.execute("DELETE FROM _import_enrollments")
+    conflicts.sort()
+    if inserted:
+        cache.bump("enrollments")
+    return {"inserted": inserted, "conflicts": conflicts}
+
+
+def _enrollment_fields(pair):
+    if isinstance(pair, dict):
+        pair = (pair.get("student_id"), pair.get("course_id"))
+    try:
+        student_id, course_id = pair
+        return int(student_id), int(course_id)
+    except (TypeError, ValueError):
+        return None, None   # reported as an unknown student
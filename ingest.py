@@ -0,0 +1,133 @@
+# ingest.py
+"""
+Group-commit writer for submission bursts.
+
+Callers put a single UPSERT on a bounded queue and block on a Future. One
+writer thread per database file (each course shard has its own) drains the
+queue, applies up to MAX_BATCH rows (or whatever arrived within MAX_DELAY
+seconds) in one transaction with synchronous=FULL, and resolves every
+Future only after that commit. Hundreds of deadline submissions then share
+a handful of fsyncs instead of paying one each.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+
+MAX_PENDING = 10000    # queued writes before submitters block
+MAX_BATCH = 256        # rows per group commit
+MAX_DELAY = 0.005      # seconds to wait for a batch to fill
+ENQUEUE_TIMEOUT = 10.0
+
+
+class GroupCommitWriter(threading.Thread):
+    """Single writer thread that commits queued statements in groups."""
+
+    def __init__(self, path=None, max_batch=MAX_BATCH, max_delay=MAX_DELAY, max_pending=MAX_PENDING):
+        super().__init__(name="group-commit-writer", daemon=True)
+        self.path = path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stopping = False
+        self.batches = 0
+        self.rows = 0
+
+    def submit(self, sql, params, timeout=ENQUEUE_TIMEOUT):
+        """Queue one statement; the returned Future resolves once it is committed."""
+        if self._stopping:
+            raise RuntimeError("writer is stopped")
+        future = Future()
+        self._queue.put((sql, params, future), timeout=timeout)
+        return future
+
+    def run(self):
+        conn = db.connect(self.path)
+        conn.execute("PRAGMA synchronous = FULL")   # an acknowledgement means on disk
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                stop = False
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._commit(conn, batch)
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        try:
+            with conn:
+                for sql, params, _ in batch:
+                    conn.execute(sql, params)
+        except Exception:
+            # One bad row must not fail its neighbours: retry them one by one.
+            for sql, params, future in batch:
+                try:
+                    with conn:
+                        conn.execute(sql, params)
+                    future.set_result(True)
+                except Exception as e:
+                    future.set_exception(e)
+        else:
+            for _, _, future in batch:
+                future.set_result(True)
+        self.batches += 1
+        self.rows += len(batch)
+
+    def stop(self):
+        """Flush everything already queued, then end the thread."""
+        self._stopping = True
+        self._queue.put(None)
+        self.join()
+
+
+_writers = {}   # database path -> writer
+_writer_lock = threading.Lock()
+
+
+def get_writer(path=None):
+    """
+    Return the writer for `path` (default: the database this thread is routed
+    to, so each course shard commits on its own), starting it on first use.
+    """
+    path = path or db.get_pool().path
+    writer = _writers.get(path)
+    if writer is None or not writer.is_alive():
+        with _writer_lock:
+            writer = _writers.get(path)
+            if writer is None or not writer.is_alive():
+                writer = _writers[path] = GroupCommitWriter(path)
+                writer.start()
+    return writer
+
+
+def write(sql, params, wait=True):
+    """Queue a write through the group-commit writer; block until durable if `wait`."""
+    future = get_writer().submit(sql, params)
+    if wait:
+        future.result()
+    return future
+
+
+def stop_writer():
+    """Flush and stop every writer."""
+    with _writer_lock:
+        for writer in _writers.values():
+            writer.stop()
+        _writers.clear()
@@ -0,0 +1,234 @@
+# manage.py
+"""
+Maintenance commands for the LMS database.
+
+    python manage.py migrate
+    python manage.py check-counters
+    python manage.py rebuild-counters
+    python manage.py import-users users.csv
+    python manage.py import-enrollments enrollments.csv
+    python manage.py import-grades grades.csv [--kind exam]
+    python manage.py seed --scale small
+    python manage.py index-answers [--kind exam]
+    python manage.py export submissions.parquet [--course 12] [--answers]
+    python manage.py --shards 4 rebalance [--dry-run] [--course 12 --to 3]
+    python manage.py process-pdfs [--backfill] [--workers 4]
+    python manage.py email-conflicts [--set 12 new@example.com]
+"""
+import argparse
+import sys
+import time
+
+import db
+import migrations
+import shards
+
+
+def cmd_migrate(args):
+    """Apply pending schema migrations"""
+    print(f"schema version {migrations.migrate()}")
+    shards.init()
+
+
+def cmd_check_counters(args):
+    """Compare progress counters with a fresh recount"""
+    import backend as bk
+    drift = bk.check_progress_counters()
+    for table, course_id, student_id, stored, actual in drift:
+        who = f" student {student_id}" if student_id is not None else ""
+        print(f"{table}: course {course_id}{who} stored={stored} actual={actual}")
+    print(f"{len(drift)} drifted counters")
+    return 1 if drift else 0
+
+
+def cmd_rebuild_counters(args):
+    """Recompute progress counters from scratch"""
+    import backend as bk
+    bk.rebuild_progress_counters()
+    print("progress counters rebuilt")
+
+
+def _print_import(result, args):
+    for line, reason in result["conflicts"][:args.show]:
+        print(f"line {line}: {reason}")
+    hidden = len(result["conflicts"]) - args.show
+    if hidden > 0:
+        print(f"... {hidden} more conflicts")
+    print(f"{result['inserted']} inserted, {len(result['conflicts'])} conflicts")
+
+
+def cmd_import_users(args):
+    """Bulk-load users (CSV columns: username,email,password,role)"""
+    import importer
+    _print_import(importer.import_users(importer.read_csv(args.csv), args.chunk_size), args)
+
+
+def cmd_import_enrollments(args):
+    """Bulk-enroll students (CSV columns: student_id,course_id)"""
+    import importer
+    _print_import(importer.import_enrollments(importer.read_csv(args.csv), args.chunk_size), args)
+
+
+def cmd_import_grades(args):
+    """Batch-grade submissions (CSV columns: submission_id,grade,feedback)"""
+    import backend as bk
+    import importer
+    result = bk.grade_submissions(importer.read_csv(args.csv), args.kind)
+    for line, reason in result["rejected"][:args.show]:
+        print(f"line {line}: {reason}")
+    hidden = len(result["rejected"]) - args.show
+    if hidden > 0:
+        print(f"... {hidden} more rejected rows")
+    print(f"{result['updated']} {args.kind} submissions graded, {len(result['rejected'])} rows rejected")
+
+
+def cmd_seed(args):
+    """Fill the database with synthetic data (see seed.py)"""
+    import seed
+    sizes = dict(seed.SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    seed.generate(**sizes)
+
+
+def cmd_index_answers(args):
+    """Rebuild near-duplicate answer detection for existing submissions"""
+    import backend as bk
+    answers, pairs = bk.rebuild_answer_index(args.kind)
+    print(f"indexed {answers} {args.kind} answers, {pairs} similar pairs")
+
+
+def cmd_export(args):
+    """Stream a report to .csv, .parquet or .arrow (see export.py)"""
+    import export
+    if args.course is not None:
+        columns, rows = export.course_report(args.course)
+    else:
+        columns, rows = export.submissions(answers=args.answers)
+    print(f"wrote {export.write(args.path, columns, rows)} rows to {args.path}")
+
+
+def cmd_rebalance(args):
+    """Move courses between shard files to even out their load (see shards.py)"""
+    if shards.count() == 1:
+        print("sharding is off (set LMS_SHARDS or pass --shards)")
+        return 1
+    if args.course is not None:
+        if args.to is None:
+            print("--course needs --to")
+            return 2
+        moves = [(args.course, shards.shard_of_course(args.course), args.to, None)]
+    else:
+        moves = shards.plan_rebalance(args.tolerance)
+    for course_id, source, target, rows in moves:
+        load = f" ({rows} rows)" if rows is not None else ""
+        print(f"course {course_id}: shard {source} -> {target}{load}")
+        if not args.dry_run:
+            shards.move_course(course_id, target)
+    loads = shards.course_loads()
+    for shard, courses in loads.items():
+        print(f"shard {shard}: {len(courses)} courses, {sum(courses.values())} rows")
+    print(f"{len(moves)} moves{' planned' if args.dry_run else ''}")
+
+
+def cmd_email_conflicts(args):
+    """List accounts sharing an email, or give one its own (runs before migration 12)"""
+    if args.set:
+        user_id, email = int(args.set[0]), args.set[1]
+        with db.transaction() as c:
+            c.execute("SELECT id FROM users WHERE email = ? AND id != ?", (email, user_id))
+            if c.fetchone() is not None:
+                print(f"{email} is already used by another account")
+                return 2
+            c.execute("UPDATE users SET email = ? WHERE id = ?", (email, user_id))
+            if not c.rowcount:
+                print(f"no user {user_id}")
+                return 2
+    with db.cursor() as c:
+        duplicates = migrations.duplicate_emails(c)
+    for email, user_id, username, role in duplicates:
+        print(f"{email}: user {user_id} ({username}, {role})")
+    print(f"{len(duplicates)} accounts share an email")
+    return 1 if duplicates else 0
+
+
+def cmd_process_pdfs(args):
+    """Extract text and previews for queued PDFs now (see pdf_pipeline.py)"""
+    import pdf_pipeline
+    if not pdf_pipeline.available():
+        print("PyMuPDF is not installed (pip install pymupdf)")
+        return 1
+    if args.backfill:
+        print(f"queued {pdf_pipeline.backfill()} PDFs without a document")
+    pipeline = pdf_pipeline.PdfPipeline(args.workers or pdf_pipeline.WORKERS)
+    started = time.perf_counter()
+    pipeline.drain()
+    elapsed = time.perf_counter() - started
+    print(f"processed {pipeline.processed} PDFs, {pipeline.failed} failures in {elapsed:.1f}s")
+    for status, jobs in sorted(pdf_pipeline.job_counts().items()):
+        print(f"{status}: {jobs}")
+
+
+COMMANDS = {
+    "migrate": cmd_migrate,
+    "check-counters": cmd_check_counters,
+    "rebuild-counters": cmd_rebuild_counters,
+    "import-users": cmd_import_users,
+    "import-enrollments": cmd_import_enrollments,
+    "import-grades": cmd_import_grades,
+    "seed": cmd_seed,
+    "index-answers": cmd_index_answers,
+    "export": cmd_export,
+    "rebalance": cmd_rebalance,
+    "process-pdfs": cmd_process_pdfs,
+    "email-conflicts": cmd_email_conflicts,
+}
+
+
+def add_arguments(name, parser):
+    if name.startswith("import-"):
+        parser.add_argument("csv", help="CSV file with a header row")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--show", type=int, default=20, help="conflicts to print")
+    if name == "seed":
+        parser.add_argument("--scale", choices=["tiny", "small", "medium", "large"], default="small")
+        for key in ("users", "courses", "enrollments", "submissions", "exam_submissions"):
+            parser.add_argument("--" + key.replace("_", "-"), dest=key, type=int,
+                                help="override the scale's row count")
+    if name == "export":
+        parser.add_argument("path", help="output file; the extension picks the format")
+        parser.add_argument("--course", type=int, help="one course's performance report")
+        parser.add_argument("--answers", action="store_true", help="include answer text")
+    if name == "rebalance":
+        parser.add_argument("--dry-run", action="store_true", help="print the moves only")
+        parser.add_argument("--tolerance", type=float, default=0.1, help="allowed deviation from the mean load")
+        parser.add_argument("--course", type=int, help="move this course instead of planning")
+        parser.add_argument("--to", type=int, help="target shard for --course")
+    if name == "email-conflicts":
+        parser.add_argument("--set", nargs=2, metavar=("USER_ID", "EMAIL"), help="give an account a new email")
+    if name == "process-pdfs":
+        parser.add_argument("--backfill", action="store_true", help="first queue uploads with no document")
+        parser.add_argument("--workers", type=int, default=None, help="extraction processes")
+    if name in ("import-grades", "index-answers"):
+        parser.add_argument("--kind", choices=["assignment", "exam"], default="assignment")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LMS maintenance commands")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--shards", type=int, default=shards.count(), help="course shard files (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, fn in COMMANDS.items():
+        add_arguments(name, sub.add_parser(name, help=fn.__doc__))
+    args = parser.parse_args(argv)
+    db.configure(args.db)
+    shards.configure(args.shards)
+    if args.command not in ("migrate", "email-conflicts"):
+        migrations.ensure_current()
+        shards.init()
+    return COMMANDS[args.command](args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+# metrics.py
+"""
+Opt-in instrumentation for backend functions and SQL statements.
+
+Turn it on with LMS_METRICS=1 in the environment or metrics.enable().
+While enabled, every public function in backend.py / auth.py and every
+statement run through db.cursor() / db.transaction() records its call
+count, latency and rows returned. Statements slower than SLOW_QUERY_MS are
+logged to the "lms.slow_query" logger together with their query plan.
+When disabled, the wrappers cost one flag check per call.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+ENABLED = os.environ.get("LMS_METRICS", "") not in ("", "0")
+SLOW_QUERY_MS = float(os.environ.get("LMS_SLOW_QUERY_MS", "100"))
+SAMPLES = 1000   # recent latencies kept per key for percentiles
+
+log = logging.getLogger("lms.slow_query")
+
+_lock = threading.Lock()
+_functions = {}
+_statements = {}
+STATEMENT_HOOKS = []   # fn(cursor, sql, params) after each timed execute; params None for executemany
+
+
+class _Stat:
+    __slots__ = ("calls", "total", "rows", "max", "recent")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.rows = 0
+        self.max = 0.0
+        self.recent = deque(maxlen=SAMPLES)
+
+    def add(self, seconds, rows=0, calls=1):
+        self.calls += calls
+        self.total += seconds
+        self.rows += rows
+        if calls:
+            self.recent.append(seconds)
+        elif self.recent:
+            self.recent[-1] += seconds   # fetch time belongs to the last execute
+        if self.recent:
+            self.max = max(self.max, self.recent[-1])
+
+    def as_dict(self):
+        recent = sorted(self.recent)
+        p95 = recent[min(len(recent) - 1, int(0.95 * len(recent)))] if recent else 0.0
+        return {
+            "calls": self.calls,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.calls, 3) if self.calls else 0.0,
+            "p95_ms": round(p95 * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "rows": self.rows,
+        }
+
+
+def _record(table, key, seconds, rows=0, calls=1):
+    with _lock:
+        stat = table.get(key)
+        if stat is None:
+            stat = table[key] = _Stat()
+        stat.add(seconds, rows, calls)
+
+
+def enable(slow_query_ms=None):
+    global ENABLED, SLOW_QUERY_MS
+    ENABLED = True
+    if slow_query_ms is not None:
+        SLOW_QUERY_MS = slow_query_ms
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    with _lock:
+        _functions.clear()
+        _statements.clear()
+
+
+# ---------------- FUNCTIONS -----------------
+def instrument(namespace, prefix):
+    """
+    Wrap every public function in a module namespace (pass globals()) so
+    calls are timed while metrics are enabled.
+    """
+    for name, fn in list(namespace.items()):
+        if (name.startswith("_") or not callable(fn) or isinstance(fn, type)
+                or getattr(fn, "__module__", None) != namespace["__name__"]):
+            continue
+        namespace[name] = _timed(fn, f"{prefix}.{name}")
+
+
+def _timed(fn, key):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        _record(_functions, key, time.perf_counter() - start, _row_count(result))
+        return result
+    return wrapper
+
+
+def _row_count(result):
+    """Rows in a function result: a list of rows, a (rows, cursor) page, or one row."""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple):
+        return len(result[0]) if result and isinstance(result[0], list) else 1
+    return 0
+
+
+# ---------------- STATEMENTS -----------------
+class TimedCursor:
+    """sqlite3.Cursor proxy that times execute/fetch and counts rows."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._sql = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        self._cursor.execute(sql, params)
+        self._done(sql, params, time.perf_counter() - start, max(self._cursor.rowcount, 0))
+        return self
+
+    def executemany(self, sql, seq):
+        start = time.perf_counter()
+        self._cursor.executemany(sql, seq)
+        self._done(sql, None, time.perf_counter() - start, max(self._cursor.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        return self._fetched(self._cursor.fetchone, single=True)
+
+    def fetchmany(self, size=None):
+        return self._fetched(lambda: self._cursor.fetchmany(size or self._cursor.arraysize))
+
+    def fetchall(self):
+        return self._fetched(self._cursor.fetchall)
+
+    def _fetched(self, fetch, single=False):
+        start = time.perf_counter()
+        rows = fetch()
+        if self._sql is not None:
+            n = (rows is not None) if single else len(rows)
+            _record(_statements, self._sql, time.perf_counter() - start, n, calls=0)
+        return rows
+
+    def _done(self, sql, params, seconds, rows):
+        self._sql = " ".join(sql.split())
+        _record(_statements, self._sql, seconds, rows)
+        for hook in STATEMENT_HOOKS:
+            hook(self._cursor, sql, params)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            log.warning("slow query %.1f ms: %s\nplan: %s", seconds * 1000, self._sql,
+                        self._plan(sql, params))
+
+    def _plan(self, sql, params):
+        if params is None or not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            return "n/a"
+        try:
+            plan = self._cursor.connection.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            return " | ".join(row[3] for row in plan)
+        except Exception as e:
+            return f"unavailable ({e})"
+
+
+def wrap(cursor):
+    """Return a TimedCursor while metrics are enabled, else the cursor itself."""
+    return TimedCursor(cursor) if ENABLED else cursor
+
+
+# ---------------- EXPORT -----------------
+def snapshot():
+    """Current stats as plain dicts, slowest total time first."""
+    with _lock:
+        def table(stats):
+            rows = [dict(name=k, **v.as_dict()) for k, v in stats.items()]
+            return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+        return {
+            "enabled": ENABLED,
+            "slow_query_ms": SLOW_QUERY_MS,
+            "functions": table(_functions),
+            "statements": table(_statements),
+        }
+
+
+def to_json(indent=2):
+    return json.dumps(snapshot(), indent=indent)
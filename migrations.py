@@ -0,0 +1,517 @@
+# migrations.py
+"""
+Versioned schema migrations.
+
+The schema version lives in PRAGMA user_version. Each migration is a
+numbered function that runs inside its own write transaction together with
+the version bump, so a crash never leaves a half-applied step behind.
+When the database is already at LATEST_VERSION, migrate() reads one pragma
+and returns without running any DDL. Nothing runs at import: processes call
+ensure_current() (via backend.init()) once at startup.
+"""
+import threading
+
+import db
+
+MIGRATIONS = []
+
+# Graded kinds: kind -> (submission table, item table, item foreign key).
+# The one definition backend, grade_stats, shards and similarity all use.
+GRADED_TABLES = {
+    "assignment": ("submissions", "assignments", "assignment_id"),
+    "exam": ("exam_submissions", "exams", "exam_id"),
+}
+
+
+def migration(version):
+    """Register a migration function under a schema version number."""
+    def register(fn):
+        MIGRATIONS.append((version, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+# ---------------- HELPERS -----------------
+def columns(c, table):
+    c.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in c.fetchall()}
+
+
+def add_column(c, table, column, decl):
+    """Add a column unless the table already has it."""
+    if column not in columns(c, table):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def dedupe(c, table, key):
+    """Keep only the newest row (highest id) for every value of `key`."""
+    c.execute(f"""DELETE FROM {table} WHERE id NOT IN (
+                      SELECT MAX(id) FROM {table} GROUP BY {key})""")
+
+
+# ---------------- MIGRATIONS -----------------
+@migration(1)
+def base_schema(c):
+    """Tables as originally created by backend.py and auth.py."""
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE,
+                    email TEXT UNIQUE,
+                    password TEXT,
+                    role TEXT CHECK(role IN ('Student','Teacher'))
+                )''')
+    add_column(c, "users", "email", "TEXT")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS courses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT,
+                    teacher_id INTEGER,
+                    FOREIGN KEY (teacher_id) REFERENCES users(id)
+                )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS enrollments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id INTEGER,
+                    course_id INTEGER,
+                    FOREIGN KEY (student_id) REFERENCES users(id),
+                    FOREIGN KEY (course_id) REFERENCES courses(id)
+                )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS assignments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    course_id INTEGER,
+                    title TEXT,
+                    file_path TEXT,
+                    FOREIGN KEY (course_id) REFERENCES courses(id)
+                )''')
+    add_column(c, "assignments", "file_path", "TEXT")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS submissions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id INTEGER,
+                    assignment_id INTEGER,
+                    answer TEXT,
+                    submission_date TEXT,
+                    grade INTEGER,
+                    feedback TEXT,
+                    FOREIGN KEY (student_id) REFERENCES users(id),
+                    FOREIGN KEY (assignment_id) REFERENCES assignments(id)
+                )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS notes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    course_id INTEGER,
+                    file_path TEXT,
+                    FOREIGN KEY (course_id) REFERENCES courses(id)
+                )''')
+    add_column(c, "notes", "file_path", "TEXT")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS exams (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    course_id INTEGER,
+                    title TEXT,
+                    file_path TEXT,
+                    FOREIGN KEY (course_id) REFERENCES courses(id)
+                )''')
+    add_column(c, "exams", "file_path", "TEXT")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS exam_submissions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id INTEGER,
+                    exam_id INTEGER,
+                    answer TEXT,
+                    submission_date TEXT,
+                    grade INTEGER,
+                    feedback TEXT,
+                    FOREIGN KEY (student_id) REFERENCES users(id),
+                    FOREIGN KEY (exam_id) REFERENCES exams(id)
+                )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS points (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id INTEGER UNIQUE,
+                    points INTEGER DEFAULT 0,
+                    FOREIGN KEY (student_id) REFERENCES users(id)
+                )''')
+
+
+@migration(2)
+def indexes_and_uniqueness(c):
+    """Foreign-key lookup indexes and the one-row-per-pair rules the code assumes."""
+    # Older databases may hold duplicates from racing SELECT-then-INSERT writes.
+    dedupe(c, "enrollments", "student_id, course_id")
+    dedupe(c, "submissions", "student_id, assignment_id")
+    dedupe(c, "exam_submissions", "student_id, exam_id")
+
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_enrollments_student_course ON enrollments(student_id, course_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_enrollments_course ON enrollments(course_id)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_submissions_student_assignment ON submissions(student_id, assignment_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_submissions_assignment ON submissions(assignment_id)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_exam_submissions_student_exam ON exam_submissions(student_id, exam_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_exam_submissions_exam ON exam_submissions(exam_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_assignments_course ON assignments(course_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_exams_course ON exams(course_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_notes_course ON notes(course_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_courses_teacher ON courses(teacher_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_users_email_role ON users(email, role)")
+
+
+@migration(3)
+def leaderboard_index(c):
+    """Serves ORDER BY points DESC and rank counts without scanning the table."""
+    c.execute("CREATE INDEX IF NOT EXISTS ix_points_rank ON points(points DESC, student_id)")
+
+
+@migration(4)
+def points_ledger(c):
+    """Append-only award log folded into points by backend.compact_points()."""
+    c.execute('''CREATE TABLE IF NOT EXISTS points_ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id INTEGER,
+                    points INTEGER,
+                    FOREIGN KEY (student_id) REFERENCES users(id)
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS ix_points_ledger_student ON points_ledger(student_id)")
+
+
+COUNTER_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS trg_assignments_count_ins AFTER INSERT ON assignments
+       WHEN NEW.course_id IS NOT NULL
+       BEGIN
+           INSERT INTO course_stats (course_id, assignment_count) VALUES (NEW.course_id, 1)
+           ON CONFLICT(course_id) DO UPDATE SET assignment_count = assignment_count + 1;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_assignments_count_del AFTER DELETE ON assignments
+       BEGIN
+           UPDATE course_stats SET assignment_count = assignment_count - 1
+           WHERE course_id = OLD.course_id;
+           UPDATE student_course_stats
+           SET submission_count = submission_count - (
+               SELECT COUNT(*) FROM submissions s
+               WHERE s.assignment_id = OLD.id AND s.student_id = student_course_stats.student_id)
+           WHERE course_id = OLD.course_id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_submissions_count_ins AFTER INSERT ON submissions
+       WHEN (SELECT course_id FROM assignments WHERE id = NEW.assignment_id) IS NOT NULL
+       BEGIN
+           INSERT INTO student_course_stats (student_id, course_id, submission_count)
+           VALUES (NEW.student_id, (SELECT course_id FROM assignments WHERE id = NEW.assignment_id), 1)
+           ON CONFLICT(student_id, course_id) DO UPDATE SET submission_count = submission_count + 1;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_submissions_count_del AFTER DELETE ON submissions
+       BEGIN
+           UPDATE student_course_stats SET submission_count = submission_count - 1
+           WHERE student_id = OLD.student_id
+             AND course_id = (SELECT course_id FROM assignments WHERE id = OLD.assignment_id);
+       END""",
+]
+
+
+@migration(5)
+def progress_counters(c):
+    """Per-course assignment counts and per-student submission counts, kept by triggers."""
+    c.execute('''CREATE TABLE IF NOT EXISTS course_stats (
+                    course_id INTEGER PRIMARY KEY,
+                    assignment_count INTEGER NOT NULL DEFAULT 0
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS student_course_stats (
+                    student_id INTEGER,
+                    course_id INTEGER,
+                    submission_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (student_id, course_id)
+                ) WITHOUT ROWID''')
+    for sql in COUNTER_TRIGGERS:
+        c.execute(sql)
+    rebuild_counters(c)
+
+
+def rebuild_counters(c):
+    """Recompute the progress counter tables from assignments and submissions."""
+    c.execute("DELETE FROM course_stats")
+    c.execute("""INSERT INTO course_stats (course_id, assignment_count)
+                 SELECT course_id, COUNT(*) FROM assignments
+                 WHERE course_id IS NOT NULL GROUP BY course_id""")
+    c.execute("DELETE FROM student_course_stats")
+    c.execute("""INSERT INTO student_course_stats (student_id, course_id, submission_count)
+                 SELECT s.student_id, a.course_id, COUNT(*)
+                 FROM submissions s JOIN assignments a ON a.id = s.assignment_id
+                 WHERE a.course_id IS NOT NULL
+                 GROUP BY s.student_id, a.course_id""")
+
+
+def check_counters(c):
+    """Return rows where a stored counter disagrees with a fresh recount."""
+    c.execute("""SELECT 'course_stats', t.course_id, NULL, COALESCE(s.assignment_count, 0), t.n
+                 FROM (SELECT course_id, COUNT(*) AS n FROM assignments
+                       WHERE course_id IS NOT NULL GROUP BY course_id) t
+                 LEFT JOIN course_stats s ON s.course_id = t.course_id
+                 WHERE COALESCE(s.assignment_count, 0) != t.n
+                 UNION ALL
+                 SELECT 'course_stats', s.course_id, NULL, s.assignment_count, 0
+                 FROM course_stats s
+                 WHERE s.assignment_count != 0
+                   AND NOT EXISTS (SELECT 1 FROM assignments a WHERE a.course_id = s.course_id)""")
+    bad = c.fetchall()
+    c.execute("""SELECT 'student_course_stats', t.course_id, t.student_id,
+                        COALESCE(s.submission_count, 0), t.n
+                 FROM (SELECT s.student_id, a.course_id, COUNT(*) AS n
+                       FROM submissions s JOIN assignments a ON a.id = s.assignment_id
+                       WHERE a.course_id IS NOT NULL
+                       GROUP BY s.student_id, a.course_id) t
+                 LEFT JOIN student_course_stats s
+                        ON s.student_id = t.student_id AND s.course_id = t.course_id
+                 WHERE COALESCE(s.submission_count, 0) != t.n
+                 UNION ALL
+                 SELECT 'student_course_stats', s.course_id, s.student_id, s.submission_count, 0
+                 FROM student_course_stats s
+                 WHERE s.submission_count != 0
+                   AND NOT EXISTS (SELECT 1 FROM submissions x JOIN assignments a ON a.id = x.assignment_id
+                                   WHERE x.student_id = s.student_id AND a.course_id = s.course_id)""")
+    return bad + c.fetchall()
+
+
+@migration(6)
+def content_addressed_files(c):
+    """Uploads reference blobs in storage.py by SHA-256; legacy rows keep only file_path."""
+    for table in ("assignments", "notes", "exams"):
+        add_column(c, table, "file_hash", "TEXT")
+        add_column(c, table, "file_size", "INTEGER")
+        c.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_file_hash ON {table}(file_hash)")
+
+
+@migration(7)
+def ungraded_indexes(c):
+    """Partial indexes over the grading backlog (rows with no grade yet)."""
+    c.execute("""CREATE INDEX IF NOT EXISTS ix_submissions_ungraded
+                 ON submissions(assignment_id, id) WHERE grade IS NULL""")
+    c.execute("""CREATE INDEX IF NOT EXISTS ix_exam_submissions_ungraded
+                 ON exam_submissions(exam_id, id) WHERE grade IS NULL""")
+
+
+COURSE_SEARCH_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS trg_courses_fts_ins AFTER INSERT ON courses BEGIN
+           INSERT INTO courses_fts (rowid, name) VALUES (NEW.id, NEW.name);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_courses_fts_del AFTER DELETE ON courses BEGIN
+           INSERT INTO courses_fts (courses_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_courses_fts_upd AFTER UPDATE OF name ON courses BEGIN
+           INSERT INTO courses_fts (courses_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+           INSERT INTO courses_fts (rowid, name) VALUES (NEW.id, NEW.name);
+       END""",
+]
+
+
+@migration(8)
+def course_search(c):
+    """FTS5 index over course names, kept in sync with courses by triggers."""
+    c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS courses_fts USING fts5(
+                     name, content='courses', content_rowid='id',
+                     tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+    c.execute("INSERT INTO courses_fts (courses_fts) VALUES ('rebuild')")
+    for sql in COURSE_SEARCH_TRIGGERS:
+        c.execute(sql)
+
+
+@migration(9)
+def answer_similarity(c):
+    """MinHash signatures, LSH buckets and near-duplicate pairs for answers."""
+    c.execute("""CREATE TABLE IF NOT EXISTS answer_signatures (
+                     kind TEXT NOT NULL, submission_id INTEGER NOT NULL, item_id INTEGER NOT NULL,
+                     signature BLOB NOT NULL,
+                     PRIMARY KEY (kind, submission_id)) WITHOUT ROWID""")
+    c.execute("""CREATE TABLE IF NOT EXISTS answer_buckets (
+                     kind TEXT NOT NULL, item_id INTEGER NOT NULL, band INTEGER NOT NULL,
+                     bucket INTEGER NOT NULL, submission_id INTEGER NOT NULL,
+                     PRIMARY KEY (kind, item_id, band, bucket, submission_id)) WITHOUT ROWID""")
+    c.execute("""CREATE TABLE IF NOT EXISTS answer_matches (
+                     kind TEXT NOT NULL, item_id INTEGER NOT NULL,
+                     submission_a INTEGER NOT NULL, submission_b INTEGER NOT NULL,
+                     similarity REAL NOT NULL,
+                     PRIMARY KEY (kind, submission_a, submission_b)) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_answer_matches_b ON answer_matches(kind, submission_b)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_answer_matches_item ON answer_matches(kind, item_id, similarity)")
+
+
+@migration(10)
+def course_shards(c):
+    """Which shard file holds each course's rows (see shards.py); absent means the catalog."""
+    c.execute("""CREATE TABLE IF NOT EXISTS course_shards (
+                     course_id INTEGER PRIMARY KEY,
+                     shard INTEGER NOT NULL)""")
+
+
+PDF_DOCUMENT_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS trg_pdf_documents_fts_ins AFTER INSERT ON pdf_documents BEGIN
+           INSERT INTO pdf_documents_fts (rowid, text) VALUES (NEW.id, NEW.text);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_pdf_documents_fts_del AFTER DELETE ON pdf_documents BEGIN
+           INSERT INTO pdf_documents_fts (pdf_documents_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_pdf_documents_fts_upd AFTER UPDATE OF text ON pdf_documents BEGIN
+           INSERT INTO pdf_documents_fts (pdf_documents_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+           INSERT INTO pdf_documents_fts (rowid, text) VALUES (NEW.id, NEW.text);
+       END""",
+]
+
+
+@migration(11)
+def pdf_pipeline(c):
+    """Background PDF extraction: a persistent job queue and the extracted text/previews."""
+    c.execute("""CREATE TABLE IF NOT EXISTS pdf_jobs (
+                     id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     kind TEXT NOT NULL CHECK(kind IN ('assignment', 'note', 'exam')),
+                     item_id INTEGER NOT NULL,
+                     file_path TEXT NOT NULL,
+                     status TEXT NOT NULL DEFAULT 'pending'
+                         CHECK(status IN ('pending', 'running', 'done', 'failed')),
+                     attempts INTEGER NOT NULL DEFAULT 0,
+                     run_after REAL NOT NULL DEFAULT 0,
+                     error TEXT,
+                     UNIQUE (kind, item_id))""")
+    c.execute("""CREATE INDEX IF NOT EXISTS ix_pdf_jobs_due ON pdf_jobs(run_after)
+                 WHERE status IN ('pending', 'running')""")
+    c.execute("""CREATE TABLE IF NOT EXISTS pdf_documents (
+                     id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     file_path TEXT NOT NULL UNIQUE,
+                     pages INTEGER NOT NULL,
+                     text TEXT NOT NULL,
+                     preview BLOB,
+                     extracted_at TEXT)""")
+    c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS pdf_documents_fts USING fts5(
+                     text, content='pdf_documents', content_rowid='id',
+                     tokenize='unicode61 remove_diacritics 2')""")
+    for sql in PDF_DOCUMENT_TRIGGERS:
+        c.execute(sql)
+
+
+DUPLICATE_EMAILS_SQL = """
+    SELECT email, id, username, role FROM users
+    WHERE email IN (SELECT email FROM users WHERE email IS NOT NULL GROUP BY email HAVING COUNT(*) > 1)
+    ORDER BY email, id"""
+
+
+def duplicate_emails(c):
+    """(email, user_id, username, role) of every account sharing its email with another."""
+    c.execute(DUPLICATE_EMAILS_SQL)
+    return c.fetchall()
+
+
+@migration(12)
+def unique_emails(c):
+    """
+    Make users(email) unique on databases whose email column was added by
+    ALTER TABLE (migration 1) and so never had the constraint. Login is by
+    email, so shared addresses are never rewritten here: the migration
+    stops and lists them until an admin gives each account its own
+    (python manage.py email-conflicts).
+    """
+    duplicates = duplicate_emails(c)
+    if duplicates:
+        listed = "\n".join(f"  {email}: user {uid} ({username}, {role})"
+                            for email, uid, username, role in duplicates[:20])
+        more = f"\n  ... {len(duplicates) - 20} more" if len(duplicates) > 20 else ""
+        raise RuntimeError("accounts share email addresses; give each its own with "
+                           f"`python manage.py email-conflicts --set USER_ID EMAIL`, then migrate again:\n"
+                           f"{listed}{more}")
+    # Tables created by migration 1 already have email UNIQUE; don't index it twice.
+    c.execute("""SELECT 1 FROM pragma_index_list('users') l
+                 WHERE l."unique" AND (SELECT group_concat(name) FROM pragma_index_info(l.name)) = 'email'""")
+    if c.fetchone() is None:
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_users_email ON users(email)")
+
+
+POINT_COUNT_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS trg_point_counts_ins AFTER INSERT ON points BEGIN
+           INSERT INTO point_counts (points, students) VALUES (COALESCE(NEW.points, 0), 1)
+           ON CONFLICT(points) DO UPDATE SET students = students + 1;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_point_counts_del AFTER DELETE ON points BEGIN
+           UPDATE point_counts SET students = students - 1 WHERE points = COALESCE(OLD.points, 0);
+           DELETE FROM point_counts WHERE points = COALESCE(OLD.points, 0) AND students = 0;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_point_counts_upd AFTER UPDATE OF points ON points
+       WHEN OLD.points IS NOT NEW.points BEGIN
+           UPDATE point_counts SET students = students - 1 WHERE points = COALESCE(OLD.points, 0);
+           DELETE FROM point_counts WHERE points = COALESCE(OLD.points, 0) AND students = 0;
+           INSERT INTO point_counts (points, students) VALUES (COALESCE(NEW.points, 0), 1)
+           ON CONFLICT(points) DO UPDATE SET students = students + 1;
+       END""",
+]
+
+
+@migration(13)
+def point_counts(c):
+    """
+    Students per points total, kept by triggers on points, so a rank is a sum
+    over the distinct totals above a score instead of a count of students.
+    """
+    c.execute("""CREATE TABLE IF NOT EXISTS point_counts (
+                     points INTEGER PRIMARY KEY,
+                     students INTEGER NOT NULL
+                 )""")
+    c.execute("DELETE FROM point_counts")
+    c.execute("""INSERT INTO point_counts (points, students)
+                 SELECT COALESCE(points, 0), COUNT(*) FROM points GROUP BY 1""")
+    for sql in POINT_COUNT_TRIGGERS:
+        c.execute(sql)
+
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ---------------- ENGINE -----------------
+def current_version(c):
+    c.execute("PRAGMA user_version")
+    return c.fetchone()[0]
+
+
+_current = set()   # database paths already checked by this process
+_current_lock = threading.Lock()
+
+
+def ensure_current():
+    """
+    migrate() once per process and database file; every later call is a set
+    lookup. Returns the schema version when it had to check, else None.
+    """
+    path = db.get_pool().path
+    if path in _current:
+        return None
+    with _current_lock:
+        if path in _current:
+            return None
+        version = migrate()
+        _current.add(path)
+    return version
+
+
+def migrate(target=None):
+    """
+    Bring the database up to `target` (default: latest) and return the
+    resulting version. Safe to call from several processes at once.
+    """
+    target = LATEST_VERSION if target is None else target
+    with db.get_pool().connection() as conn:
+        c = conn.cursor()
+        try:
+            version = current_version(c)
+            if version >= target:
+                return version
+            for version, fn in MIGRATIONS:
+                if version > target:
+                    break
+                c.execute("BEGIN IMMEDIATE")
+                try:
+                    # Re-check under the write lock: another process may have won.
+                    if current_version(c) < version:
+                        fn(c)
+                        c.execute(f"PRAGMA user_version = {version}")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            return current_version(c)
+        finally:
+            c.close()
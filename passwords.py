@@ -0,0 +1,130 @@
+# passwords.py
+"""
+Salted password hashing.
+
+Passwords are stored as "scrypt$<n>$<r>$<p>$<salt>$<hash>" (base64 salt
+and hash) with a work factor tunable through LMS_SCRYPT_N. Hashing and
+checking run on a small bounded worker pool: each scrypt call takes tens of
+milliseconds and SCRYPT_N * SCRYPT_R * 128 bytes of memory, so a
+start-of-term login rush queues here instead of running hundreds of KDFs at
+once. hashlib releases the GIL while it works, so other sessions keep
+rendering.
+
+Rows written before hashing existed hold the plaintext; verify() still
+accepts them, and needs_rehash() tells the caller to upgrade the row.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCRYPT_N = int(os.environ.get("LMS_SCRYPT_N", 2**14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+WORKERS = max(2, min(8, os.cpu_count() or 1))
+MAX_PENDING = 256           # queued hash jobs before callers wait
+QUEUE_TIMEOUT = 30.0        # seconds a caller waits for a queue slot
+SCHEME = "scrypt"
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * n * r + 2**20, dklen=KEY_BYTES)
+
+
+def hash_password(password):
+    """Return a new salted hash string for `password` (runs in the caller's thread)."""
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{SCHEME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(SCHEME + "$")
+
+
+def verify(password, stored):
+    """
+    Check `password` against a stored hash, or against a legacy plaintext
+    value. Comparisons are constant-time.
+    """
+    if stored is None or password is None:
+        return False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        expected = base64.b64decode(digest)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(stored):
+    """True for plaintext rows and hashes made with other cost settings."""
+    if not is_hashed(stored):
+        return True
+    return stored.split("$")[1:4] != [str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+
+
+# Verified against when the account does not exist, so a wrong email costs
+# as much as a wrong password and response times don't reveal accounts.
+_DUMMY = None
+
+
+def dummy_hash():
+    global _DUMMY
+    if _DUMMY is None or needs_rehash(_DUMMY):
+        _DUMMY = hash_password(os.urandom(8).hex())
+    return _DUMMY
+
+
+# ---------------- WORKER POOL -----------------
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="password-hash")
+    return _pool
+
+
+def _run(fn, *args):
+    if not _slots.acquire(timeout=QUEUE_TIMEOUT):
+        raise RuntimeError("password hashing queue is full")
+    try:
+        future = _get_pool().submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda f: _slots.release())
+    return future.result()
+
+
+def hash_in_pool(password):
+    """hash_password() on the worker pool; blocks only the calling session."""
+    return _run(hash_password, password)
+
+
+def verify_in_pool(password, stored):
+    """verify() on the worker pool; blocks only the calling session."""
+    return _run(verify, password, stored)
+
+
+def hash_many(passwords):
+    """Hash a batch of passwords across the pool, preserving order."""
+    return list(_get_pool().map(hash_password, passwords))
@@ -0,0 +1,262 @@
+# pdf_pipeline.py
+"""
+Background processing of uploaded PDFs.
+
+add_assignment, upload_note and create_exam only store the blob and put a
+row on the pdf_jobs queue. A dispatcher thread claims due jobs and runs
+extract() in a process pool, so parsing and rendering never hold up a page
+and never compete with Streamlit sessions for the GIL. Each PDF's page
+count, text and a first-page PNG preview land in pdf_documents, keyed by
+blob path (identical uploads share one row), with an FTS5 index over the
+text for search_materials().
+
+The queue lives in the catalog database, so it survives restarts. Claiming
+a job moves its run_after LEASE seconds ahead: if the process dies the job
+is claimed again once the lease runs out, and stopping the pipeline hands
+unfinished jobs straight back. Failed jobs are retried with exponential
+backoff up to MAX_ATTEMPTS, then marked failed with the error. Extraction
+needs PyMuPDF; without it start() does nothing and jobs wait for a process
+that has it.
+
+    python manage.py process-pdfs [--backfill]
+"""
+import importlib.util
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import cache
+import db
+import shards
+
+WORKERS = max(1, min(4, os.cpu_count() or 1))   # extraction processes
+IN_FLIGHT = 2                 # jobs queued per worker so none sits idle
+LEASE = 300.0                 # seconds a claimed job is reserved for its worker
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 10.0            # seconds before the first retry; doubles each attempt
+POLL_INTERVAL = 5.0           # seconds between queue checks when idle
+MAX_TEXT_CHARS = 500000       # text kept per document
+PREVIEW_WIDTH = 320           # pixels
+
+KINDS = {"assignment": "assignments", "note": "notes", "exam": "exams"}
+
+
+def available():
+    """True when PyMuPDF is installed."""
+    return importlib.util.find_spec("pymupdf") is not None
+
+
+# ---------------- EXTRACTION (worker processes) -----------------
+def extract(path):
+    """(pages, text, preview_png) of one PDF. Runs in a pool process."""
+    import pymupdf
+    with pymupdf.open(path) as doc:
+        pages = doc.page_count
+        parts, size = [], 0
+        for page in doc:
+            if size >= MAX_TEXT_CHARS:
+                break
+            text = page.get_text()
+            parts.append(text)
+            size += len(text)
+        preview = None
+        if pages:
+            first = doc[0]
+            zoom = PREVIEW_WIDTH / max(first.rect.width, 1)
+            preview = first.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom)).tobytes("png")
+    return pages, "\n".join(parts)[:MAX_TEXT_CHARS], preview
+
+
+# ---------------- QUEUE -----------------
+def enqueue(kind, item_id, file_path):
+    """Queue (or re-queue) extraction of an item's PDF and wake the dispatcher."""
+    if not file_path:
+        return
+    with shards.using(0), db.transaction() as c:
+        c.execute("""INSERT INTO pdf_jobs (kind, item_id, file_path) VALUES (?, ?, ?)
+                     ON CONFLICT(kind, item_id) DO UPDATE
+                     SET file_path = excluded.file_path, status = 'pending', attempts = 0,
+                         run_after = 0, error = NULL""", (kind, item_id, file_path))
+    _wake.set()
+
+
+def backfill():
+    """Queue every uploaded item, on every shard, whose PDF has no document yet. Returns jobs added."""
+    added = 0
+    for shard in range(shards.count()):
+        with shards.using(shard), db.cursor() as c:
+            c.execute(" UNION ALL ".join(
+                f"SELECT '{kind}', id, file_path FROM {table} WHERE file_path IS NOT NULL"
+                for kind, table in KINDS.items()))
+            items = c.fetchall()
+        with shards.using(0), db.transaction() as c:
+            c.executemany("""INSERT OR IGNORE INTO pdf_jobs (kind, item_id, file_path)
+                             SELECT ?1, ?2, ?3
+                             WHERE NOT EXISTS (SELECT 1 FROM pdf_documents WHERE file_path = ?3)""", items)
+            added += c.rowcount
+    _wake.set()
+    return added
+
+
+def claim(limit, now=None):
+    """Reserve up to `limit` due jobs for LEASE seconds; returns (id, file_path, attempts)."""
+    now = time.time() if now is None else now
+    with shards.using(0), db.transaction() as c:
+        c.execute("""UPDATE pdf_jobs SET status = 'running', attempts = attempts + 1, run_after = ?1
+                     WHERE id IN (SELECT id FROM pdf_jobs
+                                  WHERE status IN ('pending', 'running') AND run_after <= ?2
+                                  ORDER BY run_after, id LIMIT ?3)
+                     RETURNING id, file_path, attempts""", (now + LEASE, now, limit))
+        return c.fetchall()
+
+
+def known(paths):
+    """The subset of `paths` that already have a document."""
+    with shards.using(0), db.cursor() as c:
+        c.execute("SELECT file_path FROM pdf_documents WHERE file_path IN (SELECT value FROM json_each(?))",
+                  (json.dumps(list(paths)),))
+        return {row[0] for row in c.fetchall()}
+
+
+def complete(job_id, path, result):
+    """Store an extraction result and finish its job (result None: document already stored)."""
+    with shards.using(0), db.transaction() as c:
+        if result is not None:
+            pages, text, preview = result
+            c.execute("""INSERT INTO pdf_documents (file_path, pages, text, preview, extracted_at)
+                         VALUES (?, ?, ?, ?, ?)
+                         ON CONFLICT(file_path) DO UPDATE
+                         SET pages = excluded.pages, text = excluded.text, preview = excluded.preview,
+                             extracted_at = excluded.extracted_at""",
+                      (path, pages, text, preview, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        c.execute("UPDATE pdf_jobs SET status = 'done', error = NULL WHERE id = ?", (job_id,))
+    cache.bump("pdf_documents")
+
+
+def fail(job_id, attempts, error):
+    """Schedule a retry with backoff, or give up after MAX_ATTEMPTS."""
+    status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+    with shards.using(0), db.transaction() as c:
+        c.execute("UPDATE pdf_jobs SET status = ?, run_after = ?, error = ? WHERE id = ?",
+                  (status, time.time() + RETRY_DELAY * 2 ** (attempts - 1), str(error)[:1000], job_id))
+
+
+def release(job_ids):
+    """Hand unfinished jobs back to the queue right away (on shutdown)."""
+    with shards.using(0), db.transaction() as c:
+        c.executemany("""UPDATE pdf_jobs SET status = 'pending', attempts = attempts - 1, run_after = 0
+                         WHERE id = ? AND status = 'running'""", ((job_id,) for job_id in job_ids))
+
+
+def job_counts():
+    """{status: jobs} for the whole queue."""
+    with shards.using(0), db.cursor() as c:
+        c.execute("SELECT status, COUNT(*) FROM pdf_jobs GROUP BY status")
+        return dict(c.fetchall())
+
+
+# ---------------- DISPATCHER -----------------
+_wake = threading.Event()
+
+
+class PdfPipeline(threading.Thread):
+    """Daemon thread feeding due jobs to a process pool and recording results."""
+
+    def __init__(self, workers=WORKERS, poll=POLL_INTERVAL):
+        super().__init__(name="pdf-pipeline", daemon=True)
+        self.workers = workers
+        self.poll = poll
+        self._stop_event = threading.Event()
+        self.processed = 0
+        self.failed = 0
+
+    def run(self):
+        self.drain(until_idle=False)
+
+    def drain(self, until_idle=True):
+        """
+        Process jobs until stopped, or (until_idle) until no job is due.
+        Pool processes are spawned, not forked, so they never inherit the
+        parent's SQLite connections or threads.
+        """
+        import multiprocessing
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        from concurrent.futures.process import BrokenProcessPool
+
+        def new_pool():
+            return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+        pool, in_flight = new_pool(), {}
+        try:
+            while not self._stop_event.is_set():
+                free = self.workers * IN_FLIGHT - len(in_flight)
+                jobs = claim(free) if free > 0 else []
+                done = known(path for _, path, _ in jobs)
+                for job_id, path, attempts in jobs:
+                    if path in done:
+                        complete(job_id, path, None)
+                        self.processed += 1
+                    else:
+                        in_flight[pool.submit(extract, path)] = (job_id, path, attempts)
+                if not in_flight:
+                    if until_idle and not jobs:
+                        return
+                    if not jobs:
+                        _wake.wait(self.poll)
+                        _wake.clear()
+                    continue
+                finished, _ = wait(in_flight, timeout=self.poll, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in finished:
+                    job_id, path, attempts = in_flight.pop(future)
+                    try:
+                        complete(job_id, path, future.result())
+                        self.processed += 1
+                    except BrokenProcessPool as e:
+                        broken = True
+                        self.failed += 1
+                        fail(job_id, attempts, e)
+                    except Exception as e:
+                        self.failed += 1
+                        fail(job_id, attempts, e)
+                if broken:
+                    # A worker died (e.g. on a malformed file): retry the rest on a new pool.
+                    for job_id, path, attempts in in_flight.values():
+                        fail(job_id, attempts, "worker process died")
+                    in_flight.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = new_pool()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            release(job_id for job_id, _, _ in in_flight.values())
+
+    def stop(self):
+        self._stop_event.set()
+        _wake.set()
+        self.join()
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def start(workers=WORKERS):
+    """Start the process-wide pipeline once; None when PyMuPDF is missing."""
+    global _pipeline
+    if not available():
+        return None
+    with _pipeline_lock:
+        if _pipeline is None or not _pipeline.is_alive():
+            _pipeline = PdfPipeline(workers)
+            _pipeline.start()
+    return _pipeline
+
+
+def stop():
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is not None:
+            _pipeline.stop()
+            _pipeline = None
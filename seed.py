@@ -0,0 +1,125 @@
+# seed.py
+"""
+Synthetic data generator.
+
+Fills a database with deterministic fake users, courses, enrollments,
+submissions and points at a chosen scale. Rows are generated in SQL with
+recursive CTEs, and the progress-counter triggers are suspended during the
+load and rebuilt once at the end, so millions of rows take seconds. Every
+seeded course lands on the catalog shard; `manage.py rebalance` spreads them
+when sharding is on.
+
+    python manage.py seed --scale large
+"""
+import re
+import time
+
+import cache
+import db
+import migrations
+import passwords
+
+SCALES = {
+    "tiny":   dict(users=500, courses=20, enrollments=2000, submissions=6000, exam_submissions=2000),
+    "small":  dict(users=5000, courses=200, enrollments=50000, submissions=200000, exam_submissions=50000),
+    "medium": dict(users=20000, courses=1000, enrollments=200000, submissions=800000, exam_submissions=200000),
+    "large":  dict(users=50000, courses=2000, enrollments=500000, submissions=2000000, exam_submissions=500000),
+}
+ASSIGNMENTS_PER_COURSE = 10
+EXAMS_PER_COURSE = 3
+TEACHER_EVERY = 50   # one teacher per this many users
+PASSWORD = "password"
+
+
+def _numbers(n):
+    return f"WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {int(n)})"
+
+
+def generate(users, courses, enrollments, submissions, exam_submissions, log=print):
+    """
+    Append a synthetic dataset to the current database. Students get ids
+    first, then teachers; each enrollment submits to a fixed share of its
+    course's assignments and exams. Returns the resulting table sizes.
+    """
+    migrations.migrate()
+    teachers = max(users // TEACHER_EVERY, 1)
+    students = max(users - teachers, 1)
+    per_student = -(-enrollments // students)
+    if per_student > courses:
+        raise ValueError("more enrollments than students x courses allows")
+    subs_per_enrollment = min(round(submissions / enrollments), ASSIGNMENTS_PER_COURSE)
+    exams_per_enrollment = min(round(exam_submissions / enrollments), EXAMS_PER_COURSE)
+    # One hash (and salt) shared by every synthetic user keeps seeding fast.
+    hashed = passwords.hash_password(PASSWORD)
+    triggers = re.findall(r"TRIGGER IF NOT EXISTS (\w+)", " ".join(migrations.COUNTER_TRIGGERS))
+    start = time.perf_counter()
+
+    with db.transaction() as c:
+        c.execute("BEGIN IMMEDIATE")   # DDL below must share the transaction
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+        u0 = c.fetchone()[0]
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM courses")
+        c0 = c.fetchone()[0]
+        for name in triggers:
+            c.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+        c.execute(f"""{_numbers(students + teachers)}
+            INSERT INTO users (username, email, password, role)
+            SELECT 'user' || ({u0} + i), 'user' || ({u0} + i) || '@lms.test', ?,
+                   CASE WHEN i > {students} THEN 'Teacher' ELSE 'Student' END
+            FROM n""", (hashed,))
+        c.execute(f"""{_numbers(courses)}
+            INSERT INTO courses (name, teacher_id)
+            SELECT 'Course ' || ({c0} + i), {u0 + students} + 1 + (i * 7919) % {teachers} FROM n""")
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM assignments")
+        a0 = c.fetchone()[0]
+        c.execute(f"""{_numbers(courses * ASSIGNMENTS_PER_COURSE)}
+            INSERT INTO assignments (course_id, title)
+            SELECT {c0} + 1 + (i - 1) / {ASSIGNMENTS_PER_COURSE},
+                   'Assignment ' || (1 + (i - 1) % {ASSIGNMENTS_PER_COURSE})
+            FROM n""")
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM exams")
+        e0 = c.fetchone()[0]
+        c.execute(f"""{_numbers(courses * EXAMS_PER_COURSE)}
+            INSERT INTO exams (course_id, title)
+            SELECT {c0} + 1 + (i - 1) / {EXAMS_PER_COURSE}, 'Exam ' || (1 + (i - 1) % {EXAMS_PER_COURSE})
+            FROM n""")
+        # Student s takes courses (s * 31 + j) mod C for j < per_student: distinct per student.
+        c.execute(f"""{_numbers(enrollments)}
+            INSERT OR IGNORE INTO enrollments (student_id, course_id)
+            SELECT {u0} + 1 + (i - 1) % {students},
+                   {c0} + 1 + (((i - 1) % {students}) * 31 + (i - 1) / {students}) % {courses}
+            FROM n""")
+        c.execute(f"""
+            INSERT INTO submissions (student_id, assignment_id, answer, submission_date)
+            SELECT e.student_id, a.id, 'Answer from ' || e.student_id || ' to ' || a.title,
+                   '2025-01-01 10:00:00'
+            FROM enrollments e
+            JOIN assignments a ON a.course_id = e.course_id
+            WHERE e.course_id > {c0} AND a.id > {a0}
+              AND (a.id + e.student_id) % {ASSIGNMENTS_PER_COURSE} < {subs_per_enrollment}""")
+        c.execute(f"""
+            INSERT INTO exam_submissions (student_id, exam_id, answer, submission_date)
+            SELECT e.student_id, x.id, 'Exam answer from ' || e.student_id, '2025-01-02 10:00:00'
+            FROM enrollments e
+            JOIN exams x ON x.course_id = e.course_id
+            WHERE e.course_id > {c0} AND x.id > {e0}
+              AND (x.id + e.student_id) % {EXAMS_PER_COURSE} < {exams_per_enrollment}""")
+        c.execute(f"""
+            INSERT INTO points (student_id, points)
+            SELECT id, (id * 37) % 1000 FROM users WHERE id > {u0} AND role = 'Student'
+            ON CONFLICT(student_id) DO NOTHING""")
+
+        migrations.rebuild_counters(c)
+        for sql in migrations.COUNTER_TRIGGERS:
+            c.execute(sql)
+
+        counts = {}
+        for table in ("users", "courses", "assignments", "exams", "enrollments",
+                      "submissions", "exam_submissions", "points"):
+            c.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = c.fetchone()[0]
+    cache.bump("users", "courses", "enrollments", "assignments", "exams", "notes")
+    log(f"seeded in {time.perf_counter() - start:.1f}s: " +
+        ", ".join(f"{k}={v}" for k, v in counts.items()))
+    return counts
@@ -0,0 +1,501 @@
+# shards.py
+"""
+Course-sharded storage.
+
+Global tables (users, courses, points, ...) live in the catalog, db.DB_PATH.
+The course-scoped tables (COURSE_TABLES, plus the counters and copy-detection
+state derived from them) of each course live in one shard file: shard 0 is
+the catalog itself, shard k >= 1 is "<catalog stem>.shard<k>.db" next to it.
+Every file carries the full schema, so migrations run on each unchanged;
+the catalog's course_shards table maps a course to its shard and courses
+missing from it stay on shard 0. With LMS_SHARDS=1 (the default) nothing
+here does any work and everything lives in one file as before.
+
+Shard connections ATTACH the catalog and shadow its global tables with TEMP
+views, so the backend's joins against users and courses run unchanged on
+any shard. Writers for different courses then commit to different files and
+never wait on each other's database lock.
+
+Routing sits behind backend.py's signatures:
+
+    @shards.by_course()          run on the course's shard
+    @shards.by_item("assignments", "assignment_id")
+    @shards.fan_out(merge)       run on every shard in parallel and merge
+
+Ids stay globally unique: assignments, exams and notes take ids from the
+catalog's sequence wherever they are stored (new_id), and each shard starts
+its enrollment/submission sequences at k * SHARD_ID_SPAN, so a submission
+id alone names its shard (shard_of_row). Moving a course (move_course,
+`manage.py rebalance`) keeps its item ids and renumbers its enrollments and
+submissions into the target shard's range.
+"""
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cache
+import db
+import migrations
+
+SHARDS = int(os.environ.get("LMS_SHARDS", 1))
+SHARD_ID_SPAN = 1 << 40     # enrollment/submission ids per shard
+FANOUT_WORKERS = 8
+MAP_TTL = cache.TTL         # seconds before re-reading course_shards written by other processes
+
+# Global tables read through the attached catalog on shard connections.
+GLOBAL_TABLES = ("users", "courses", "points", "points_ledger")
+# Tables holding a course's rows, keyed by course_id.
+COURSE_TABLES = ("enrollments", "assignments", "exams", "notes", "submissions", "exam_submissions")
+# Item tables whose ids come from the catalog sequence.
+ITEM_TABLES = ("assignments", "exams", "notes")
+# Per-shard sequences, started at shard * SHARD_ID_SPAN.
+ROW_TABLES = ("enrollments", "submissions", "exam_submissions")
+
+_local = threading.local()
+_lock = threading.Lock()
+_pools = {}            # shard path -> ShardPool
+_ready = set()         # shard paths migrated by this process
+_course_map = None     # (cache version, loaded_at, {course_id: shard})
+_item_course = {}      # (item table, item id) -> course_id; never changes
+_executor = None
+
+
+# ---------------- CONFIGURATION -----------------
+def configure(count):
+    """Set the number of shard files (1 turns sharding off) and drop cached routes."""
+    global SHARDS, _course_map
+    if count < 1:
+        raise ValueError("need at least one shard")
+    with _lock:
+        SHARDS = count
+        _course_map = None
+        _item_course.clear()
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def count():
+    return SHARDS
+
+
+def shard_path(shard):
+    """Database file of a shard; shard 0 is the catalog."""
+    if shard == 0:
+        return db.DB_PATH
+    stem, ext = os.path.splitext(db.DB_PATH)
+    return f"{stem}.shard{shard}{ext or '.db'}"
+
+
+class ShardPool(db.ConnectionPool):
+    """Pool on a shard file whose connections see the catalog's global tables."""
+
+    def __init__(self, path, catalog, size=db.POOL_SIZE, timeout=db.BUSY_TIMEOUT):
+        super().__init__(path, size, timeout)
+        self.catalog = catalog
+
+    def _open(self):
+        conn = super()._open()
+        conn.execute("ATTACH DATABASE ? AS catalog", (self.catalog,))
+        for table in GLOBAL_TABLES:
+            conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS {table} AS SELECT * FROM catalog.{table}")
+        return conn
+
+
+def get_pool(shard):
+    """Connection pool of shard `shard` (this thread's catalog pool for shard 0)."""
+    if shard == 0:
+        return _home()
+    path = shard_path(shard)
+    pool = _pools.get(path)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = ShardPool(path, db.DB_PATH)
+    return pool
+
+
+def init():
+    """Create and migrate the shard files; free once done in this process."""
+    for shard in range(1, SHARDS):
+        path = shard_path(shard)
+        if path in _ready:
+            continue
+        with _lock:
+            if path in _ready:
+                continue
+            pool = db.ConnectionPool(path, 1)
+            try:
+                with db.using(pool):
+                    migrations.ensure_current()
+                    with db.transaction() as c:
+                        _start_sequences(c, shard)
+            finally:
+                pool.close()
+            _ready.add(path)
+
+
+def _start_sequences(c, shard):
+    base = shard * SHARD_ID_SPAN
+    for table in ROW_TABLES:
+        c.execute("INSERT INTO sqlite_sequence (name, seq) SELECT ?1, ?2 "
+                  "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?1)", (table, base))
+        c.execute("UPDATE sqlite_sequence SET seq = ?2 WHERE name = ?1 AND seq < ?2", (table, base))
+
+
+# ---------------- ROUTING -----------------
+def _home():
+    """The catalog pool of this thread: the one it used before any shard was bound."""
+    home = getattr(_local, "home", None)
+    return home if home is not None else db.get_pool()
+
+
+def current():
+    """Shard the calling thread is routed to."""
+    return getattr(_local, "shard", 0)
+
+
+@contextmanager
+def using(shard, home=None):
+    """Route db.cursor()/db.transaction() in this thread to `shard` for the block."""
+    outer = (getattr(_local, "home", None), getattr(_local, "shard", 0))
+    if outer[0] is None:
+        _local.home = home or db.get_pool()
+    _local.shard = shard
+    try:
+        with db.using(get_pool(shard)):
+            yield shard
+    finally:
+        _local.home, _local.shard = outer
+
+
+def _load_map():
+    with using(0), db.cursor() as c:
+        c.execute("SELECT course_id, shard FROM course_shards")
+        return dict(c.fetchall())
+
+
+def shard_of_course(course_id):
+    """Shard holding a course's rows."""
+    global _course_map
+    if SHARDS == 1 or course_id is None:
+        return 0
+    entry = _course_map
+    version = cache.version("course_shards")
+    now = time.monotonic()
+    if entry is None or entry[0] != version or entry[1] + MAP_TTL < now:
+        entry = _course_map = (version, now, _load_map())
+    shard = entry[2].get(course_id)
+    if shard is None:
+        # Placed by another process since the map was read, or on the catalog.
+        with using(0), db.cursor() as c:
+            c.execute("SELECT shard FROM course_shards WHERE course_id = ?", (course_id,))
+            row = c.fetchone()
+        shard = entry[2][course_id] = row[0] if row else 0
+    return shard if shard < SHARDS else 0
+
+
+def course_of_item(table, item_id):
+    """course_id of an assignment, exam or note, looked up across the shards once."""
+    key = (table, item_id)
+    course_id = _item_course.get(key)
+    if course_id is None:
+        for shard in range(SHARDS):
+            with using(shard), db.cursor() as c:
+                c.execute(f"SELECT course_id FROM {table} WHERE id = ?", (item_id,))
+                row = c.fetchone()
+            if row is not None:
+                course_id = _item_course[key] = row[0]
+                break
+    return course_id
+
+
+def shard_of_item(table, item_id):
+    if SHARDS == 1:
+        return 0
+    return shard_of_course(course_of_item(table, item_id))
+
+
+def shard_of_row(row_id):
+    """Shard of an enrollment or submission: its id lies in that shard's range."""
+    if SHARDS == 1:
+        return 0
+    shard = row_id // SHARD_ID_SPAN
+    return shard if shard < SHARDS else 0
+
+
+def split_rows(rows, key):
+    """{shard: [rows]} grouping rows by shard_of_row(key(row))."""
+    if SHARDS == 1:
+        return {0: list(rows)}
+    groups = {}
+    for row in rows:
+        groups.setdefault(shard_of_row(key(row)), []).append(row)
+    return groups
+
+
+def _argument(fn, name):
+    """Return a getter for argument `name` of `fn` from (args, kwargs)."""
+    code = fn.__code__
+    names = code.co_varnames[:code.co_argcount]
+    pos = names.index(name)
+    defaults = dict(zip(names[len(names) - len(fn.__defaults__ or ()):], fn.__defaults__ or ()))
+    default = defaults.get(name)
+
+    def get(args, kwargs):
+        return args[pos] if len(args) > pos else kwargs.get(name, default)
+    return get
+
+
+def _routed(locate):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if SHARDS == 1:
+                return fn(*args, **kwargs)
+            with using(locate(args, kwargs)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def by_course(name="course_id"):
+    """Run the decorated function on the shard of its `name` argument's course."""
+    def decorate(fn):
+        get = _argument(fn, name)
+        return _routed(lambda args, kwargs: shard_of_course(get(args, kwargs)))(fn)
+    return decorate
+
+
+def by_item(table, name):
+    """Run the decorated function on the shard of the `table` row its `name` argument ids."""
+    def decorate(fn):
+        get = _argument(fn, name)
+        return _routed(lambda args, kwargs: shard_of_item(table, get(args, kwargs)))(fn)
+    return decorate
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="shard-fanout")
+    return _executor
+
+
+def fan_out(merge):
+    """
+    Run the decorated function on every shard in parallel and return
+    merge([result of shard 0, result of shard 1, ...]).
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if SHARDS == 1:
+                return fn(*args, **kwargs)
+            home = _home()
+
+            def call(shard):
+                with using(shard, home):
+                    return fn(*args, **kwargs)
+            return merge(list(_get_executor().map(call, range(SHARDS))))
+        return wrapper
+    return decorate
+
+
+def concat(results):
+    return [row for rows in results for row in rows]
+
+
+def total(results):
+    if results and isinstance(results[0], tuple):
+        return tuple(map(sum, zip(*results)))
+    return sum(results)
+
+
+# ---------------- PLACEMENT -----------------
+def place(c, course_id):
+    """Record a new course's shard (course_id modulo the shard count) with catalog cursor `c`."""
+    shard = course_id % SHARDS
+    if shard:
+        c.execute("INSERT OR REPLACE INTO course_shards (course_id, shard) VALUES (?, ?)", (course_id, shard))
+    return shard
+
+
+def new_id(table):
+    """
+    Id for a new row of an item table on the routed shard, drawn from the
+    catalog's sequence so it is unique across shards. None on the catalog,
+    where AUTOINCREMENT draws from the same sequence.
+    """
+    if current() == 0:
+        return None
+    with using(0), db.transaction() as c:
+        c.execute("INSERT INTO sqlite_sequence (name, seq) SELECT ?1, 0 "
+                  "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?1)", (table,))
+        c.execute(f"""UPDATE sqlite_sequence SET seq = MAX(seq, (SELECT COALESCE(MAX(id), 0) FROM {table})) + 1
+                      WHERE name = ? RETURNING seq""", (table,))
+        return c.fetchone()[0]
+
+
+# ---------------- REBALANCING -----------------
+LOAD_SQL = """
+    SELECT course_id, SUM(n) FROM (
+        SELECT course_id, COUNT(*) AS n FROM enrollments GROUP BY course_id
+        UNION ALL
+        SELECT a.course_id, COUNT(*) FROM submissions s JOIN assignments a ON a.id = s.assignment_id
+        GROUP BY a.course_id
+        UNION ALL
+        SELECT e.course_id, COUNT(*) FROM exam_submissions s JOIN exams e ON e.id = s.exam_id
+        GROUP BY e.course_id)
+    WHERE course_id IS NOT NULL
+    GROUP BY course_id
+"""
+
+
+def course_loads():
+    """{shard: {course_id: rows}} counting enrollments and submissions."""
+    loads = {}
+    for shard in range(SHARDS):
+        with using(shard), db.cursor() as c:
+            c.execute(LOAD_SQL)
+            loads[shard] = {cid: n for cid, n in c.fetchall() if shard_of_course(cid) == shard}
+    return loads
+
+
+def plan_rebalance(tolerance=0.1):
+    """
+    Moves [(course_id, from_shard, to_shard, rows)] that bring every shard
+    within `tolerance` of the mean load, moving the biggest course that fits
+    from the fullest shard to the emptiest one at each step.
+    """
+    loads = course_loads()
+    totals = {shard: sum(courses.values()) for shard, courses in loads.items()}
+    mean = sum(totals.values()) / SHARDS
+    moves = []
+    while True:
+        heavy = max(totals, key=totals.get)
+        light = min(totals, key=totals.get)
+        gap = totals[heavy] - totals[light]
+        if gap <= tolerance * mean:
+            return moves
+        fits = [(n, cid) for cid, n in loads[heavy].items() if 0 < n < gap]
+        if not fits:
+            return moves
+        n, cid = max(fits)
+        del loads[heavy][cid]
+        loads[light][cid] = n
+        totals[heavy] -= n
+        totals[light] += n
+        moves.append((cid, heavy, light, n))
+
+
+def move_course(course_id, target):
+    """
+    Move a course's rows to shard `target`. Run it in a quiet window: writes
+    to the course's old shard wait for the move, and this process's routes
+    switch when it commits (other processes within MAP_TTL seconds).
+    Returns the number of rows copied.
+    """
+    source = shard_of_course(course_id)
+    if source == target:
+        return 0
+    if not 0 <= target < SHARDS:
+        raise ValueError(f"no shard {target} (have {SHARDS})")
+    init()
+    # Hold the source's write lock so nothing lands there between copy and delete.
+    src = db.connect(shard_path(source))
+    dst = db.connect(shard_path(target))
+    try:
+        src.execute("BEGIN IMMEDIATE")
+        dst.execute("ATTACH DATABASE ? AS src", (shard_path(source),))
+        with dst:
+            copied = _copy_course(dst, course_id)
+        dst.execute("DETACH DATABASE src")
+
+        if source == 0:
+            # src is the catalog and holds its write lock: switch with the delete.
+            _set_shard(src, course_id, target)
+        else:
+            with using(0), db.transaction() as c:
+                _set_shard(c, course_id, target)
+        _delete_course(src, course_id)
+        src.commit()
+        cache.bump("course_shards", *COURSE_TABLES)
+    finally:
+        if src.in_transaction:
+            src.rollback()
+        src.close()
+        dst.close()
+    _reindex_answers(course_id, target)
+    return copied
+
+
+def _set_shard(c, course_id, shard):
+    if shard:
+        c.execute("INSERT OR REPLACE INTO course_shards (course_id, shard) VALUES (?, ?)", (course_id, shard))
+    else:
+        c.execute("DELETE FROM course_shards WHERE course_id = ?", (course_id,))
+
+
+def _columns(conn, schema, table, skip=()):
+    rows = conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()
+    return [row[1] for row in rows if row[1] not in skip]
+
+
+def _copy_course(dst, course_id):
+    """Copy a course's rows from attached `src` into `dst`; safe to repeat."""
+    copied = 0
+    for table in COURSE_TABLES:
+        # Items keep their (catalog-unique) ids; the rest are renumbered.
+        skip = () if table in ITEM_TABLES else ("id",)
+        names = ", ".join(_columns(dst, "main", table, skip))
+        if table in ("submissions", "exam_submissions"):
+            fk, items = ("assignment_id", "assignments") if table == "submissions" else ("exam_id", "exams")
+            where = f"{fk} IN (SELECT id FROM src.{items} WHERE course_id = ?)"
+        else:
+            where = "course_id = ?"
+        cur = dst.execute(f"INSERT OR IGNORE INTO main.{table} ({names}) "
+                          f"SELECT {names} FROM src.{table} WHERE {where}", (course_id,))
+        copied += cur.rowcount
+    return copied
+
+
+def _delete_course(src, course_id):
+    """Remove a course's rows (and derived state) from the shard it left."""
+    for kind, (table, items, fk) in migrations.GRADED_TABLES.items():
+        for state in ("answer_matches", "answer_buckets", "answer_signatures"):
+            src.execute(f"DELETE FROM {state} WHERE kind = ? AND item_id IN "
+                        f"(SELECT id FROM {items} WHERE course_id = ?)", (kind, course_id))
+        src.execute(f"DELETE FROM {table} WHERE {fk} IN (SELECT id FROM {items} WHERE course_id = ?)",
+                    (course_id,))
+    for table in ("enrollments", "assignments", "exams", "notes", "course_stats", "student_course_stats"):
+        src.execute(f"DELETE FROM {table} WHERE course_id = ?", (course_id,))
+
+
+def _reindex_answers(course_id, shard):
+    """Recompute copy detection for a moved course (submission ids changed)."""
+    try:
+        import similarity
+    except ImportError:
+        return
+    with using(shard):
+        for kind, (_, items, _) in migrations.GRADED_TABLES.items():
+            with db.cursor() as c:
+                c.execute(f"SELECT id FROM {items} WHERE course_id = ?", (course_id,))
+                ids = [row[0] for row in c.fetchall()]
+            similarity.reindex_items(kind, ids)
+
+
+def rebalance(tolerance=0.1, dry_run=False):
+    """Plan and (unless dry_run) apply moves; returns the plan."""
+    moves = plan_rebalance(tolerance)
+    if not dry_run:
+        for course_id, _, target, _ in moves:
+            move_course(course_id, target)
+    return moves
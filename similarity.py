@@ -0,0 +1,396 @@
+# similarity.py
+"""
+Near-duplicate answer detection with MinHash and LSH.
+
+Each answer is normalised, cut into overlapping SHINGLE-character pieces and
+reduced to a NUM_PERM-value MinHash signature with NumPy. The fraction of
+equal values in two signatures estimates the Jaccard similarity of their
+shingle sets. Signatures are split into BANDS bands of ROWS values; answers
+to the same assignment or exam that share a band hash become candidates, so
+a new answer is compared with a handful of neighbours instead of every
+other submission. Pairs at or above STORE_SIMILARITY are kept in
+answer_matches for the teacher report.
+
+The hash parameters come from a fixed seed: signatures stored by one
+process stay comparable with those computed by the next.
+
+Submissions are indexed off the request path: once the group-commit writer
+has committed an answer it is queued on the AnswerIndexer of its database
+file, which indexes whatever has queued up in short transactions (at most
+MAX_HOLD seconds each, then as long again with the lock released) and
+retries when the database is busy.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import db
+from migrations import GRADED_TABLES
+
+SHINGLE = 5              # characters per shingle
+NUM_PERM = 128           # MinHash values per signature
+BANDS = 16               # LSH bands; BANDS * ROWS == NUM_PERM
+ROWS = NUM_PERM // BANDS
+STORE_SIMILARITY = 0.5   # pairs below this are not recorded
+REPORT_SIMILARITY = 0.8
+SEED = 20240601
+INDEX_BATCH = 256        # answers taken off the queue at a time
+MAX_HOLD = 0.02          # seconds an indexing transaction may hold the write lock
+INDEX_PENDING = 20000    # queued answers before the group-commit writer waits
+BUSY_RETRIES = 6
+BUSY_BACKOFF = 0.05      # seconds before the first retry; doubles each attempt
+
+log = logging.getLogger("lms.similarity")
+
+
+_rng = np.random.default_rng(SEED)
+_SHINGLE_WEIGHTS = _rng.integers(1, 2**63, SHINGLE, dtype=np.uint64) | np.uint64(1)
+_A = _rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+_BAND_WEIGHTS = _rng.integers(1, 2**63, ROWS, dtype=np.uint64) | np.uint64(1)
+_SHIFT = np.uint64(32)
+
+
+# ---------------- SIGNATURES -----------------
+def shingles(text):
+    """64-bit hashes of the distinct SHINGLE-character windows of `text`."""
+    data = " ".join((text or "").lower().split()).encode("utf-8")
+    if len(data) < SHINGLE:
+        return np.empty(0, dtype=np.uint64)
+    windows = sliding_window_view(np.frombuffer(data, dtype=np.uint8), SHINGLE)
+    return np.unique(windows.astype(np.uint64) @ _SHINGLE_WEIGHTS)
+
+
+def signature(text):
+    """
+    MinHash signature (NUM_PERM uint32 values) of an answer, or None when it
+    is too short to compare. Each permutation is a multiply-shift hash.
+    """
+    x = shingles(text)
+    if not len(x):
+        return None
+    hashed = (_A[:, None] * x[None, :] + _B[:, None]) >> _SHIFT
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def bands(sig):
+    """One signed 64-bit bucket key per band, ready to store in SQLite."""
+    keys = sig.reshape(BANDS, ROWS).astype(np.uint64) @ _BAND_WEIGHTS
+    return keys.view(np.int64).tolist()
+
+
+def similarity(sig, others):
+    """Estimated Jaccard similarity of `sig` to each row of `others`."""
+    return (np.asarray(others) == sig).mean(axis=1)
+
+
+def _pack(sig):
+    return sig.astype("<u4").tobytes()
+
+
+def _unpack(blob):
+    return np.frombuffer(blob, dtype="<u4")
+
+
+# ---------------- INCREMENTAL -----------------
+def index_answer(kind, student_id, item_id, answer):
+    """
+    (Re)index one student's answer to an assignment or exam after it was
+    written: drop its old buckets and matches, store the new signature and
+    record matches against the LSH candidates. Returns the matches found as
+    (other_submission_id, similarity).
+    """
+    with db.transaction() as c:
+        return _index(c, kind, student_id, item_id, answer)
+
+
+def _index(c, kind, student_id, item_id, answer):
+    table, _, fk = GRADED_TABLES[kind]
+    sig = signature(answer)
+    c.execute(f"SELECT id FROM {table} WHERE student_id = ? AND {fk} = ?", (student_id, item_id))
+    row = c.fetchone()
+    if row is None:
+        return []
+    sid = row[0]
+    _forget(c, kind, sid)
+    if sig is None:
+        return []
+
+    keys = bands(sig)
+    c.execute("INSERT INTO answer_signatures VALUES (?, ?, ?, ?)", (kind, sid, item_id, _pack(sig)))
+    c.executemany("INSERT OR IGNORE INTO answer_buckets VALUES (?, ?, ?, ?, ?)",
+                  ((kind, item_id, band, key, sid) for band, key in enumerate(keys)))
+    c.execute(f"""
+        SELECT s.submission_id, s.signature
+        FROM answer_signatures s
+        WHERE s.kind = ?1 AND s.submission_id IN (
+            SELECT b.submission_id FROM answer_buckets b
+            WHERE b.kind = ?1 AND b.item_id = ?2 AND b.submission_id != ?3
+              AND ({" OR ".join("(b.band = ? AND b.bucket = ?)" for _ in keys)}))
+    """, (kind, item_id, sid, *[v for band, key in enumerate(keys) for v in (band, key)]))
+    candidates = c.fetchall()
+    if not candidates:
+        return []
+    scores = similarity(sig, [_unpack(blob) for _, blob in candidates])
+    matches = [(other, float(score)) for (other, _), score in zip(candidates, scores)
+               if score >= STORE_SIMILARITY]
+    c.executemany("INSERT OR REPLACE INTO answer_matches VALUES (?, ?, ?, ?, ?)",
+                  ((kind, item_id, min(sid, other), max(sid, other), score) for other, score in matches))
+    return matches
+
+
+def _forget(c, kind, sid):
+    """Remove a submission's signature, buckets and matches."""
+    c.execute("SELECT item_id, signature FROM answer_signatures WHERE kind = ? AND submission_id = ?",
+              (kind, sid))
+    old = c.fetchone()
+    if old is None:
+        return
+    item_id, blob = old
+    c.executemany("""DELETE FROM answer_buckets
+                     WHERE kind = ? AND item_id = ? AND band = ? AND bucket = ? AND submission_id = ?""",
+                  ((kind, item_id, band, key, sid) for band, key in enumerate(bands(_unpack(blob)))))
+    c.execute("DELETE FROM answer_signatures WHERE kind = ? AND submission_id = ?", (kind, sid))
+    c.execute("DELETE FROM answer_matches WHERE kind = ? AND submission_a = ?", (kind, sid))
+    c.execute("DELETE FROM answer_matches WHERE kind = ? AND submission_b = ?", (kind, sid))
+
+
+# ---------------- BACKGROUND INDEXER -----------------
+def _busy(error):
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
+
+
+class AnswerIndexer(threading.Thread):
+    """Daemon thread indexing committed answers of one database file in batches."""
+
+    def __init__(self, path, max_batch=INDEX_BATCH, max_pending=INDEX_PENDING):
+        super().__init__(name="answer-indexer", daemon=True)
+        self.path = path
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.batches = 0
+        self.indexed = 0
+        self.failed = 0
+
+    def submit(self, kind, student_id, item_id, answer):
+        """Queue one committed answer; blocks while INDEX_PENDING answers wait."""
+        self._queue.put((kind, student_id, item_id, answer))
+
+    def run(self):
+        conn = db.connect(self.path)
+        try:
+            while True:
+                item = self._queue.get()
+                batch, stop = [item], item is None
+                while not stop and len(batch) < self.max_batch:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+                    stop = item is None
+                answers = {}   # a resubmission in the same batch supersedes the earlier answer
+                for kind, student_id, item_id, answer in filter(None, batch):
+                    answers[(kind, student_id, item_id)] = answer
+                if answers:
+                    self._index_batch(conn, answers)
+                for _ in batch:
+                    self._queue.task_done()
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _index_batch(self, conn, answers):
+        items, attempt = list(answers.items()), 0
+        while items:
+            started = time.monotonic()
+            try:
+                done = self._commit(conn, items)
+            except Exception as e:
+                if _busy(e) and attempt < BUSY_RETRIES:
+                    time.sleep(BUSY_BACKOFF * 2 ** attempt)
+                    attempt += 1
+                    continue
+                self._index_each(conn, items)
+                return
+            attempt = 0
+            self.batches += 1
+            self.indexed += done
+            items = items[done:]
+            # Leave the write lock free for as long as we held it, so the
+            # group-commit writer is never starved by a backlog of answers.
+            time.sleep(time.monotonic() - started)
+
+    def _index_each(self, conn, items):
+        # Not a busy database, or busy for too long: one transaction per answer
+        # so a bad one only loses itself. `manage.py index-answers` repairs the rest.
+        for key, answer in items:
+            try:
+                self._commit(conn, [(key, answer)])
+                self.indexed += 1
+            except Exception as e:
+                self.failed += 1
+                log.warning("could not index %s answer of student %s to item %s: %s", *key, e)
+
+    @staticmethod
+    def _commit(conn, items):
+        """Index answers from `items` for up to MAX_HOLD seconds in one transaction; returns how many."""
+        conn.execute("BEGIN IMMEDIATE")   # take the write lock up front; busy waits happen here
+        try:
+            c = conn.cursor()
+            deadline = time.monotonic() + MAX_HOLD
+            done = 0
+            for (kind, student_id, item_id), answer in items:
+                _index(c, kind, student_id, item_id, answer)
+                done += 1
+                if time.monotonic() >= deadline:
+                    break
+            conn.commit()
+            return done
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def flush(self):
+        """Block until every answer queued so far is indexed."""
+        self._queue.join()
+
+    def stop(self):
+        """Index everything already queued, then end the thread."""
+        self._queue.put(None)
+        self.join()
+
+
+_indexers = {}   # database path -> indexer
+_indexer_lock = threading.Lock()
+
+
+def get_indexer(path=None):
+    """Return the indexer for `path` (default: this thread's database), starting it on first use."""
+    path = path or db.get_pool().path
+    indexer = _indexers.get(path)
+    if indexer is None or not indexer.is_alive():
+        with _indexer_lock:
+            indexer = _indexers.get(path)
+            if indexer is None or not indexer.is_alive():
+                indexer = _indexers[path] = AnswerIndexer(path)
+                indexer.start()
+    return indexer
+
+
+def stop_indexer():
+    """Index everything queued and stop every indexer."""
+    with _indexer_lock:
+        for indexer in _indexers.values():
+            indexer.stop()
+        _indexers.clear()
+
+
+# ---------------- REBUILD -----------------
+def rebuild(kind, batch=20000):
+    """
+    Recompute every signature, bucket and match for one kind from scratch,
+    comparing candidates in memory per item. Returns (answers, matches).
+    """
+    table, _, fk = GRADED_TABLES[kind]
+    answers = pairs = 0
+    with db.transaction() as c:
+        for name in ("answer_matches", "answer_buckets", "answer_signatures"):
+            c.execute(f"DELETE FROM {name} WHERE kind = ?", (kind,))
+
+        reader = c.connection.cursor()   # c itself is busy writing each item
+        reader.execute(f"SELECT id, {fk}, answer FROM {table} ORDER BY {fk}, id")
+        item, sids, sigs = None, [], []
+        while True:
+            rows = reader.fetchmany(batch)
+            for sid, item_id, answer in rows:
+                if item_id != item and sids:
+                    pairs += _store_item(c, kind, item, sids, sigs)
+                    sids, sigs = [], []
+                item = item_id
+                sig = signature(answer)
+                if sig is not None:
+                    sids.append(sid)
+                    sigs.append(sig)
+                    answers += 1
+            if not rows:
+                break
+        if sids:
+            pairs += _store_item(c, kind, item, sids, sigs)
+    return answers, pairs
+
+
+def reindex_items(kind, item_ids):
+    """Recompute signatures, buckets and matches of some items only; returns (answers, matches)."""
+    table, _, fk = GRADED_TABLES[kind]
+    answers = pairs = 0
+    with db.transaction() as c:
+        for item_id in item_ids:
+            for name in ("answer_matches", "answer_buckets", "answer_signatures"):
+                c.execute(f"DELETE FROM {name} WHERE kind = ? AND item_id = ?", (kind, item_id))
+            c.execute(f"SELECT id, answer FROM {table} WHERE {fk} = ? ORDER BY id", (item_id,))
+            sids, sigs = [], []
+            for sid, answer in c.fetchall():
+                sig = signature(answer)
+                if sig is not None:
+                    sids.append(sid)
+                    sigs.append(sig)
+            if sids:
+                answers += len(sids)
+                pairs += _store_item(c, kind, item_id, sids, sigs)
+    return answers, pairs
+
+
+def _store_item(c, kind, item_id, sids, sigs):
+    """Write one item's signatures and buckets, and match its LSH candidates."""
+    sigs = np.vstack(sigs)
+    keys = (sigs.reshape(len(sids), BANDS, ROWS).astype(np.uint64) @ _BAND_WEIGHTS).view(np.int64)
+    c.executemany("INSERT INTO answer_signatures VALUES (?, ?, ?, ?)",
+                  ((kind, sid, item_id, _pack(sig)) for sid, sig in zip(sids, sigs)))
+    c.executemany("INSERT OR IGNORE INTO answer_buckets VALUES (?, ?, ?, ?, ?)",
+                  ((kind, item_id, band, key, sid)
+                   for sid, row in zip(sids, keys.tolist()) for band, key in enumerate(row)))
+
+    candidates = set()
+    for band in range(BANDS):
+        buckets = {}
+        for i, key in enumerate(keys[:, band].tolist()):
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            candidates.update((a, b) for n, a in enumerate(members) for b in members[n + 1:])
+    if not candidates:
+        return 0
+    left, right = np.array(sorted(candidates)).T
+    scores = (sigs[left] == sigs[right]).mean(axis=1)
+    keep = scores >= STORE_SIMILARITY
+    c.executemany("INSERT OR REPLACE INTO answer_matches VALUES (?, ?, ?, ?, ?)",
+                  ((kind, item_id, sids[a], sids[b], s)
+                   for a, b, s in zip(left[keep].tolist(), right[keep].tolist(), scores[keep].tolist())))
+    return int(keep.sum())
+
+
+# ---------------- REPORT -----------------
+def suspicious_pairs(kind, item_id, min_similarity=REPORT_SIMILARITY):
+    """
+    Pairs of answers to one assignment or exam that look copied, most
+    similar first, as (student_a, student_b, similarity, submission_a, submission_b).
+    """
+    table, _, _ = GRADED_TABLES[kind]
+    with db.cursor() as c:
+        c.execute(f"""
+            SELECT ua.username, ub.username, m.similarity, m.submission_a, m.submission_b
+            FROM answer_matches m
+            JOIN {table} sa ON sa.id = m.submission_a
+            JOIN {table} sb ON sb.id = m.submission_b
+            LEFT JOIN users ua ON ua.id = sa.student_id
+            LEFT JOIN users ub ON ub.id = sb.student_id
+            WHERE m.kind = ? AND m.item_id = ? AND m.similarity >= ?
+            ORDER BY m.similarity DESC, m.submission_a, m.submission_b
+        """, (kind, item_id, min_similarity))
+        return c.fetchall()
@@ -0,0 +1,94 @@
+# storage.py
+"""
+Content-addressed upload store.
+
+Uploads are streamed to disk in CHUNK_SIZE pieces while being hashed, then
+moved to blobs/<h0h1>/<h2h3>/<sha256>.pdf. Identical files are stored once,
+and two uploads in the same second can no longer overwrite each other.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+STORE_DIR = "uploads/blobs"
+CHUNK_SIZE = 1024 * 1024
+READ_CACHE_BYTES = 64 * 1024 * 1024   # recently served files kept in memory
+
+
+def blob_path(digest, ext=".pdf"):
+    """Sharded location of a blob: two directory levels from the hash prefix."""
+    return os.path.join(STORE_DIR, digest[:2], digest[2:4], digest + ext)
+
+
+def _chunks(source):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from iter(lambda: f.read(CHUNK_SIZE), b"")
+        return
+    if hasattr(source, "seek"):
+        source.seek(0)
+    yield from iter(lambda: source.read(CHUNK_SIZE), b"")
+
+
+def store(source, ext=".pdf"):
+    """
+    Stream `source` (a path or a readable file object such as Streamlit's
+    UploadedFile) into the store. Returns (sha256, size, path).
+    """
+    os.makedirs(STORE_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=STORE_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in _chunks(source):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        sha = digest.hexdigest()
+        path = blob_path(sha, ext)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        return sha, size, path
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# ---------------- DOWNLOAD PAYLOADS -----------------
+_read_lock = threading.Lock()
+_read_cache = OrderedDict()   # (path, size, mtime) -> bytes
+_read_cache_bytes = 0
+
+
+def read_file(path):
+    """
+    Return a file's bytes for a download, served from a bounded LRU of
+    recently read files. Entries are keyed on size and mtime, so a file
+    replaced on disk is read again.
+    """
+    global _read_cache_bytes
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _read_lock:
+        data = _read_cache.get(key)
+        if data is not None:
+            _read_cache.move_to_end(key)
+            return data
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) <= READ_CACHE_BYTES:
+        with _read_lock:
+            if key not in _read_cache:
+                _read_cache[key] = data
+                _read_cache_bytes += len(data)
+            while _read_cache_bytes > READ_CACHE_BYTES:
+                _, old = _read_cache.popitem(last=False)
+                _read_cache_bytes -= len(old)
+    return data